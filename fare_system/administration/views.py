@@ -2,13 +2,14 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.models import User
 from bus.models import Bus, BusDriver  # Import Bus and BusDriver from bus app
+from students.ledger import balance, credit
 from students.models import Student
 from django.contrib.auth.models import Group
+from django.db import transaction as db_transaction
 
 
 def admin_dashboard(request):
     students = Student.objects.all()
-    print("Students:", students)  # Debug print
     drivers = BusDriver.objects.all()
     buses = Bus.objects.all()
     return render(
@@ -43,8 +44,6 @@ def add_student(request):
                 full_name=full_name,
                 student_id=student_id,
                 balance=float(balance),
-                face_encoding="",
-                face_encodings="[]",
             )
 
             messages.success(request, "Student added successfully!")
@@ -60,10 +59,23 @@ def update_student(request, student_id):
     student = get_object_or_404(Student, student_id=student_id)
 
     if request.method == "POST":
-        student.full_name = request.POST.get("full_name")
-        student.balance = float(request.POST.get("balance"))
-        student.save()
-        messages.success(request, "Student updated successfully!")
+        try:
+            new_balance = float(request.POST.get("balance"))
+            shown_balance = float(request.POST.get("shown_balance", student.balance))
+        except (TypeError, ValueError):
+            messages.error(request, "Invalid balance entered.")
+            return redirect("update_student", student_id=student_id)
+
+        with db_transaction.atomic():
+            student.full_name = request.POST.get("full_name")
+            student.save(update_fields=["full_name"])
+            # Apply the edit as a relative change, so fares charged since the
+            # form was loaded are not overwritten
+            adjustment = round(new_balance - shown_balance, 2)
+            if adjustment:
+                credit(student.pk, adjustment)
+        student.balance = balance(student.pk)
+        messages.success(request, f"Student updated successfully! Balance is now {student.balance}.")
         return redirect("admin_dashboard")
 
     return render(request, "update_student.html", {"student": student})
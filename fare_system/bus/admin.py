@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Bus, BusDriver
+from .models import Bus, BusDriver, SyncedBoarding
 
 
 @admin.register(Bus)
@@ -14,3 +14,10 @@ class BusDriverAdmin(admin.ModelAdmin):
     list_display = ("full_name", "bus")
     search_fields = ("full_name",)
     list_filter = ("bus",)
+
+
+@admin.register(SyncedBoarding)
+class SyncedBoardingAdmin(admin.ModelAdmin):
+    list_display = ("client_id", "bus", "student", "device_timestamp", "result", "received_at")
+    search_fields = ("client_id",)
+    list_filter = ("result", "bus")
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class BusConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bus'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+
+        if settings.FACE_WARM_UP:
+            from .warmup import warm_up
+
+            warm_up.start()
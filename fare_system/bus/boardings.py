@@ -0,0 +1,95 @@
+"""Recent-boarding index behind the 30-minute re-boarding rule.
+
+The last boarding time of each student is kept in the cache until it leaves
+the re-boarding window, so repeated scans of someone who just boarded never
+reach the database. Only boardings inside the window are cached and a newer
+boarding can only extend the window, so an entry is never wrong even when
+another process charged the student since. Misses fall back to the
+``(student, timestamp)`` index on Transaction.
+"""
+
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+
+from students.models import Transaction
+
+# A student is not charged again within this window
+REBOARD_WINDOW = timedelta(minutes=30)
+
+CACHE_KEY = "last_boarding:{}"
+
+
+def _key(student_pk):
+    return CACHE_KEY.format(student_pk)
+
+
+def _timeout(timestamp):
+    """Seconds until ``timestamp`` leaves the window, or None if it already has."""
+    remaining = (timestamp + REBOARD_WINDOW - timezone.now()).total_seconds()
+    return remaining if remaining > 0 else None
+
+
+def remember(student_pk, timestamp):
+    """Cache a boarding time for as long as it falls inside the window."""
+    timeout = _timeout(timestamp)
+    if timeout is not None:
+        cache.set(_key(student_pk), timestamp, timeout)
+
+
+def forget(student_pk):
+    cache.delete(_key(student_pk))
+
+
+def _recent(student_pks):
+    return Transaction.objects.filter(
+        student_id__in=student_pks, timestamp__gte=timezone.now() - REBOARD_WINDOW
+    )
+
+
+def last_boarding(student_pk):
+    """Return the student's boarding time inside the window, or None."""
+    timestamp = cache.get(_key(student_pk))
+    if timestamp is None:
+        timestamp = (
+            _recent([student_pk]).order_by("-timestamp").values_list("timestamp", flat=True).first()
+        )
+        if timestamp is not None:
+            remember(student_pk, timestamp)
+    return timestamp
+
+
+async def alast_boarding(student_pk):
+    """Async counterpart of :func:`last_boarding`."""
+    timestamp = await cache.aget(_key(student_pk))
+    if timestamp is None:
+        timestamp = await (
+            _recent([student_pk]).order_by("-timestamp").values_list("timestamp", flat=True).afirst()
+        )
+        if timestamp is not None:
+            timeout = _timeout(timestamp)
+            if timeout is not None:
+                await cache.aset(_key(student_pk), timestamp, timeout)
+    return timestamp
+
+
+def last_boardings(student_pks):
+    """Return ``{student_pk: boarding time}`` for students who boarded inside the window."""
+    student_pks = list(student_pks)
+    cached = cache.get_many([_key(pk) for pk in student_pks])
+    found = {pk: cached[_key(pk)] for pk in student_pks if _key(pk) in cached}
+
+    missing = [pk for pk in student_pks if pk not in found]
+    if missing:
+        fetched = dict(
+            _recent(missing)
+            .values("student_id")
+            .annotate(last=Max("timestamp"))
+            .values_list("student_id", "last")
+        )
+        for pk, timestamp in fetched.items():
+            remember(pk, timestamp)
+        found.update(fetched)
+    return found
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends whose entries are not seen by other server processes
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches)
+def idempotency_cache_check(app_configs, **kwargs):
+    """Warn when Idempotency-Key claims cannot be shared between processes."""
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            "The default cache is not shared between processes, so a kiosk "
+            "retry handled by another server process may be charged twice.",
+            hint=(
+                "Point CACHES['default'] at a shared cache such as Redis or "
+                "Memcached, or add 'bus.W001' to SILENCED_SYSTEM_CHECKS when "
+                "serving from a single process."
+            ),
+            id="bus.W001",
+        )
+    ]
@@ -0,0 +1,97 @@
+"""Sampled recognition diagnostics kept in a bounded in-memory ring buffer.
+
+With ``FACE_DIAGNOSTICS_ENABLED`` a random ``FACE_DIAGNOSTICS_SAMPLE_RATE``
+share of recognized frames is searched again for its
+``FACE_DIAGNOSTICS_TOP_K`` closest students and the result is appended to a
+buffer of the last ``FACE_DIAGNOSTICS_BUFFER_SIZE`` samples. Nothing is
+written to stdout; staff inspect the buffer through ``recognition_diagnostics``.
+"""
+
+import random
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.utils import timezone
+
+from students.gallery import MATCH_THRESHOLD, gallery
+
+# Rows fetched per requested student, since a student has several encodings
+ROWS_PER_STUDENT = 5
+
+
+def top_students(encoding, k):
+    """Return the ``k`` closest distinct students as ``[(student_pk, distance)]``."""
+    students = {}
+    for student_pk, distance in gallery.search(encoding, k=k * ROWS_PER_STUDENT):
+        students.setdefault(student_pk, distance)
+        if len(students) == k:
+            break
+    return list(students.items())
+
+
+def is_near_miss(candidates):
+    """True if a frame was rejected, or a second student was also under the threshold."""
+    if not candidates:
+        return False
+    return candidates[0][1] > MATCH_THRESHOLD or (
+        len(candidates) > 1 and candidates[1][1] <= MATCH_THRESHOLD
+    )
+
+
+class DiagnosticsBuffer:
+    """Fixed-size ring buffer of sampled top-k candidate lists."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = None
+
+    def _buffer(self):
+        with self._lock:
+            if self._samples is None:
+                self._samples = deque(maxlen=settings.FACE_DIAGNOSTICS_BUFFER_SIZE)
+            return self._samples
+
+    def sampled(self):
+        """Decide whether the current frame should be recorded."""
+        return (
+            settings.FACE_DIAGNOSTICS_ENABLED
+            and random.random() < settings.FACE_DIAGNOSTICS_SAMPLE_RATE
+        )
+
+    def record(self, encoding, bus_id, escalated=False):
+        """Store the top-k candidates of a sampled frame's final encoding."""
+        candidates = top_students(encoding, settings.FACE_DIAGNOSTICS_TOP_K)
+        sample = {
+            "time": timezone.now().isoformat(),
+            "bus": bus_id,
+            "escalated": escalated,
+            "near_miss": is_near_miss(candidates),
+            "candidates": [
+                {"student": student_pk, "distance": round(distance, 4)}
+                for student_pk, distance in candidates
+            ],
+        }
+        buffer = self._buffer()
+        with self._lock:
+            buffer.append(sample)
+
+    def report(self, near_misses_only=True, bus_id=None):
+        """Return the buffered samples, newest first."""
+        buffer = self._buffer()
+        with self._lock:
+            samples = list(buffer)
+        samples.reverse()
+        if near_misses_only:
+            samples = [sample for sample in samples if sample["near_miss"]]
+        if bus_id is not None:
+            samples = [sample for sample in samples if sample["bus"] == bus_id]
+        return {
+            "enabled": settings.FACE_DIAGNOSTICS_ENABLED,
+            "sample_rate": settings.FACE_DIAGNOSTICS_SAMPLE_RATE,
+            "buffered": len(buffer),
+            "samples": samples,
+        }
+
+
+diagnostics = DiagnosticsBuffer()
@@ -0,0 +1,92 @@
+"""Per-bus hot sets of regular riders, searched before the full face gallery."""
+
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from students.gallery import MATCH_THRESHOLD, gallery
+from students.models import Transaction
+
+
+class RouteHotSets:
+    """Match a frame against a bus's regular riders first.
+
+    A bus's hot set is every student recognized on that bus in the last
+    ``FACE_HOT_SET_DAYS`` days. Its encodings are cached as a small matrix for
+    ``FACE_HOT_SET_TTL`` seconds, or until the gallery layout changes. The
+    gallery is synced first, so changes made by other workers drop a cached
+    set as soon as the gallery sees them. Only frames with no hot-set
+    candidate under the threshold fall back to a full gallery search.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sets = {}
+        self.stats = {"hot_hits": 0, "full_scans": 0, "no_bus": 0}
+
+    def _hot_set(self, bus_id):
+        # Pull deletes and re-enrollments made by other workers before
+        # trusting a cached set
+        gallery.ensure_loaded()
+        now = time.monotonic()
+        cached = self._sets.get(bus_id)
+        if (
+            cached is not None
+            and cached["expires"] > now
+            and cached["generation"] == gallery.generation
+        ):
+            return cached
+
+        since = timezone.now() - timedelta(days=settings.FACE_HOT_SET_DAYS)
+        student_pks = list(
+            Transaction.objects.filter(bus_id=bus_id, timestamp__gte=since)
+            .values_list("student_id", flat=True)
+            .distinct()
+        )
+        vectors, student_ids, generation = gallery.subset(student_pks)
+        cached = {
+            "vectors": vectors,
+            "student_ids": student_ids,
+            "generation": generation,
+            "expires": now + settings.FACE_HOT_SET_TTL,
+        }
+        with self._lock:
+            self._sets[bus_id] = cached
+        return cached
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def match(self, encoding, bus_id):
+        """Return ``(student_pk, distance)`` like ``FaceGallery.match``."""
+        if bus_id is None:
+            self._count("no_bus")
+            return gallery.match(encoding)
+
+        hot = self._hot_set(bus_id)
+        if len(hot["student_ids"]):
+            distances = np.linalg.norm(hot["vectors"] - encoding, axis=1)
+            row = int(np.argmin(distances))
+            if distances[row] <= MATCH_THRESHOLD:
+                self._count("hot_hits")
+                return int(hot["student_ids"][row]), float(distances[row])
+
+        self._count("full_scans")
+        return gallery.match(encoding)
+
+    def report(self):
+        """Return the counters plus the share of bus scans answered by a hot set."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["hot_sets_cached"] = len(self._sets)
+        bus_scans = stats["hot_hits"] + stats["full_scans"]
+        stats["hot_hit_rate"] = stats["hot_hits"] / bus_scans if bus_scans else 0.0
+        return stats
+
+
+hot_sets = RouteHotSets()
@@ -0,0 +1,128 @@
+"""Idempotency keys for kiosk captures.
+
+The kiosk sends each capture with an ``Idempotency-Key`` header and reuses
+the key when it resends that capture after a timeout or network error. The
+first request claims the key in the cache; a duplicate is answered from the
+stored response before any image is decoded, so a retry costs neither an
+encoding nor a second fare. A duplicate that arrives while the original is
+still being processed gets a short 409 and retries. Responses other than
+200 (e.g. a busy pool) release the key so the retry does the work.
+
+Keys are scoped to the requesting user and live in the default cache for
+``FARE_IDEMPOTENCY_TTL`` seconds. With several server processes that cache
+must be shared (e.g. Redis or Memcached) for a retry landing on another
+process to be absorbed; the ``bus.W001`` system check warns when it is not.
+"""
+
+import re
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from .metrics import bus_label, recognition_outcomes
+
+HEADER = "Idempotency-Key"
+CACHE_KEY = "recognize_capture:{}:{}"
+IN_PROGRESS = "in-progress"
+
+# Client-generated; a UUID or similar. Anything else is ignored.
+KEY_PATTERN = re.compile(r"[A-Za-z0-9_.:-]{1,64}")
+
+
+def request_key(request, user):
+    """Cache key for the request's idempotency key, or None if it has none.
+
+    Keys are chosen by the client, so they are scoped to ``user`` to keep two
+    drivers from colliding on the same key.
+    """
+    key = request.headers.get(HEADER, "")
+    if request.method != "POST" or not KEY_PATTERN.fullmatch(key):
+        return None
+    return CACHE_KEY.format(user.pk if user.is_authenticated else "anonymous", key)
+
+
+def in_progress_response():
+    response = JsonResponse({
+        "status": "busy",
+        "message": "This capture is still being processed. Retrying shortly...",
+        "retry": True,
+        "continue": True
+    }, status=409)
+    response["Retry-After"] = "1"
+    return response
+
+
+def replay(stored, bus_id):
+    """Rebuild a response from ``stored``, or None if the key is unclaimed.
+
+    Counted as the "replayed" outcome, or "in_progress" while the original
+    request is still running, under the bus of the requesting driver.
+    """
+    if stored is None:
+        return None
+    if stored == IN_PROGRESS:
+        recognition_outcomes.labels("in_progress", bus_label(bus_id)).inc()
+        return in_progress_response()
+    recognition_outcomes.labels("replayed", bus_label(bus_id)).inc()
+    status, content = stored
+    response = HttpResponse(content, status=status, content_type="application/json")
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(view):
+    """Answer repeated requests with the same ``Idempotency-Key`` from the cache."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if HEADER not in request.headers:
+                return await view(request, *args, **kwargs)
+            user = await request.auser()
+            key = request_key(request, user)
+            if key is None:
+                return await view(request, *args, **kwargs)
+            if not await cache.aadd(key, IN_PROGRESS, settings.FARE_IDEMPOTENCY_TTL):
+                from .views import driver_bus_id
+
+                bus_id = await sync_to_async(driver_bus_id)(user)
+                response = replay(await cache.aget(key), bus_id)
+                if response is not None:
+                    return response
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await cache.adelete(key)
+                raise
+            if response.status_code == 200:
+                await cache.aset(key, (200, response.content), settings.FARE_IDEMPOTENCY_TTL)
+            else:
+                await cache.adelete(key)
+            return response
+        return wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request_key(request, request.user)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not cache.add(key, IN_PROGRESS, settings.FARE_IDEMPOTENCY_TTL):
+            from .views import driver_bus_id
+
+            response = replay(cache.get(key), driver_bus_id(request.user))
+            if response is not None:
+                return response
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            cache.delete(key)
+            raise
+        if response.status_code == 200:
+            cache.set(key, (200, response.content), settings.FARE_IDEMPOTENCY_TTL)
+        else:
+            cache.delete(key)
+        return response
+    return wrapper
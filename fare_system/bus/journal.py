@@ -0,0 +1,124 @@
+"""On-bus journal of boardings recorded while offline.
+
+With ``FARE_OFFLINE_JOURNAL`` set to a file path, a bus running the app
+locally records each recognized boarding in this SQLite file instead of
+charging it, and ``manage.py sync_boardings`` later uploads the journal to
+the central server. Every entry gets a UUID and the device timestamp when it
+is recorded, which makes uploads safe to retry.
+"""
+
+import sqlite3
+import threading
+import uuid
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .boardings import REBOARD_WINDOW
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boardings (
+    id TEXT PRIMARY KEY,
+    student INTEGER NOT NULL,
+    device_timestamp TEXT NOT NULL,
+    distance REAL,
+    result TEXT,
+    synced_at TEXT
+);
+CREATE INDEX IF NOT EXISTS boardings_student_time ON boardings (student, device_timestamp);
+CREATE INDEX IF NOT EXISTS boardings_unsynced ON boardings (synced_at, device_timestamp);
+"""
+
+
+def _stamp(moment):
+    # Fixed-width UTC ISO 8601, so timestamps compare correctly as text
+    return moment.astimezone(dt_timezone.utc).isoformat(timespec="microseconds")
+
+
+class BoardingJournal:
+    """Append-only SQLite journal; one short-lived connection per call."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        if not self._ready:
+            with self._lock:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(SCHEMA)
+                self._ready = True
+        return db
+
+    def record(self, student_pk, distance=None):
+        """Journal a boarding now; returns its UUID."""
+        client_id = str(uuid.uuid4())
+        db = self._connect()
+        try:
+            with db:
+                db.execute(
+                    "INSERT INTO boardings (id, student, device_timestamp, distance) VALUES (?, ?, ?, ?)",
+                    (client_id, student_pk, _stamp(timezone.now()), distance),
+                )
+        finally:
+            db.close()
+        return client_id
+
+    def last_boarding(self, student_pk):
+        """Latest journaled boarding of a student inside the re-boarding window."""
+        since = _stamp(timezone.now() - REBOARD_WINDOW)
+        db = self._connect()
+        try:
+            row = db.execute(
+                "SELECT max(device_timestamp) FROM boardings WHERE student = ? AND device_timestamp >= ?",
+                (student_pk, since),
+            ).fetchone()
+        finally:
+            db.close()
+        return parse_datetime(row[0]) if row and row[0] else None
+
+    def pending(self, limit):
+        """Oldest entries not yet accepted by the server."""
+        db = self._connect()
+        try:
+            rows = db.execute(
+                "SELECT id, student, device_timestamp FROM boardings "
+                "WHERE synced_at IS NULL ORDER BY device_timestamp LIMIT ?",
+                (limit,),
+            ).fetchall()
+        finally:
+            db.close()
+        return [
+            {"id": client_id, "student": student, "timestamp": timestamp}
+            for client_id, student, timestamp in rows
+        ]
+
+    def mark_synced(self, results):
+        """Store the server's per-item results; synced entries are not uploaded again."""
+        now = _stamp(timezone.now())
+        db = self._connect()
+        try:
+            with db:
+                db.executemany(
+                    "UPDATE boardings SET result = ?, synced_at = ? WHERE id = ?",
+                    [(result["result"], now, result["id"]) for result in results if result.get("id")],
+                )
+        finally:
+            db.close()
+
+
+_journal = None
+
+
+def get_journal():
+    """The journal at ``FARE_OFFLINE_JOURNAL``, or None when on-bus mode is off."""
+    global _journal
+    if not settings.FARE_OFFLINE_JOURNAL:
+        return None
+    if _journal is None or _journal.path != str(settings.FARE_OFFLINE_JOURNAL):
+        _journal = BoardingJournal(settings.FARE_OFFLINE_JOURNAL)
+    return _journal
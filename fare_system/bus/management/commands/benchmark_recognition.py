@@ -0,0 +1,223 @@
+import base64
+import io
+import json
+import platform
+import time
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from PIL import Image
+
+from bus.boardings import REBOARD_WINDOW, forget, last_boarding, remember
+from bus.recognition import FARE_AMOUNT
+from students import faces
+from students.gallery import ENCODING_SIZE, FaceGallery
+from students.ledger import charge_fare
+from students.models import Student, Transaction
+
+# Synthetic students are generated this many at a time, bounds temporary memory
+STUDENT_CHUNK = 20000
+
+
+class SyntheticGallery(FaceGallery):
+    """A gallery filled from generated arrays that never talks to the database."""
+
+    def fill(self, vectors, student_ids):
+        self.vectors = self._store(vectors)
+        self.student_ids = student_ids
+        self.encoding_ids = np.arange(len(student_ids), dtype=np.int64)
+        self.centroids = self._build_centroids(self.vectors, student_ids)
+        self.loaded = True
+
+    def sync(self, force=False):
+        pass
+
+
+def synthetic_encodings(size, angles, rng):
+    """Clustered encodings, ``angles`` rows per student, like enrolled data."""
+    students = -(-size // angles)
+    vectors = np.empty((students * angles, ENCODING_SIZE), dtype=np.float64)
+    for start in range(0, students, STUDENT_CHUNK):
+        count = min(STUDENT_CHUNK, students - start)
+        centers = rng.normal(0, 0.15, (count, ENCODING_SIZE))
+        rows = slice(start * angles, (start + count) * angles)
+        vectors[rows] = np.repeat(centers, angles, axis=0)
+        vectors[rows] += rng.normal(0, 0.03, (count * angles, ENCODING_SIZE))
+    student_ids = np.repeat(np.arange(students, dtype=np.int64), angles)
+    return vectors[:size], student_ids[:size]
+
+
+def summarize(timings):
+    """Latency summary in milliseconds."""
+    timings = np.asarray(timings) * 1000
+    return {
+        "n": len(timings),
+        "mean_ms": round(float(np.mean(timings)), 4),
+        "p50_ms": round(float(np.percentile(timings, 50)), 4),
+        "p95_ms": round(float(np.percentile(timings, 95)), 4),
+        "min_ms": round(float(np.min(timings)), 4),
+    }
+
+
+def timed(fn, repeat):
+    """Return ``(last result, timings)`` for ``repeat`` calls of ``fn``."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+class Command(BaseCommand):
+    help = (
+        "Time each stage of recognize_face separately (base64 decode, image "
+        "load, HOG detection, encoding, gallery match, debounce query and "
+        "Transaction write) with synthetic galleries of several sizes, and "
+        "print the results as JSON. Database stages run in a transaction that "
+        "is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--image", help="JPEG/PNG frame to use; a synthetic 640x480 frame by default.")
+        parser.add_argument(
+            "--sizes", default="1000,10000,100000,1000000",
+            help="Comma-separated synthetic gallery sizes (encodings). 1M encodings need about 1 GB.",
+        )
+        parser.add_argument("--angles", type=int, default=5, help="Encodings per synthetic student.")
+        parser.add_argument("--repeat", type=int, default=20, help="Repetitions of each image and database stage.")
+        parser.add_argument("--queries", type=int, default=200, help="Match queries per gallery size.")
+        parser.add_argument("--history", type=int, default=10000, help="Transactions seeded before the database stages.")
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        repeat = options["repeat"]
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "settings": {
+                "FACE_DETECTION_SCALE": settings.FACE_DETECTION_SCALE,
+                "FACE_FIRST_PASS_JITTERS": settings.FACE_FIRST_PASS_JITTERS,
+                "FACE_CENTROID_PRUNING": settings.FACE_CENTROID_PRUNING,
+                "FACE_GALLERY_PRECISION": settings.FACE_GALLERY_PRECISION,
+            },
+            "stages": self.image_stages(options["image"], repeat),
+            "match": {},
+        }
+
+        for size in [int(size) for size in options["sizes"].split(",")]:
+            report["match"][str(size)] = self.match_stage(size, options["angles"], options["queries"], rng)
+
+        report["stages"].update(self.database_stages(options["history"], repeat, rng))
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def image_stages(self, path, repeat):
+        if path:
+            with open(path, "rb") as f:
+                image_bytes = f.read()
+        else:
+            gradient = np.add.outer(np.arange(480), np.arange(640)) % 256
+            buffer = io.BytesIO()
+            Image.fromarray(np.dstack([gradient] * 3).astype(np.uint8)).save(buffer, "JPEG")
+            image_bytes = buffer.getvalue()
+        data_url = "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode()
+
+        _, decode = timed(lambda: base64.b64decode(data_url.split(",")[1]), repeat)
+        frame, load = timed(lambda: faces.load_frame(image_bytes), repeat)
+        locations, detect = timed(
+            lambda: faces.detect_faces(frame, settings.FACE_DETECTION_SCALE), repeat
+        )
+
+        # Without a detected face, encode a centred box of typical size
+        height, width = frame.shape[:2]
+        side = min(height, width) // 2
+        location = locations[0] if locations else (
+            (height - side) // 2, (width + side) // 2, (height + side) // 2, (width - side) // 2
+        )
+        _, encode = timed(
+            lambda: faces.encode_locations(frame, [location], settings.FACE_FIRST_PASS_JITTERS),
+            repeat,
+        )
+        return {
+            "frame": {"width": width, "height": height, "bytes": len(image_bytes), "faces": len(locations)},
+            "base64_decode": summarize(decode),
+            "image_load": summarize(load),
+            "hog_detect": summarize(detect),
+            "encode": summarize(encode),
+        }
+
+    def match_stage(self, size, angles, queries, rng):
+        vectors, student_ids = synthetic_encodings(size, angles, rng)
+        gallery = SyntheticGallery()
+        start = time.perf_counter()
+        gallery.fill(vectors, student_ids)
+        build = time.perf_counter() - start
+
+        samples = rng.choice(size, min(queries, size), replace=False)
+        probes = vectors[samples] + rng.normal(0, 0.03, (len(samples), ENCODING_SIZE))
+        timings, correct = [], 0
+        for row, probe in zip(samples, probes):
+            start = time.perf_counter()
+            student_pk, _ = gallery.match(probe)
+            timings.append(time.perf_counter() - start)
+            correct += student_pk == student_ids[row]
+        del vectors
+
+        return {
+            "students": int(student_ids[-1]) + 1,
+            "build_ms": round(build * 1000, 1),
+            "gallery_mb": round(gallery.vectors.nbytes / 2**20, 1),
+            "top1_accuracy": round(correct / len(samples), 4),
+            **summarize(timings),
+        }
+
+    def database_stages(self, history, repeat, rng):
+        with db_transaction.atomic():
+            base = 900_000_000
+            users = User.objects.bulk_create(
+                User(username=f"benchmark-{base + i}") for i in range(100)
+            )
+            students = Student.objects.bulk_create(
+                Student(user=user, full_name="Benchmark", student_id=base + i, balance=1e9)
+                for i, user in enumerate(users)
+            )
+            owners = rng.integers(0, len(students), history)
+            Transaction.objects.bulk_create(
+                (Transaction(student=students[owner], amount=FARE_AMOUNT, status="Approved") for owner in owners),
+                batch_size=1000,
+            )
+            student = students[0]
+
+            # The database fallback of the recent-boarding index
+            _, debounce = timed(
+                lambda: Transaction.objects.filter(
+                    student=student, timestamp__gte=timezone.now() - REBOARD_WINDOW
+                ).order_by("-timestamp").values_list("timestamp", flat=True).first(),
+                repeat,
+            )
+            _, write = timed(lambda: charge_fare(student, FARE_AMOUNT), repeat)
+            remember(student.pk, timezone.now())
+            _, debounce_cached = timed(lambda: last_boarding(student.pk), repeat)
+            # The rolled-back primary key may be reused by a real student
+            forget(student.pk)
+            db_transaction.set_rollback(True)
+
+        return {
+            "database": {"vendor": db_transaction.get_connection().vendor, "history": history},
+            "debounce_query": summarize(debounce),
+            "debounce_cached": summarize(debounce_cached),
+            "transaction_write": summarize(write),
+        }
@@ -0,0 +1,126 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+
+class ThreadSampler:
+    """Records the peak number of live threads while a run is in progress."""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = (
+        "Post the same frame to the WSGI (recognize_face) and ASGI "
+        "(recognize_face_async) endpoints at several concurrency levels and "
+        "compare throughput, latency and threads used. Only replies with "
+        "status \"success\" (a boarded student) count towards ok/s and "
+        "latency; debounced (\"info\"), error, busy (503) and other failed "
+        "replies are counted separately. A student boarded within the last "
+        "30 minutes is answered with \"info\", so post a frame of a student "
+        "who has not boarded yet, against a scratch database: "
+        "matched faces create real Transactions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("image", help="Path to a JPEG frame to post.")
+        parser.add_argument("--requests", type=int, default=48, help="Requests per run.")
+        parser.add_argument(
+            "--concurrency", default="1,4,16", help="Comma-separated concurrency levels."
+        )
+
+    def handle(self, *args, **options):
+        with open(options["image"], "rb") as f:
+            image_data = "data:image/jpeg;base64," + base64.b64encode(f.read()).decode()
+        payload = {"image_data": image_data}
+        total = options["requests"]
+
+        self.stdout.write(
+            f"{'path':<6} {'conc':>5} {'ok/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'info':>6} {'error':>6} {'busy':>6} {'failed':>6} {'threads':>8}"
+        )
+        for concurrency in [int(c) for c in options["concurrency"].split(",")]:
+            for name, runner in (("wsgi", self.run_sync), ("asgi", self.run_async)):
+                with ThreadSampler() as sampler:
+                    start = time.perf_counter()
+                    results = runner(payload, total, concurrency)
+                    elapsed = time.perf_counter() - start
+                # Only boarded students are throughput; error payloads (no
+                # face, not recognized) also come back as 200
+                outcomes = Counter(outcome for _, outcome in results)
+                latencies = np.array([seconds for seconds, outcome in results if outcome == "success"]) * 1000
+                if len(latencies):
+                    p50, p95 = np.percentile(latencies, 50), np.percentile(latencies, 95)
+                else:
+                    p50 = p95 = float("nan")
+                failed = len(results) - sum(outcomes[o] for o in ("success", "info", "error", "busy"))
+                self.stdout.write(
+                    f"{name:<6} {concurrency:>5} {len(latencies) / elapsed:>8.1f} "
+                    f"{p50:>8.1f} {p95:>8.1f} {outcomes['info']:>6} {outcomes['error']:>6} "
+                    f"{outcomes['busy']:>6} {failed:>6} {sampler.peak:>8}"
+                )
+
+    @staticmethod
+    def outcome(response):
+        """The payload's ``status`` for 200 and 503 replies, else the HTTP status."""
+        if response.status_code not in (200, 503):
+            return str(response.status_code)
+        try:
+            return json.loads(response.content)["status"]
+        except (ValueError, KeyError, TypeError):
+            return "invalid"
+
+    def run_sync(self, payload, total, concurrency):
+        url = reverse("recognize_face")
+
+        def post(_):
+            start = time.perf_counter()
+            response = Client().post(url, payload)
+            connections.close_all()
+            return time.perf_counter() - start, self.outcome(response)
+
+        # One thread per in-flight request, as a threaded WSGI server would use
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(post, range(total)))
+
+    def run_async(self, payload, total, concurrency):
+        url = reverse("recognize_face_async")
+
+        async def main():
+            client = AsyncClient()
+            gate = asyncio.Semaphore(concurrency)
+
+            async def post():
+                async with gate:
+                    start = time.perf_counter()
+                    response = await client.post(url, payload)
+                    return time.perf_counter() - start, self.outcome(response)
+
+            return await asyncio.gather(*(post() for _ in range(total)))
+
+        return asyncio.run(main())
@@ -0,0 +1,80 @@
+import os
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bus.journal import get_journal
+
+
+class Command(BaseCommand):
+    help = (
+        "Upload boardings journaled on this bus (FARE_OFFLINE_JOURNAL) to the "
+        "central server in batches, logging in as the bus's driver. Entries "
+        "are marked synced with the server's per-item result; retrying after "
+        "a failure never charges a boarding twice."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("server", help="Base URL of the central server, e.g. https://fares.example.edu")
+        parser.add_argument("--username", default=os.environ.get("FARE_SYNC_USERNAME"), help="Driver username (or FARE_SYNC_USERNAME).")
+        parser.add_argument("--password", default=os.environ.get("FARE_SYNC_PASSWORD"), help="Driver password (or FARE_SYNC_PASSWORD).")
+        parser.add_argument("--batch-size", type=int, default=500, help="Boardings per upload.")
+        parser.add_argument("--timeout", type=float, default=30, help="Seconds per HTTP request.")
+
+    def handle(self, *args, **options):
+        journal = get_journal()
+        if journal is None:
+            raise CommandError("FARE_OFFLINE_JOURNAL is not set.")
+        if not options["username"] or not options["password"]:
+            raise CommandError("Driver credentials are required.")
+        batch_size = min(options["batch_size"], settings.FARE_SYNC_MAX_ITEMS)
+
+        server = options["server"].rstrip("/")
+        session = self.login(server, options["username"], options["password"], options["timeout"])
+
+        uploaded, outcomes = 0, {}
+        while True:
+            batch = journal.pending(batch_size)
+            if not batch:
+                break
+            try:
+                response = session.post(
+                    f"{server}/bus/sync-boardings/",
+                    json={"boardings": batch},
+                    headers={"X-CSRFToken": session.cookies.get("csrftoken", ""), "Referer": server + "/"},
+                    timeout=options["timeout"],
+                )
+                response.raise_for_status()
+                results = response.json()["results"]
+            except (requests.RequestException, ValueError, KeyError) as e:
+                raise CommandError(f"Upload failed after {uploaded} boardings, will resume next run: {e}")
+
+            journal.mark_synced(results)
+            uploaded += len(batch)
+            for result in results:
+                outcomes[result["result"]] = outcomes.get(result["result"], 0) + 1
+
+        summary = ", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+        self.stdout.write(self.style.SUCCESS(f"Synced {uploaded} boardings{': ' + summary if summary else ''}."))
+
+    def login(self, server, username, password, timeout):
+        session = requests.Session()
+        try:
+            session.get(f"{server}/users/login/", timeout=timeout).raise_for_status()
+            response = session.post(
+                f"{server}/users/login/",
+                data={
+                    "username": username,
+                    "password": password,
+                    "csrfmiddlewaretoken": session.cookies.get("csrftoken", ""),
+                },
+                headers={"Referer": f"{server}/users/login/"},
+                timeout=timeout,
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise CommandError(f"Could not log in to {server}: {e}")
+        if "sessionid" not in session.cookies:
+            raise CommandError("Login rejected; check the driver credentials.")
+        return session
@@ -0,0 +1,111 @@
+"""Prometheus metrics for the boarding and enrollment hot paths.
+
+Every recognition request records the seconds spent in each stage and its
+outcome, labelled by the driver's bus ("none" for kiosks without a logged-in
+driver). Under a multi-process server set ``PROMETHEUS_MULTIPROC_DIR`` so the
+``/metrics`` view aggregates all workers.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Seconds; spans a fast gallery match up to a jittered encode under load
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+recognition_seconds = Histogram(
+    "fare_recognition_stage_seconds",
+    "Seconds spent per recognition request in each stage, and in total.",
+    ["stage", "bus"],
+    buckets=BUCKETS,
+)
+recognition_outcomes = Counter(
+    "fare_recognition_outcomes",
+    "Recognition results by outcome.",
+    ["outcome", "bus"],
+)
+enrollment_seconds = Histogram(
+    "fare_enrollment_stage_seconds",
+    "Seconds spent per enrollment request in each stage, and in total.",
+    ["stage"],
+    buckets=BUCKETS,
+)
+
+
+def bus_label(bus_id):
+    return "none" if bus_id is None else str(bus_id)
+
+
+def frame_outcome(analysis):
+    """Outcome of a frame rejected by ``recognition.frame_error``."""
+    if not analysis["locations"]:
+        return "no_face"
+    if len(analysis["locations"]) > 1:
+        return "multiple_faces"
+    return "unusable_face"
+
+
+def board_outcome(payload):
+    """Outcome of a payload returned by ``recognition.board`` and friends."""
+    if payload["status"] == "success":
+        return "matched"
+    if payload["status"] == "info":
+        return "debounced"
+    if "balance" in payload:
+        return "insufficient_balance"
+    return "not_recognized"
+
+
+class StageTimer:
+    """Accumulates stage durations for one request and records them once."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add({name: time.perf_counter() - start})
+
+    def add(self, timings):
+        """Add durations measured elsewhere, e.g. on a face worker."""
+        for name, seconds in timings.items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def observe(self, bus_id, outcomes):
+        """Record a recognition request with one outcome per face."""
+        bus = bus_label(bus_id)
+        for name, seconds in self.seconds.items():
+            recognition_seconds.labels(name, bus).observe(seconds)
+        recognition_seconds.labels("total", bus).observe(time.perf_counter() - self.started)
+        for outcome in outcomes:
+            recognition_outcomes.labels(outcome, bus).inc()
+
+    def observe_enrollment(self):
+        for name, seconds in self.seconds.items():
+            enrollment_seconds.labels(name).observe(seconds)
+        enrollment_seconds.labels("total").observe(time.perf_counter() - self.started)
+
+
+def exposition():
+    """Return ``(body, content_type)`` of the current metrics."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus', '0005_remove_bus_route_bus_route_name_alter_busdriver_bus'),
+        ('students', '0016_transaction_student_time_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncedBoarding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.UUIDField(unique=True)),
+                ('device_timestamp', models.DateTimeField()),
+                ('result', models.CharField(choices=[('charged', 'Charged'), ('declined', 'Declined'), ('debounced', 'Debounced'), ('unknown_student', 'Unknown student')], max_length=20)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('bus', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='synced_boardings', to='bus.bus')),
+                ('student', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='students.student')),
+                ('transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='students.transaction')),
+            ],
+        ),
+    ]
@@ -22,3 +22,36 @@ class BusDriver(models.Model):
 
     def __str__(self):
         return f"{self.full_name} - {self.bus.bus_number if self.bus else 'No Bus Assigned'}"
+
+
+class SyncedBoarding(models.Model):
+    """A boarding uploaded from an on-bus journal, keyed by its client UUID.
+
+    The stored result is returned again when the same boarding is re-uploaded,
+    so a bus can retry a sync without being charged twice.
+    """
+
+    client_id = models.UUIDField(unique=True)
+    bus = models.ForeignKey(
+        Bus, on_delete=models.SET_NULL, null=True, blank=True, related_name="synced_boardings"
+    )
+    student = models.ForeignKey(
+        "students.Student", on_delete=models.SET_NULL, null=True, blank=True
+    )
+    device_timestamp = models.DateTimeField()
+    result = models.CharField(
+        max_length=20,
+        choices=[
+            ("charged", "Charged"),
+            ("declined", "Declined"),
+            ("debounced", "Debounced"),
+            ("unknown_student", "Unknown student"),
+        ],
+    )
+    transaction = models.OneToOneField(
+        "students.Transaction", on_delete=models.SET_NULL, null=True, blank=True
+    )
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.client_id} - {self.result}"
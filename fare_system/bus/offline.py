@@ -0,0 +1,119 @@
+"""Server side of offline boarding: idempotent ingest of on-bus journals.
+
+A bus that records boardings in its local journal (``bus.journal``) uploads
+them in batches. Each item carries the client-generated UUID, the student
+and the device timestamp of the boarding. Items are applied in device-time
+order with the same re-boarding rule and balance ledger as live boardings,
+and every outcome is stored under the UUID so re-uploads are answered with
+the original result instead of charging again.
+"""
+
+import uuid
+
+from django.db import IntegrityError
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from students.ledger import charge_fare
+from students.models import Student, Transaction
+
+from .boardings import REBOARD_WINDOW
+from .models import SyncedBoarding
+from .recognition import FARE_AMOUNT
+
+
+def parse_item(item):
+    """Return ``(client_id, student_pk, device_timestamp)`` or raise ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object.")
+    try:
+        client_id = uuid.UUID(str(item["id"]))
+        student_pk = int(item["student"])
+        timestamp = parse_datetime(str(item["timestamp"]))
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed item: {e}")
+    if timestamp is None:
+        raise ValueError("Malformed timestamp.")
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    # A device clock running ahead must not push boardings into the future
+    return client_id, student_pk, min(timestamp, timezone.now())
+
+
+def item_result(boarding, duplicate=False):
+    transaction = boarding.transaction
+    return {
+        "id": str(boarding.client_id),
+        "result": boarding.result,
+        "duplicate": duplicate,
+        "student": boarding.student_id,
+        "transaction": transaction.pk if transaction else None,
+        "status": transaction.status if transaction else None,
+    }
+
+
+def apply_boarding(bus_id, client_id, student_pk, timestamp):
+    """Charge one journal item, unless a boarding within the window precedes it."""
+    with db_transaction.atomic():
+        student = Student.objects.filter(pk=student_pk).first()
+        transaction = None
+        if student is None:
+            result = "unknown_student"
+        elif Transaction.objects.filter(
+            student=student,
+            timestamp__gt=timestamp - REBOARD_WINDOW,
+            timestamp__lte=timestamp,
+        ).exists():
+            result = "debounced"
+        else:
+            transaction = charge_fare(student, FARE_AMOUNT, bus_id)
+            # Record the boarding at the time it happened on the bus
+            Transaction.objects.filter(pk=transaction.pk).update(timestamp=timestamp)
+            transaction.timestamp = timestamp
+            result = "charged" if transaction.status == "Approved" else "declined"
+
+        return SyncedBoarding.objects.create(
+            client_id=client_id,
+            bus_id=bus_id,
+            student=student,
+            device_timestamp=timestamp,
+            result=result,
+            transaction=transaction,
+        )
+
+
+def ingest(bus_id, items):
+    """Apply a batch of journal items; returns one result per item, in request order."""
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            client_id, student_pk, timestamp = parse_item(item)
+        except ValueError as e:
+            results[index] = {
+                "id": item.get("id") if isinstance(item, dict) else None,
+                "result": "invalid",
+                "error": str(e),
+            }
+            continue
+        parsed.append((timestamp, index, client_id, student_pk))
+
+    existing = SyncedBoarding.objects.select_related("transaction").in_bulk(
+        [client_id for _, _, client_id, _ in parsed], field_name="client_id"
+    )
+    for timestamp, index, client_id, student_pk in sorted(parsed, key=lambda entry: entry[:2]):
+        boarding = existing.get(client_id)
+        if boarding is not None:
+            results[index] = item_result(boarding, duplicate=True)
+            continue
+        try:
+            boarding = apply_boarding(bus_id, client_id, student_pk, timestamp)
+        except IntegrityError:
+            # Uploaded twice in the same batch, or by a concurrent retry
+            boarding = SyncedBoarding.objects.select_related("transaction").get(client_id=client_id)
+            results[index] = item_result(boarding, duplicate=True)
+        else:
+            existing[client_id] = boarding
+            results[index] = item_result(boarding)
+    return results
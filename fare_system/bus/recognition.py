@@ -0,0 +1,300 @@
+"""Steps of the boarding flow shared by the recognition views.
+
+Each helper returns the JSON payload for the kiosk, so the sync and async
+views only differ in how they wait for image work and the database.
+"""
+
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from students.gallery import MATCH_THRESHOLD, gallery
+from students.ledger import charge_fare
+from students.models import Student
+
+from .boardings import REBOARD_WINDOW, alast_boarding, last_boarding, last_boardings
+from .journal import get_journal
+
+FARE_AMOUNT = 20
+
+
+def no_image():
+    return {
+        "status": "error",
+        "message": "No image data received.",
+        "continue": True  # Tell frontend to keep scanning
+    }
+
+
+class EscalationStats:
+    """Counts how often a cheap first-pass encoding had to be re-encoded."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.first_pass = 0
+        self.escalated = 0
+
+    def record(self, escalated):
+        with self._lock:
+            self.first_pass += 1
+            self.escalated += escalated
+
+    def report(self):
+        with self._lock:
+            first_pass, escalated = self.first_pass, self.escalated
+        return {
+            "first_pass_encodings": first_pass,
+            "escalated_encodings": escalated,
+            "escalation_rate": escalated / first_pass if first_pass else 0.0,
+        }
+
+
+escalation_stats = EscalationStats()
+
+
+def is_ambiguous(distance):
+    """True if a first-pass distance is too close to the threshold to trust.
+
+    Clear matches and clear non-matches are accepted as they are; only
+    distances within ``FACE_ESCALATION_BAND`` of the threshold are worth a
+    jittered re-encoding.
+    """
+    return (
+        distance is not None
+        and abs(distance - MATCH_THRESHOLD) <= settings.FACE_ESCALATION_BAND
+    )
+
+
+def frame_error(analysis):
+    """Return the error payload for an unusable frame, or None."""
+    face_locations = analysis["locations"]
+
+    if not face_locations:
+        return {
+            "status": "error",
+            "message": "No face detected. Please position your face clearly in the frame.",
+            "continue": True  # Tell frontend to keep scanning
+        }
+
+    if len(face_locations) > 1:
+        return {
+            "status": "error",
+            "message": "Multiple faces detected. Please ensure only your face is in the frame.",
+            "continue": True
+        }
+
+    top, right, bottom, left = face_locations[0]
+    face_width = right - left
+    face_height = bottom - top
+
+    if face_width < 50 or face_height < 50:
+        return {
+            "status": "error",
+            "message": f"Face too small in image. Please move closer to the camera. (Size: {face_width}x{face_height})",
+            "continue": True
+        }
+
+    if not analysis["encodings"]:
+        return {
+            "status": "error",
+            "message": "Could not extract facial features. Please try again with better lighting.",
+            "continue": True
+        }
+
+    return None
+
+
+def not_recognized():
+    return {
+        "status": "error",
+        "message": "Face not recognized. Please try again or enroll your face.",
+        "continue": True
+    }
+
+
+def below_threshold(distance):
+    # Debug info for close but not matching
+    return {
+        "status": "error",
+        "message": f"Face not recognized. Closest match had {(1-distance)*100:.1f}% confidence which is below the threshold. Please try again or re-enroll your face.",
+        "confidence": (1-distance)*100,
+        "continue": True
+    }
+
+
+def recently_boarded(last_timestamp):
+    """True if the last boarding time falls inside the re-boarding window."""
+    return (
+        last_timestamp is not None
+        and timezone.now() - last_timestamp < REBOARD_WINDOW
+    )
+
+
+def already_boarded(student, last_timestamp):
+    return {
+        "status": "info",
+        "message": f"Already checked in within the last 30 minutes. Student: {student.full_name}",
+        "student": student.full_name,
+        "lastCheckIn": last_timestamp.isoformat(),
+        "continue": True  # Keep scanning for other faces
+    }
+
+
+def fare_result(student, transaction, distance):
+    # Format confidence percentage for user feedback
+    confidence = (1 - distance) * 100
+
+    if transaction.status == "Approved":
+        return {
+            "status": "success",
+            "message": f"Face recognized: {student.full_name} (confidence: {confidence:.1f}%). Payment successful. New balance: {student.balance}",
+            "student": student.full_name,
+            "confidence": confidence,
+            "balance": student.balance,
+            "continue": True  # Keep scanning for other faces
+        }
+    return {
+        "status": "error",
+        "message": f"Face recognized: {student.full_name} (confidence: {confidence:.1f}%). Insufficient balance ({student.balance}).",
+        "student": student.full_name,
+        "confidence": confidence,
+        "balance": student.balance,
+        "continue": True
+    }
+
+
+def board(student_pk, distance, bus_id):
+    """Charge the matched student unless they boarded recently."""
+    if student_pk is None:
+        return not_recognized()
+    # Use a threshold of 0.6 for better accuracy with multiple encodings
+    if distance > MATCH_THRESHOLD:
+        return below_threshold(distance)
+
+    student = Student.objects.filter(pk=student_pk).first()
+    if student is None:
+        return not_recognized()
+
+    # Check for a boarding within the last 30 minutes, cached or indexed
+    last_timestamp = last_boarding(student.pk)
+    if recently_boarded(last_timestamp):
+        return already_boarded(student, last_timestamp)
+
+    # Conditional debit and Transaction insert, committed together
+    transaction = charge_fare(student, FARE_AMOUNT, bus_id)
+    return fare_result(student, transaction, distance)
+
+
+def board_offline(student_pk, distance, bus_id):
+    """On-bus counterpart of :func:`board`: journal the boarding for a later sync.
+
+    The re-boarding rule is applied against the journal; the fare itself is
+    charged by the server when the journal is uploaded.
+    """
+    if student_pk is None:
+        return not_recognized()
+    if distance > MATCH_THRESHOLD:
+        return below_threshold(distance)
+
+    student = Student.objects.filter(pk=student_pk).first()
+    if student is None:
+        return not_recognized()
+
+    journal = get_journal()
+    last_timestamp = journal.last_boarding(student.pk)
+    if recently_boarded(last_timestamp):
+        return already_boarded(student, last_timestamp)
+
+    journal.record(student.pk, distance)
+    confidence = (1 - distance) * 100
+    return {
+        "status": "success",
+        "message": f"Face recognized: {student.full_name} (confidence: {confidence:.1f}%). Boarding recorded; the fare is charged when the bus syncs.",
+        "student": student.full_name,
+        "confidence": confidence,
+        "queued": True,
+        "continue": True
+    }
+
+
+async def aboard(student_pk, distance, bus_id):
+    """Async counterpart of :func:`board` using the async ORM."""
+    if student_pk is None:
+        return not_recognized()
+    if distance > MATCH_THRESHOLD:
+        return below_threshold(distance)
+
+    student = await Student.objects.filter(pk=student_pk).afirst()
+    if student is None:
+        return not_recognized()
+
+    last_timestamp = await alast_boarding(student.pk)
+    if recently_boarded(last_timestamp):
+        return already_boarded(student, last_timestamp)
+
+    transaction = await sync_to_async(charge_fare)(student, FARE_AMOUNT, bus_id)
+    return fare_result(student, transaction, distance)
+
+
+def face_too_small(location):
+    top, right, bottom, left = location
+    return {
+        "status": "error",
+        "message": f"Face too small in image. Please move closer to the camera. (Size: {right - left}x{bottom - top})",
+    }
+
+
+def board_burst(faces, bus_id):
+    """Board every face found in a burst of frames.
+
+    All encodings are matched against the gallery in one matrix operation,
+    the re-boarding rule is checked for every matched student with one query
+    and the resulting transactions are committed together. Returns one result
+    per matched student (taken from the face that matched best across the
+    burst) plus one for each face that could not be matched.
+    """
+    encoded = [face for face in faces if face["encoding"] is not None]
+    matches = gallery.match_many([face["encoding"] for face in encoded]) if encoded else []
+
+    best = {}
+    for face, (student_pk, distance) in zip(encoded, matches):
+        face["student_pk"], face["distance"] = student_pk, distance
+        if student_pk is None or distance > MATCH_THRESHOLD:
+            continue
+        if student_pk not in best or distance < best[student_pk]["distance"]:
+            best[student_pk] = face
+
+    students = Student.objects.in_bulk(list(best))
+    boarded = last_boardings(best)
+
+    results = {}
+    with db_transaction.atomic():
+        for student_pk, face in best.items():
+            student = students.get(student_pk)
+            if student is None:
+                results[id(face)] = not_recognized()
+            elif recently_boarded(boarded.get(student_pk)):
+                results[id(face)] = already_boarded(student, boarded[student_pk])
+            else:
+                transaction = charge_fare(student, FARE_AMOUNT, bus_id)
+                results[id(face)] = fare_result(student, transaction, face["distance"])
+
+    payloads = []
+    for face in faces:
+        if face["encoding"] is None:
+            payload = face_too_small(face["location"])
+        elif id(face) in results:
+            payload = results[id(face)]
+        elif face["student_pk"] is None:
+            payload = not_recognized()
+        elif face["distance"] > MATCH_THRESHOLD:
+            payload = below_threshold(face["distance"])
+        else:
+            # Same student as a better-matching face elsewhere in the burst
+            continue
+        payload.pop("continue", None)
+        payloads.append({"frame": face["frame"], "box": face["location"], **payload})
+    return payloads
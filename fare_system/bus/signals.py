@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from students.models import Transaction
+
+from .boardings import remember
+
+
+@receiver(post_save, sender=Transaction)
+def record_boarding(sender, instance, created, **kwargs):
+    """Index a new boarding in the recent-boarding cache once it is committed."""
+    if created:
+        transaction.on_commit(lambda: remember(instance.student_id, instance.timestamp))
@@ -1,3 +1,751 @@
-from django.test import TestCase
+import asyncio
+import json
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from prometheus_client import REGISTRY
+
+from students.gallery import ENCODING_SIZE, gallery, read_encodings
+from students.ledger import charge_fare
+from students.models import FaceEncoding, Student, Transaction
+from students.tests import GalleryTestCase
+from students.workers import face_pool
+
+from .boardings import (
+    CACHE_KEY, REBOARD_WINDOW, alast_boarding, forget, last_boarding, last_boardings, remember,
+)
+from .checks import idempotency_cache_check
+from .diagnostics import DiagnosticsBuffer, is_near_miss, top_students
+from .hotset import RouteHotSets
+from .management.commands.benchmark_recognition import synthetic_encodings
+from .idempotency import idempotent
+from .models import Bus, BusDriver, SyncedBoarding
+from .offline import ingest
+from .recognition import FARE_AMOUNT, escalation_stats, is_ambiguous
+
+
+def boarding(student_pk, timestamp, client_id=None):
+    return {
+        "id": str(client_id or uuid.uuid4()),
+        "student": student_pk,
+        "timestamp": timestamp.isoformat(),
+    }
+
+
+class OfflineSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bus = Bus.objects.create(bus_number="B1", route_name="Campus loop")
+        user = User.objects.create(username="1001")
+        self.student = Student.objects.create(
+            user=user, full_name="Test Student", student_id=1001, balance=FARE_AMOUNT * 2
+        )
+        self.start = timezone.now() - timedelta(hours=6)
+
+    def balance(self):
+        return Student.objects.values_list("balance", flat=True).get(pk=self.student.pk)
+
+    def test_items_are_applied_in_device_time_order(self):
+        # Sent newest first; the earlier boarding must be the one charged
+        later = boarding(self.student.pk, self.start + timedelta(minutes=10))
+        earlier = boarding(self.student.pk, self.start)
+
+        results = ingest(self.bus.pk, [later, earlier])
+
+        self.assertEqual([r["result"] for r in results], ["debounced", "charged"])
+        self.assertEqual(results[1]["id"], earlier["id"])
+        transaction = Transaction.objects.get(student=self.student)
+        self.assertEqual(transaction.timestamp, self.start)
+        self.assertEqual(transaction.bus_id, self.bus.pk)
+        self.assertEqual(self.balance(), FARE_AMOUNT)
+
+    def test_boardings_outside_the_window_are_each_charged_until_declined(self):
+        items = [boarding(self.student.pk, self.start + timedelta(hours=hour)) for hour in range(3)]
+
+        results = ingest(self.bus.pk, items)
+
+        self.assertEqual([r["result"] for r in results], ["charged", "charged", "declined"])
+        self.assertEqual(results[2]["status"], "Declined")
+        self.assertEqual(self.balance(), 0)
+
+    def test_duplicate_within_a_batch_is_charged_once(self):
+        item = boarding(self.student.pk, self.start)
+
+        results = ingest(self.bus.pk, [item, dict(item)])
+
+        self.assertEqual([r["duplicate"] for r in results], [False, True])
+        self.assertEqual(results[0]["transaction"], results[1]["transaction"])
+        self.assertEqual(Transaction.objects.filter(student=self.student).count(), 1)
+        self.assertEqual(self.balance(), FARE_AMOUNT)
+
+    def test_reupload_replays_the_stored_results(self):
+        items = [
+            boarding(self.student.pk, self.start),
+            boarding(self.student.pk, self.start + timedelta(minutes=5)),
+        ]
+        first = ingest(self.bus.pk, items)
+
+        second = ingest(self.bus.pk, items)
+
+        self.assertTrue(all(r["duplicate"] for r in second))
+        self.assertEqual(
+            [(r["result"], r["transaction"]) for r in second],
+            [(r["result"], r["transaction"]) for r in first],
+        )
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(SyncedBoarding.objects.count(), 2)
+
+    def test_malformed_and_unknown_items(self):
+        items = [
+            {"id": "not-a-uuid", "student": self.student.pk, "timestamp": self.start.isoformat()},
+            {"id": str(uuid.uuid4()), "student": self.student.pk, "timestamp": "yesterday"},
+            "not an object",
+            boarding(self.student.pk + 1000, self.start),
+        ]
+
+        results = ingest(self.bus.pk, items)
+
+        self.assertEqual(
+            [r["result"] for r in results], ["invalid", "invalid", "invalid", "unknown_student"]
+        )
+        self.assertEqual(results[0]["id"], "not-a-uuid")
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_future_device_time_is_clamped_to_now(self):
+        ingest(self.bus.pk, [boarding(self.student.pk, timezone.now() + timedelta(days=1))])
+
+        self.assertLessEqual(Transaction.objects.get().timestamp, timezone.now())
+
+    def test_endpoint_requires_the_driver_of_a_bus(self):
+        driver = User.objects.create_user("driver", password="pw")
+        url = "/bus/sync-boardings/"
+        body = json.dumps({"boardings": [boarding(self.student.pk, self.start)]})
+
+        self.assertEqual(self.client.post(url, body, content_type="application/json").status_code, 401)
+        self.client.force_login(driver)
+        self.assertEqual(self.client.post(url, body, content_type="application/json").status_code, 403)
+
+        BusDriver.objects.create(user=driver, full_name="Driver", bus=self.bus)
+        response = self.client.post(url, body, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["result"], "charged")
+        self.assertEqual(
+            self.client.post(url, "not json", content_type="application/json").status_code, 400
+        )
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.calls = 0
+        self.status = 200
+
+    def request(self, key="capture-1", user=None):
+        request = self.factory.post(
+            "/bus/recognize-face/", b"jpeg", content_type="image/jpeg", HTTP_IDEMPOTENCY_KEY=key
+        )
+        request.user = user or AnonymousUser()
+
+        async def auser():
+            return request.user
+
+        request.auser = auser
+        return request
+
+    def view(self, request):
+        self.calls += 1
+        return JsonResponse({"status": "success", "call": self.calls}, status=self.status)
+
+    def outcomes(self, outcome, bus="none"):
+        return REGISTRY.get_sample_value(
+            "fare_recognition_outcomes_total", {"outcome": outcome, "bus": bus}
+        ) or 0
+
+    def test_duplicate_is_replayed_without_running_the_view(self):
+        view = idempotent(self.view)
+        before = self.outcomes("replayed")
+
+        first = view(self.request())
+        second = view(self.request())
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(self.outcomes("replayed"), before + 1)
+
+    def test_keys_are_scoped_to_the_user(self):
+        view = idempotent(self.view)
+        first = User.objects.create(username="first-driver")
+        second = User.objects.create(username="second-driver")
+
+        view(self.request(user=first))
+        response = view(self.request(user=second))
+
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+
+    def test_process_local_cache_is_reported(self):
+        locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        shared = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}}
+
+        with override_settings(CACHES=locmem):
+            self.assertEqual([e.id for e in idempotency_cache_check(None)], ["bus.W001"])
+        with override_settings(CACHES=shared):
+            self.assertEqual(idempotency_cache_check(None), [])
+
+    def test_other_keys_and_requests_without_a_key_run_the_view(self):
+        view = idempotent(self.view)
+
+        view(self.request("capture-1"))
+        view(self.request("capture-2"))
+        view(self.request("not a valid key!"))
+        view(self.request("not a valid key!"))
+
+        self.assertEqual(self.calls, 4)
+
+    def test_non_200_releases_the_key(self):
+        view = idempotent(self.view)
+        self.status = 503
+        view(self.request())
+        self.status = 200
+
+        response = view(self.request())
+
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(json.loads(response.content)["call"], 2)
+
+    def test_exception_releases_the_key(self):
+        def failing(request):
+            raise RuntimeError("worker crashed")
+
+        with self.assertRaises(RuntimeError):
+            idempotent(failing)(self.request())
+        idempotent(self.view)(self.request())
+
+        self.assertEqual(self.calls, 1)
+
+    def test_duplicate_of_a_request_in_flight_gets_409(self):
+        responses = []
+        before = self.outcomes("in_progress")
+
+        def slow(request):
+            # A retry arrives while the original is still being processed
+            responses.append(view(self.request()))
+            return self.view(request)
+
+        view = idempotent(slow)
+        view(self.request())
+
+        self.assertEqual(responses[0].status_code, 409)
+        self.assertEqual(responses[0]["Retry-After"], "1")
+        self.assertEqual(self.outcomes("in_progress"), before + 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_replays_are_counted_under_the_drivers_bus(self):
+        bus = Bus.objects.create(bus_number="B7", route_name="North")
+        driver = User.objects.create(username="driver")
+        BusDriver.objects.create(user=driver, full_name="Driver", bus=bus)
+        view = idempotent(self.view)
+        before = self.outcomes("replayed", str(bus.pk))
+
+        view(self.request(user=driver))
+        view(self.request(user=driver))
+
+        self.assertEqual(self.outcomes("replayed", str(bus.pk)), before + 1)
+
+    def test_async_view(self):
+        async def async_view(request):
+            return self.view(request)
+
+        view = idempotent(async_view)
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+
+        async def run():
+            first = await view(self.request())
+            second = await view(self.request())
+            self.status = 503
+            await view(self.request("capture-2"))
+            self.status = 200
+            third = await view(self.request("capture-2"))
+            return first, second, third
+
+        first, second, third = asyncio.run(run())
+
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(json.loads(third.content)["call"], 3)
+        self.assertEqual(self.calls, 3)
+
+
+class RecognitionMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bus = Bus.objects.create(bus_number="B9", route_name="East")
+        driver = User.objects.create_user("metrics-driver", password="pw")
+        BusDriver.objects.create(user=driver, full_name="Driver", bus=self.bus)
+        self.client.force_login(driver)
+
+    def sample(self, name, labels):
+        return REGISTRY.get_sample_value(name, {**labels, "bus": str(self.bus.pk)}) or 0
+
+    def post(self, url, analysis):
+        with mock.patch.object(face_pool, "run", return_value=analysis):
+            return self.client.post(url, b"jpeg", content_type="image/jpeg")
+
+    def test_rejected_frame_is_labelled_with_the_drivers_bus(self):
+        outcomes = self.sample("fare_recognition_outcomes_total", {"outcome": "no_face"})
+        detected = self.sample("fare_recognition_stage_seconds_count", {"stage": "detect"})
+        analysis = {"locations": [], "encodings": [], "timings": {"decode": 0.01, "detect": 0.02}}
+
+        response = self.post("/bus/recognize-face/", analysis)
+
+        self.assertEqual(json.loads(response.content)["status"], "error")
+        self.assertEqual(
+            self.sample("fare_recognition_outcomes_total", {"outcome": "no_face"}), outcomes + 1
+        )
+        self.assertEqual(
+            self.sample("fare_recognition_stage_seconds_count", {"stage": "detect"}), detected + 1
+        )
+
+    def test_batch_records_stage_timings_under_the_drivers_bus(self):
+        outcomes = self.sample("fare_recognition_outcomes_total", {"outcome": "no_face"})
+        encoded = self.sample("fare_recognition_stage_seconds_count", {"stage": "encode"})
+        analysis = {"faces": [], "timings": {"decode": 0.01, "detect": 0.02, "encode": 0.0}}
+
+        self.post("/bus/recognize-faces/", analysis)
+
+        self.assertEqual(
+            self.sample("fare_recognition_outcomes_total", {"outcome": "no_face"}), outcomes + 1
+        )
+        self.assertEqual(
+            self.sample("fare_recognition_stage_seconds_count", {"stage": "encode"}), encoded + 1
+        )
+
+
+class RouteHotSetTests(GalleryTestCase):
+    students = 10
+
+    def setUp(self):
+        super().setUp()
+        settings = override_settings(FACE_GALLERY_SYNC_INTERVAL=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        gallery.invalidate()
+        self.addCleanup(gallery.invalidate)
+
+        self.bus = Bus.objects.create(bus_number="B3", route_name="West")
+        self.regulars = self.enrolled[:3]
+        for student in self.regulars:
+            Transaction.objects.create(student=student, bus=self.bus, status="Approved")
+        self.hot_sets = RouteHotSets()
+
+    def face(self, student):
+        vectors, _, _ = read_encodings(FaceEncoding.objects.filter(student=student))
+        return vectors[0] + 0.001
+
+    def test_regular_rider_is_a_hot_hit(self):
+        student_pk, distance = self.hot_sets.match(self.face(self.regulars[0]), self.bus.pk)
+
+        self.assertEqual(student_pk, self.regulars[0].pk)
+        self.assertLess(distance, 0.05)
+        self.assertEqual(self.hot_sets.stats["hot_hits"], 1)
+        self.assertEqual(self.hot_sets.stats["full_scans"], 0)
+
+    def test_other_riders_fall_back_to_the_full_gallery(self):
+        face = self.face(self.enrolled[-1])
+
+        self.assertEqual(self.hot_sets.match(face, self.bus.pk), self.brute_force(face)[0])
+        self.assertEqual(self.hot_sets.stats["full_scans"], 1)
+        self.assertEqual(self.hot_sets.match(face, None), self.brute_force(face)[0])
+        self.assertEqual(self.hot_sets.stats["no_bus"], 1)
+
+    def test_change_from_another_worker_drops_the_hot_set_entry(self):
+        student = self.regulars[0]
+        face = self.face(student)
+        self.assertEqual(self.hot_sets.match(face, self.bus.pk)[0], student.pk)
+
+        # Records a GalleryChange; this process's on-commit sync never runs in
+        # a TestCase, as if the delete happened on another worker
+        student.encodings.all().delete()
+
+        student_pk, _ = self.hot_sets.match(face, self.bus.pk)
+        self.assertNotEqual(student_pk, student.pk)
+        self.assertEqual(self.hot_sets.stats["full_scans"], 1)
+
+
+class RecognitionTestCase(GalleryTestCase):
+    """A logged-in driver of a bus, with the face worker mocked out."""
+
+    students = 5
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        gallery.invalidate()
+        self.addCleanup(gallery.invalidate)
+        patcher = mock.patch("bus.hotset.hot_sets", RouteHotSets())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.bus = Bus.objects.create(bus_number="B5", route_name="South")
+        driver = User.objects.create_user("recognition-driver", password="pw")
+        BusDriver.objects.create(user=driver, full_name="Driver", bus=self.bus)
+        self.client.force_login(driver)
+        self.student = self.enrolled[0]
+        Student.objects.filter(pk=self.student.pk).update(balance=FARE_AMOUNT)
+
+    def face(self, student):
+        vectors, _, _ = read_encodings(FaceEncoding.objects.filter(student=student))
+        return vectors[0] + 0.001
+
+    def analysis(self, encoding):
+        return {
+            "locations": [(0, 120, 120, 0)],
+            "encodings": [encoding],
+            "timings": {"decode": 0.001, "detect": 0.01, "encode": 0.02},
+        }
+
+    def outcomes(self, outcome):
+        return REGISTRY.get_sample_value(
+            "fare_recognition_outcomes_total", {"outcome": outcome, "bus": str(self.bus.pk)}
+        ) or 0
+
+
+
+class RecognizeFaceTests(RecognitionTestCase):
+    def post(self, encoding, url="/bus/recognize-face/"):
+        analysis = self.analysis(encoding)
+        with mock.patch.object(face_pool, "run", return_value=analysis), mock.patch.object(
+            face_pool, "arun", mock.AsyncMock(return_value=analysis)
+        ):
+            return json.loads(self.client.post(url, b"jpeg", content_type="image/jpeg").content)
+
+    def test_boarding_then_debounce(self):
+        matched, debounced = self.outcomes("matched"), self.outcomes("debounced")
+
+        first = self.post(self.face(self.student))
+        second = self.post(self.face(self.student))
+
+        self.assertEqual(first["status"], "success")
+        self.assertEqual(first["student"], self.student.full_name)
+        self.assertEqual(first["balance"], 0)
+        self.assertEqual(second["status"], "info")
+        transaction = Transaction.objects.get(student=self.student)
+        self.assertEqual((transaction.status, transaction.bus_id), ("Approved", self.bus.pk))
+        self.assertEqual(self.outcomes("matched"), matched + 1)
+        self.assertEqual(self.outcomes("debounced"), debounced + 1)
+
+    def test_insufficient_balance(self):
+        before = self.outcomes("insufficient_balance")
+        student = self.enrolled[1]
+
+        result = self.post(self.face(student))
+
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(result["balance"], 0)
+        self.assertEqual(Transaction.objects.get(student=student).status, "Declined")
+        self.assertEqual(self.outcomes("insufficient_balance"), before + 1)
+
+    def test_unknown_face(self):
+        before = self.outcomes("not_recognized")
+
+        result = self.post(np.full(ENCODING_SIZE, 0.5))
+
+        self.assertEqual(result["status"], "error")
+        self.assertIn("confidence", result)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(self.outcomes("not_recognized"), before + 1)
+
+    def test_async_endpoint(self):
+        matched = self.outcomes("matched")
+
+        result = self.post(self.face(self.student), url="/bus/recognize-face/async/")
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(Transaction.objects.get(student=self.student).bus_id, self.bus.pk)
+        self.assertEqual(self.outcomes("matched"), matched + 1)
+
+
+class BatchBoardingTests(RecognitionTestCase):
+    def face(self, student, frame=0, location=(0, 120, 120, 0)):
+        return {"frame": frame, "location": location, "encoding": super().face(student)}
+
+    def post(self, faces):
+        analysis = {"faces": faces, "timings": {"decode": 0.001, "detect": 0.01, "encode": 0.02}}
+        with mock.patch.object(face_pool, "run", return_value=analysis):
+            response = self.client.post("/bus/recognize-faces/", b"jpeg", content_type="image/jpeg")
+        return json.loads(response.content)
+
+    def test_every_face_in_a_burst_gets_a_result(self):
+        second = self.enrolled[1]
+        Student.objects.filter(pk=second.pk).update(balance=FARE_AMOUNT)
+        matched = self.outcomes("matched")
+        faces = [
+            self.face(self.student),
+            self.face(second, location=(0, 260, 120, 140)),
+            # The same student again in a later frame is boarded once
+            self.face(self.student, frame=1),
+            {"frame": 1, "location": (0, 30, 30, 0), "encoding": None},
+            {"frame": 1, "location": (0, 260, 120, 140), "encoding": np.full(ENCODING_SIZE, 0.5)},
+        ]
+
+        result = self.post(faces)
+
+        self.assertEqual(result["status"], "batch")
+        self.assertEqual(result["message"], "2 of 4 faces boarded.")
+        statuses = [(face["frame"], face["status"]) for face in result["faces"]]
+        self.assertEqual(statuses, [(0, "success"), (0, "success"), (1, "error"), (1, "error")])
+        self.assertIn("too small", result["faces"][2]["message"])
+        self.assertEqual(
+            sorted(Transaction.objects.values_list("student_id", "bus_id")),
+            [(self.student.pk, self.bus.pk), (second.pk, self.bus.pk)],
+        )
+        self.assertEqual(self.outcomes("matched"), matched + 2)
+
+    def test_recent_boarding_is_debounced(self):
+        self.post([self.face(self.student)])
+
+        result = self.post([self.face(self.student), self.face(self.enrolled[1], frame=1)])
+
+        self.assertEqual([face["status"] for face in result["faces"]], ["info", "error"])
+        self.assertEqual(Transaction.objects.filter(student=self.student).count(), 1)
+        self.assertEqual(Transaction.objects.get(student=self.enrolled[1]).status, "Declined")
+
+    def test_no_faces(self):
+        before = self.outcomes("no_face")
+
+        result = self.post([])
+
+        self.assertEqual((result["status"], result["faces"]), ("error", []))
+        self.assertEqual(self.outcomes("no_face"), before + 1)
+
+
+@override_settings(FACE_ESCALATION_BAND=0.05, FACE_ESCALATION_JITTERS=3)
+class AdaptiveJitterTests(RecognitionTestCase):
+    def ambiguous(self, student):
+        """An encoding of ``student`` 0.58 away, just inside the match threshold."""
+        offset = self.rng.normal(0, 1, ENCODING_SIZE)
+        return self.face(student) + 0.58 * offset / np.linalg.norm(offset)
+
+    def post(self, first_pass, escalated=None):
+        analysis = self.analysis(first_pass)
+        results = [analysis] if escalated is None else [analysis, escalated]
+        with mock.patch.object(face_pool, "run", side_effect=results) as run:
+            response = self.client.post("/bus/recognize-face/", b"jpeg", content_type="image/jpeg")
+        return json.loads(response.content), run
+
+    def test_only_distances_near_the_threshold_are_ambiguous(self):
+        self.assertFalse(is_ambiguous(None))
+        self.assertFalse(is_ambiguous(0.3))
+        self.assertTrue(is_ambiguous(0.56))
+        self.assertTrue(is_ambiguous(0.64))
+        self.assertFalse(is_ambiguous(0.9))
+
+    def test_clear_match_is_not_re_encoded(self):
+        before = escalation_stats.report()
+
+        result, run = self.post(self.face(self.student))
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(run.call_count, 1)
+        report = escalation_stats.report()
+        self.assertEqual(report["first_pass_encodings"], before["first_pass_encodings"] + 1)
+        self.assertEqual(report["escalated_encodings"], before["escalated_encodings"])
+
+    def test_ambiguous_match_is_re_encoded_with_jitters(self):
+        before = escalation_stats.report()
+
+        result, run = self.post(self.ambiguous(self.student), escalated=self.face(self.student))
+
+        self.assertEqual(result["status"], "success")
+        self.assertGreater(result["confidence"], 98)
+        self.assertEqual(run.call_count, 2)
+        _, image_bytes, location = run.call_args.args
+        self.assertEqual((image_bytes, location), (b"jpeg", (0, 120, 120, 0)))
+        self.assertEqual(run.call_args.kwargs, {"num_jitters": 3})
+        report = escalation_stats.report()
+        self.assertEqual(report["escalated_encodings"], before["escalated_encodings"] + 1)
+
+    def test_escalated_encoding_can_reject_the_match(self):
+        result, _ = self.post(self.ambiguous(self.student), escalated=np.full(ENCODING_SIZE, 0.5))
+
+        self.assertEqual(result["status"], "error")
+        self.assertFalse(Transaction.objects.exists())
+
+
+class RecognitionBenchmarkTests(TestCase):
+    def test_synthetic_encodings(self):
+        vectors, student_ids = synthetic_encodings(11, 3, np.random.default_rng(0))
+
+        self.assertEqual(vectors.shape, (11, ENCODING_SIZE))
+        self.assertEqual(student_ids.tolist(), [0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3])
+
+    def test_report(self):
+        students, transactions = Student.objects.count(), Transaction.objects.count()
+        out = StringIO()
+
+        call_command(
+            "benchmark_recognition", "--sizes", "100,500", "--repeat", "2", "--queries", "20",
+            "--history", "50", stdout=out,
+        )
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report["match"]), {"100", "500"})
+        for size in report["match"].values():
+            self.assertGreaterEqual(size["top1_accuracy"], 0.95)
+            self.assertEqual(size["n"], 20)
+        for stage in ("base64_decode", "hog_detect", "encode", "debounce_query", "transaction_write"):
+            self.assertEqual(report["stages"][stage]["n"], 2)
+        # Database stages are rolled back
+        self.assertEqual(Student.objects.count(), students)
+        self.assertEqual(Transaction.objects.count(), transactions)
+
+
+@override_settings(
+    FACE_DIAGNOSTICS_ENABLED=True, FACE_DIAGNOSTICS_TOP_K=3, FACE_DIAGNOSTICS_BUFFER_SIZE=4
+)
+class DiagnosticsTests(GalleryTestCase):
+    students = 8
+
+    def setUp(self):
+        super().setUp()
+        gallery.invalidate()
+        self.addCleanup(gallery.invalidate)
+        self.buffer = DiagnosticsBuffer()
+
+    def test_top_students_are_distinct_and_closest_first(self):
+        vectors, student_ids, _ = read_encodings(FaceEncoding.objects.all())
+        query = vectors[0] + 0.001
+        distances = np.linalg.norm(vectors - query, axis=1)
+        expected = []
+        for row in np.argsort(distances):
+            if int(student_ids[row]) not in [pk for pk, _ in expected]:
+                expected.append((int(student_ids[row]), float(distances[row])))
+
+        candidates = top_students(query, 3)
+
+        self.assertEqual([pk for pk, _ in candidates], [pk for pk, _ in expected[:3]])
+        np.testing.assert_allclose([d for _, d in candidates], [d for _, d in expected[:3]])
+
+    def test_near_misses(self):
+        self.assertFalse(is_near_miss([]))
+        self.assertFalse(is_near_miss([(1, 0.3), (2, 0.9)]))
+        self.assertTrue(is_near_miss([(1, 0.7), (2, 0.9)]))
+        self.assertTrue(is_near_miss([(1, 0.3), (2, 0.5)]))
+
+    def test_buffer_keeps_the_newest_samples(self):
+        vectors, _, _ = read_encodings(FaceEncoding.objects.all())
+        far = np.full(ENCODING_SIZE, 0.5)
+        for i in range(5):
+            self.buffer.record(vectors[i * 3] + 0.001, bus_id=i, escalated=i == 4)
+        self.buffer.record(far, bus_id=7)
+
+        report = self.buffer.report(near_misses_only=False)
+
+        self.assertEqual(report["buffered"], 4)
+        self.assertEqual([sample["bus"] for sample in report["samples"]], [7, 4, 3, 2])
+        self.assertTrue(report["samples"][1]["escalated"])
+        self.assertEqual(len(report["samples"][1]["candidates"]), 3)
+        self.assertEqual([s["bus"] for s in self.buffer.report()["samples"]], [7])
+        self.assertEqual(
+            [s["bus"] for s in self.buffer.report(near_misses_only=False, bus_id=3)["samples"]], [3]
+        )
+
+    def test_sampling(self):
+        with override_settings(FACE_DIAGNOSTICS_SAMPLE_RATE=1.0):
+            self.assertTrue(self.buffer.sampled())
+        with override_settings(FACE_DIAGNOSTICS_SAMPLE_RATE=0.0):
+            self.assertFalse(self.buffer.sampled())
+        with override_settings(FACE_DIAGNOSTICS_ENABLED=False, FACE_DIAGNOSTICS_SAMPLE_RATE=1.0):
+            self.assertFalse(self.buffer.sampled())
+
+    def test_view_is_staff_only(self):
+        url = "/bus/recognition-diagnostics/"
+        user = User.objects.create_user("diagnostics", password="pw")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+        response = self.client.get(url, {"all": "1", "bus": "3"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content)["enabled"])
+
+
+class RecentBoardingIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.students = [
+            Student.objects.create(
+                user=User.objects.create(username=str(2000 + i)),
+                full_name=f"Rider {i}", student_id=2000 + i, balance=FARE_AMOUNT * 2,
+            )
+            for i in range(3)
+        ]
+
+    def board(self, student, minutes_ago=0):
+        """Record a boarding ``minutes_ago`` minutes back, bypassing the signal."""
+        transaction = Transaction.objects.create(student=student, amount=FARE_AMOUNT, status="Approved")
+        timestamp = timezone.now() - timedelta(minutes=minutes_ago)
+        Transaction.objects.filter(pk=transaction.pk).update(timestamp=timestamp)
+        forget(student.pk)
+        return timestamp
+
+    def test_miss_falls_back_to_the_database_and_is_cached(self):
+        student = self.students[0]
+        self.assertIsNone(last_boarding(student.pk))
+
+        timestamp = self.board(student, minutes_ago=5)
+        with self.assertNumQueries(1):
+            self.assertEqual(last_boarding(student.pk), timestamp)
+        with self.assertNumQueries(0):
+            self.assertEqual(last_boarding(student.pk), timestamp)
+
+    def test_boardings_outside_the_window_are_ignored(self):
+        student = self.students[0]
+        self.board(student, minutes_ago=REBOARD_WINDOW.total_seconds() / 60 + 1)
+
+        self.assertIsNone(last_boarding(student.pk))
+        remember(student.pk, timezone.now() - REBOARD_WINDOW - timedelta(seconds=1))
+        self.assertIsNone(cache.get(CACHE_KEY.format(student.pk)))
+
+    def test_new_boardings_are_indexed_on_commit(self):
+        student = self.students[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            transaction = charge_fare(student, FARE_AMOUNT)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(last_boarding(student.pk), transaction.timestamp)
+
+    def test_batch_lookup_mixes_cache_and_database(self):
+        cached, stored, absent = self.students
+        cached_at = timezone.now() - timedelta(minutes=2)
+        remember(cached.pk, cached_at)
+        stored_at = self.board(stored, minutes_ago=10)
+
+        with self.assertNumQueries(1):
+            found = last_boardings([cached.pk, stored.pk, absent.pk])
+        self.assertEqual(found, {cached.pk: cached_at, stored.pk: stored_at})
+        # The database hit is cached for the next batch
+        with self.assertNumQueries(0):
+            self.assertEqual(last_boardings([stored.pk]), {stored.pk: stored_at})
+
+    def test_async_lookup_agrees(self):
+        student = self.students[0]
+        timestamp = self.board(student, minutes_ago=5)
+
+        self.assertEqual(async_to_sync(alast_boarding)(student.pk), timestamp)
+        self.assertEqual(cache.get(CACHE_KEY.format(student.pk)), timestamp)
+        self.assertIsNone(async_to_sync(alast_boarding)(self.students[1].pk))
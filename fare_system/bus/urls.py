@@ -1,8 +1,22 @@
 from django.urls import path
-from .views import bus_dashboard, update_location, recognize_face
+from .views import (
+    bus_dashboard,
+    update_location,
+    recognize_face,
+    recognize_face_async,
+    recognize_faces_batch,
+    recognition_stats,
+    recognition_diagnostics,
+    sync_boardings,
+)
 
 urlpatterns = [
     path("dashboard/", bus_dashboard, name="bus_dashboard"),
     path("update-location/", update_location, name="update_location"),
     path("recognize-face/", recognize_face, name="recognize_face"),
+    path("recognize-face/async/", recognize_face_async, name="recognize_face_async"),
+    path("recognize-faces/", recognize_faces_batch, name="recognize_faces_batch"),
+    path("sync-boardings/", sync_boardings, name="sync_boardings"),
+    path("recognition-stats/", recognition_stats, name="recognition_stats"),
+    path("recognition-diagnostics/", recognition_diagnostics, name="recognition_diagnostics"),
 ]
@@ -1,20 +1,22 @@
-import base64
-import io
 import json
+import logging
+from django.conf import settings
 from django.contrib import messages
-import cv2
-import numpy as np
-import face_recognition
 from django.shortcuts import render, redirect
-from students.models import Student, Transaction
+from students.uploads import request_image, request_images
+from students.workers import PoolBusy, face_pool
+from .idempotency import idempotent
+from .metrics import StageTimer, board_outcome, exposition, frame_outcome
 from .models import Bus, BusDriver
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-from datetime import datetime, timedelta
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from datetime import datetime
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.utils import timezone
-from django.db import models
+from asgiref.sync import sync_to_async
+
+logger = logging.getLogger(__name__)
 
 
 @login_required
@@ -72,223 +74,383 @@ def update_location(request):
         })
 
 
+def busy_response():
+    """Fast reply for when every face worker is occupied; the kiosk retries."""
+    response = JsonResponse({
+        "status": "busy",
+        "message": "Recognition is busy. Retrying shortly...",
+        "continue": True
+    }, status=503)
+    response["Retry-After"] = "1"
+    return response
+
+
+def driver_bus_id(user):
+    """Return the id of the bus assigned to a logged-in driver, or None."""
+    if not user.is_authenticated:
+        return None
+    return BusDriver.objects.filter(user=user).values_list("bus_id", flat=True).first()
+
+
+@idempotent
 def recognize_face(request):
     if request.method == "GET":
         return render(request, "recognize_face.html")
 
     elif request.method == "POST":
+        # Imported on first use so processes that never recognize faces skip
+        # loading OpenCV, dlib and numpy
+        from students import faces
+        from .diagnostics import diagnostics
+        from .hotset import hot_sets
+        from .recognition import (
+            board,
+            board_offline,
+            escalation_stats,
+            frame_error,
+            is_ambiguous,
+            no_image,
+        )
+
+        timer = StageTimer()
+        bus_id = None
+        outcome = "error"
         try:
+            # Bus of the logged-in driver, whose regular riders are searched
+            # first; resolved up front so every outcome is labelled with it
+            with timer.stage("db"):
+                bus_id = driver_bus_id(request.user)
+
             # Get the image data from the POST request
-            image_data = request.POST.get("image_data")
+            with timer.stage("decode"):
+                image_bytes = request_image(request)
 
-            if not image_data:
-                return JsonResponse({
-                    "status": "error",
-                    "message": "No image data received.",
-                    "continue": True  # Tell frontend to keep scanning
-                })
+            if image_bytes is None:
+                outcome = "no_image"
+                return JsonResponse(no_image())
 
-            # Decode the base64 image
-            image_data = image_data.split(",")[1]
-            image_bytes = base64.b64decode(image_data)
+            # Detect and encode on a worker process
+            try:
+                analysis = face_pool.run(
+                    faces.analyze_frame,
+                    image_bytes,
+                    num_jitters=settings.FACE_FIRST_PASS_JITTERS,
+                    detect_scale=settings.FACE_DETECTION_SCALE,
+                )
+            except PoolBusy:
+                outcome = "busy"
+                return busy_response()
+            timer.add(analysis["timings"])
+
+            error = frame_error(analysis)
+            if error:
+                outcome = frame_outcome(analysis)
+                return JsonResponse(error)
+
+            frame_encodings = analysis["encodings"]
+            frame_encoding = frame_encodings[0]  # Use the first detected face
 
-            # Load image file
-            frame = face_recognition.load_image_file(io.BytesIO(image_bytes))
+            # Match against the in-memory gallery in a single vectorized pass
+            with timer.stage("match"):
+                student_pk, best_distance = hot_sets.match(frame_encoding, bus_id)
 
-            if len(frame.shape) == 3 and frame.shape[2] == 4:  # RGBA format
-                frame = frame[:, :, :3]  # Convert to RGB
+            # Re-encode with jitters only when the cheap encoding is ambiguous
+            escalated = is_ambiguous(best_distance)
+            if escalated:
+                try:
+                    with timer.stage("encode"):
+                        frame_encoding = face_pool.run(
+                            faces.encode_face,
+                            image_bytes,
+                            analysis["locations"][0],
+                            num_jitters=settings.FACE_ESCALATION_JITTERS,
+                        )
+                except PoolBusy:
+                    outcome = "busy"
+                    return busy_response()
+                with timer.stage("match"):
+                    student_pk, best_distance = hot_sets.match(frame_encoding, bus_id)
+            escalation_stats.record(escalated)
+
+            # A sampled share of frames keeps its closest candidates for staff
+            if diagnostics.sampled():
+                diagnostics.record(frame_encoding, bus_id, escalated)
+
+            # On a bus running offline, boardings go to the local journal
+            boarding = board_offline if settings.FARE_OFFLINE_JOURNAL else board
+            with timer.stage("db"):
+                result = boarding(student_pk, best_distance, bus_id)
+            outcome = board_outcome(result)
+            return JsonResponse(result)
 
-            face_locations = face_recognition.face_locations(frame, model="hog")
+        except Exception as e:
+            logger.exception("Face recognition error")
+            return JsonResponse({
+                "status": "error", 
+                "message": f"Error: {str(e)}",
+                "continue": True  # Keep scanning even after errors
+            })
 
-            if not face_locations:
-                return JsonResponse({
-                    "status": "error",
-                    "message": "No face detected. Please position your face clearly in the frame.",
-                    "continue": True  # Tell frontend to keep scanning
-                })
+        finally:
+            timer.observe(bus_id, [outcome])
 
-            if len(face_locations) > 1:
-                return JsonResponse({
-                    "status": "error", 
-                    "message": "Multiple faces detected. Please ensure only your face is in the frame.",
-                    "continue": True
-                })
+    return JsonResponse({
+        "status": "error", 
+        "message": "Invalid request method.",
+        "continue": False  # Stop on invalid method
+    })
 
-            top, right, bottom, left = face_locations[0]
-            face_width = right - left
-            face_height = bottom - top
 
-            if face_width < 50 or face_height < 50:
-                return JsonResponse({
-                    "status": "error",
-                    "message": f"Face too small in image. Please move closer to the camera. (Size: {face_width}x{face_height})",
-                    "continue": True
-                })
+@idempotent
+async def recognize_face_async(request):
+    """Async variant of recognize_face for deployments served by fare_system.asgi.
 
-            frame_encodings = face_recognition.face_encodings(
-                frame, face_locations, num_jitters=3, model="small"
-            )
+    Image work is awaited on the face worker pool and the debounce lookup and
+    fare write use the async ORM, so a waiting kiosk does not hold a thread.
+    """
+    if request.method != "POST":
+        return JsonResponse({
+            "status": "error",
+            "message": "Invalid request method.",
+            "continue": False
+        })
 
-            if not frame_encodings:
-                return JsonResponse({
-                    "status": "error",
-                    "message": "Could not extract facial features. Please try again with better lighting.",
-                    "continue": True
-                })
+    from students import faces
+    from .diagnostics import diagnostics
+    from .hotset import hot_sets
+    from .recognition import (
+        aboard,
+        board_offline,
+        escalation_stats,
+        frame_error,
+        is_ambiguous,
+        no_image,
+    )
+
+    timer = StageTimer()
+    bus_id = None
+    outcome = "error"
+    try:
+        with timer.stage("db"):
+            bus_id = await sync_to_async(driver_bus_id)(await request.auser())
 
-            frame_encoding = frame_encodings[0]  # Use the first detected face
+        with timer.stage("decode"):
+            image_bytes = request_image(request)
 
-            # Debug log for troubleshooting
-            print(f"Frame encoding shape: {frame_encoding.shape}, type: {type(frame_encoding)}")
+        if image_bytes is None:
+            outcome = "no_image"
+            return JsonResponse(no_image())
 
-            # Get all students with face encodings
-            students = Student.objects.filter(
-                models.Q(face_encodings__isnull=False) | 
-                models.Q(face_encoding__isnull=False)
+        try:
+            analysis = await face_pool.arun(
+                faces.analyze_frame,
+                image_bytes,
+                num_jitters=settings.FACE_FIRST_PASS_JITTERS,
+                detect_scale=settings.FACE_DETECTION_SCALE,
             )
-            print(f"Found {students.count()} students with face encodings")
+        except PoolBusy:
+            outcome = "busy"
+            return busy_response()
+        timer.add(analysis["timings"])
 
-            # Debug log - print face distances for diagnostics
-            face_distances = []
+        error = frame_error(analysis)
+        if error:
+            outcome = frame_outcome(analysis)
+            return JsonResponse(error)
 
-            for student in students:
-                try:
-                    # Try to use multiple encodings first (new method)
-                    known_encodings = []
-
-                    if student.face_encodings:
-                        try:
-                            # Parse the JSON array of encodings
-                            encodings_data = json.loads(student.face_encodings)
-                            
-                            for encoding_data in encodings_data:
-                                encoding_bytes = base64.b64decode(encoding_data["encoding"])
-                                known_encoding = np.frombuffer(encoding_bytes, dtype=np.float64)
-                                
-                                # Reshape if needed
-                                if known_encoding.shape[0] != frame_encoding.shape[0]:
-                                    known_encoding = known_encoding.reshape(frame_encoding.shape)
-                                
-                                known_encodings.append(known_encoding)
-
-                        except (json.JSONDecodeError, KeyError, TypeError) as e:
-                            print(f"Error parsing face_encodings for student {student.student_id}: {str(e)}")
-
-                    # Fallback to legacy single encoding if no multiple encodings found
-                    if not known_encodings and student.face_encoding:
-                        known_encoding_bytes = base64.b64decode(student.face_encoding)
-                        known_encoding = np.frombuffer(known_encoding_bytes, dtype=np.float64)
-                        
-                        # Reshape if needed
-                        if known_encoding.shape[0] != frame_encoding.shape[0]:
-                            known_encoding = known_encoding.reshape(frame_encoding.shape)
-                        
-                        known_encodings.append(known_encoding)
-
-                    # Skip if no valid encodings found
-                    if not known_encodings:
-                        continue
-
-                    # Check against each encoding and keep the best match
-                    best_distance = 1.0  # Initialize with worst possible distance
-                    
-                    for known_encoding in known_encodings:
-                        distance = face_recognition.face_distance([known_encoding], frame_encoding)[0]
-                        if distance < best_distance:
-                            best_distance = distance
-
-                    # Add the best match distance
-                    face_distances.append((student, best_distance))
-                    print(f"Best distance for student {student.student_id}: {best_distance}")
-
-                except Exception as e:
-                    print(f"Error processing student {student.student_id}: {str(e)}")
-                    continue
-
-            # Sort by distance (lowest first) and get best match
-            if face_distances:
-                face_distances.sort(key=lambda x: x[1])
-                best_match_student, best_distance = face_distances[0]
-
-                # Use a threshold of 0.6 for better accuracy with multiple encodings
-                if best_distance <= 0.6:
-                    # Found a match
-                    # Check for a recent transaction within the last 30 minutes
-                    last_transaction = Transaction.objects.filter(
-                        student=best_match_student
-                    ).order_by("-timestamp").first()
-                    
-                    current_time = timezone.now()
-
-                    if last_transaction and (current_time - last_transaction.timestamp) < timedelta(minutes=30):
-                        return JsonResponse({
-                            "status": "info",
-                            "message": f"Already checked in within the last 30 minutes. Student: {best_match_student.full_name}",
-                            "student": best_match_student.full_name,
-                            "lastCheckIn": last_transaction.timestamp.isoformat(),
-                            "continue": True  # Keep scanning for other faces
-                        })
-
-                    # Create a new transaction
-                    transaction = Transaction.objects.create(
-                        student=best_match_student,
-                        amount=20,
-                        status="Pending",  # Start as pending, let the save method handle status
+        frame_encoding = analysis["encodings"][0]
+
+        with timer.stage("match"):
+            student_pk, best_distance = await sync_to_async(hot_sets.match)(
+                frame_encoding, bus_id
+            )
+
+        escalated = is_ambiguous(best_distance)
+        if escalated:
+            try:
+                with timer.stage("encode"):
+                    frame_encoding = await face_pool.arun(
+                        faces.encode_face,
+                        image_bytes,
+                        analysis["locations"][0],
+                        num_jitters=settings.FACE_ESCALATION_JITTERS,
                     )
+            except PoolBusy:
+                outcome = "busy"
+                return busy_response()
+            with timer.stage("match"):
+                student_pk, best_distance = await sync_to_async(hot_sets.match)(
+                    frame_encoding, bus_id
+                )
+        escalation_stats.record(escalated)
+
+        if diagnostics.sampled():
+            await sync_to_async(diagnostics.record)(frame_encoding, bus_id, escalated)
+
+        with timer.stage("db"):
+            if settings.FARE_OFFLINE_JOURNAL:
+                result = await sync_to_async(board_offline)(student_pk, best_distance, bus_id)
+            else:
+                result = await aboard(student_pk, best_distance, bus_id)
+        outcome = board_outcome(result)
+        return JsonResponse(result)
+
+    except Exception as e:
+        logger.exception("Face recognition error")
+        return JsonResponse({
+            "status": "error",
+            "message": f"Error: {str(e)}",
+            "continue": True
+        })
 
-                    # Format confidence percentage for user feedback
-                    confidence = (1 - best_distance) * 100
-
-                    if transaction.status == "Approved":
-                        return JsonResponse({
-                            "status": "success",
-                            "message": f"Face recognized: {best_match_student.full_name} (confidence: {confidence:.1f}%). Payment successful. New balance: {best_match_student.balance}",
-                            "student": best_match_student.full_name,
-                            "confidence": confidence,
-                            "balance": best_match_student.balance,
-                            "continue": True  # Keep scanning for other faces
-                        })
-                    else:
-                        return JsonResponse({
-                            "status": "error",
-                            "message": f"Face recognized: {best_match_student.full_name} (confidence: {confidence:.1f}%). Insufficient balance ({best_match_student.balance}).",
-                            "student": best_match_student.full_name,
-                            "confidence": confidence,
-                            "balance": best_match_student.balance,
-                            "continue": True
-                        })
-                else:
-                    # Debug info for close but not matching
-                    if len(face_distances) > 0:
-                        closest_distance = face_distances[0][1]
-                        return JsonResponse({
-                            "status": "error",
-                            "message": f"Face not recognized. Closest match had {(1-closest_distance)*100:.1f}% confidence which is below the threshold. Please try again or re-enroll your face.",
-                            "confidence": (1-closest_distance)*100,
-                            "continue": True
-                        })
+    finally:
+        timer.observe(bus_id, [outcome])
+
+
+def recognize_faces_batch(request):
+    """Board every face in a frame, or a short burst of frames, at once.
 
+    Returns a per-face result list so the kiosk can show everyone's status.
+    """
+    if request.method != "POST":
+        return JsonResponse({
+            "status": "error",
+            "message": "Invalid request method.",
+            "continue": False
+        })
+
+    from students import faces
+    from .recognition import board_burst, no_image
+
+    timer = StageTimer()
+    bus_id = None
+    outcomes = ["error"]
+    try:
+        with timer.stage("db"):
+            bus_id = driver_bus_id(request.user)
+
+        with timer.stage("decode"):
+            frames = request_images(request)[:settings.FACE_BATCH_MAX_FRAMES]
+
+        if not frames:
+            outcomes = ["no_image"]
+            return JsonResponse(no_image())
+
+        try:
+            analysis = face_pool.run(
+                faces.analyze_burst,
+                frames,
+                detect_scale=settings.FACE_DETECTION_SCALE,
+                max_faces=settings.FACE_BATCH_MAX_FACES,
+            )
+        except PoolBusy:
+            outcomes = ["busy"]
+            return busy_response()
+        timer.add(analysis["timings"])
+        faces_found = analysis["faces"]
+
+        if not faces_found:
+            outcomes = ["no_face"]
             return JsonResponse({
                 "status": "error",
-                "message": "Face not recognized. Please try again or enroll your face.",
+                "message": "No face detected. Please position your face clearly in the frame.",
+                "faces": [],
                 "continue": True
             })
 
-        except Exception as e:
-            import traceback
-            print("Face recognition error:", str(e))
-            print(traceback.format_exc())
-            return JsonResponse({
-                "status": "error", 
-                "message": f"Error: {str(e)}",
-                "continue": True  # Keep scanning even after errors
-            })
+        # Matching and boarding happen together in board_burst
+        with timer.stage("db"):
+            results = board_burst(faces_found, bus_id)
+        outcomes = [board_outcome(result) for result in results]
+        boarded = sum(result["status"] == "success" for result in results)
+        return JsonResponse({
+            "status": "batch",
+            "message": f"{boarded} of {len(results)} faces boarded.",
+            "faces": results,
+            "continue": True
+        })
 
-    return JsonResponse({
-        "status": "error", 
-        "message": "Invalid request method.",
-        "continue": False  # Stop on invalid method
-    })
+    except Exception as e:
+        logger.exception("Face recognition error")
+        return JsonResponse({
+            "status": "error",
+            "message": f"Error: {str(e)}",
+            "continue": True
+        })
+
+    finally:
+        timer.observe(bus_id, outcomes)
+
+
+def sync_boardings(request):
+    """Ingest a batch of boardings journaled offline by the driver's bus.
+
+    Expects ``{"boardings": [{"id": uuid, "student": pk, "timestamp": iso}]}``
+    and returns one result per item. Items already ingested are answered
+    with their stored result, so a bus can safely retry an upload.
+    """
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid request method."}, status=405)
+    if not request.user.is_authenticated:
+        return JsonResponse({"status": "error", "message": "Authentication required."}, status=401)
+
+    bus_id = driver_bus_id(request.user)
+    if bus_id is None:
+        return JsonResponse({"status": "error", "message": "No bus assigned to this driver."}, status=403)
+
+    try:
+        items = json.loads(request.body)["boardings"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({"status": "error", "message": "Invalid JSON data"}, status=400)
+    if not isinstance(items, list) or len(items) > settings.FARE_SYNC_MAX_ITEMS:
+        return JsonResponse({
+            "status": "error",
+            "message": f"Expected a list of at most {settings.FARE_SYNC_MAX_ITEMS} boardings.",
+        }, status=400)
+
+    from .offline import ingest
+
+    results = ingest(bus_id, items)
+    return JsonResponse({"status": "success", "results": results})
+
+
+@staff_member_required
+def recognition_stats(request):
+    """Per-process counters of the recognition hot path."""
+    from .hotset import hot_sets
+    from .recognition import escalation_stats
+
+    return JsonResponse({**hot_sets.report(), **escalation_stats.report()})
+
+
+def readiness(request):
+    """Load balancer readiness probe: 200 once recognition is warmed up."""
+    from .warmup import warm_up
+
+    report = warm_up.report()
+    return JsonResponse(report, status=200 if report["ready"] else 503)
+
+
+@staff_member_required
+def recognition_diagnostics(request):
+    """Recent sampled frames with their closest candidates, newest first.
+
+    Only near-misses are listed unless ``?all=1`` is given; ``?bus=<id>``
+    narrows the list to one bus.
+    """
+    from .diagnostics import diagnostics
+
+    bus_id = request.GET.get("bus")
+    return JsonResponse(diagnostics.report(
+        near_misses_only=request.GET.get("all") != "1",
+        bus_id=int(bus_id) if bus_id and bus_id.isdigit() else None,
+    ))
+
+
+def metrics(request):
+    """Prometheus scrape endpoint."""
+    body, content_type = exposition()
+    return HttpResponse(body, content_type=content_type)
 
 
 def driver_dashboard(request):
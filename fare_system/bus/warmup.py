@@ -0,0 +1,78 @@
+"""Warm-up of the recognition path before a process takes kiosk traffic.
+
+The first recognition after a deploy otherwise pays for loading dlib's HOG
+detector and face models and for building the gallery. With
+``FACE_WARM_UP`` set, ``BusConfig.ready`` runs that work on a background
+thread and ``/healthz/ready`` reports 503 until it has finished.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class WarmUp:
+    """Loads the face models and the gallery once per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.started = False
+        self.ready = False
+        self.error = None
+        self.seconds = None
+
+    def start(self):
+        """Run :meth:`run` on a daemon thread; later calls do nothing."""
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+            self._thread = threading.Thread(target=self.run, name="face-warm-up", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        from students import faces
+        from students.gallery import gallery
+        from students.workers import face_pool
+
+        start = time.perf_counter()
+        try:
+            if settings.FACE_WORKER_PROCESSES:
+                # Every worker loads the models in its initializer; wait
+                # until each one has answered before reporting ready
+                face_pool.wait_until_warm(settings.FACE_WARM_UP_TIMEOUT)
+            else:
+                faces.warm_up()
+            gallery.ensure_loaded()
+        except Exception as e:
+            self.error = str(e)
+            logger.exception("Face recognition warm-up failed")
+            return
+        finally:
+            # This thread's connection is never reused
+            connection.close()
+        self.seconds = time.perf_counter() - start
+        self.ready = True
+        logger.info("Face recognition warmed up in %.2fs", self.seconds)
+
+    def report(self):
+        return {
+            "ready": self.is_ready(),
+            "warm_up": settings.FACE_WARM_UP,
+            "started": self.started,
+            "error": self.error,
+            "seconds": self.seconds,
+        }
+
+    def is_ready(self):
+        """Processes without warm-up enabled have nothing to wait for."""
+        return self.ready or not settings.FACE_WARM_UP
+
+
+warm_up = WarmUp()
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from .views import home
+from bus.views import metrics, readiness
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -9,4 +10,6 @@ urlpatterns = [
     path("bus/", include("bus.urls")),  # Bus app
     path("students/", include("students.urls")),  # Students app
     path("users/", include("users.urls")),  # Users app (for login, user management)
+    path("healthz/ready", readiness, name="readiness"),  # Load balancer readiness probe
+    path("metrics", metrics, name="metrics"),  # Prometheus scrape endpoint
 ]
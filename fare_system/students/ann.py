@@ -0,0 +1,111 @@
+"""Approximate nearest-neighbour (IVF) index for large face galleries.
+
+Encodings are partitioned into ``nlist`` coarse clusters with k-means. A query
+only scans the rows of the ``nprobe`` clusters whose centroids are closest to
+it, and the candidates found there are ranked by their exact distance.
+"""
+
+import numpy as np
+
+# Rows per block when assigning vectors to centroids, bounds temporary memory
+ASSIGN_CHUNK = 8192
+
+
+def nearest_centroids(vectors, centroids):
+    """Return the index of the closest centroid for every row of ``vectors``."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = vectors[start:start + ASSIGN_CHUNK]
+        # ||x - c||^2 without the ||x||^2 term, which is constant per row
+        scores = centroid_norms - 2.0 * (block @ centroids.T)
+        labels[start:start + ASSIGN_CHUNK] = np.argmin(scores, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """Coarse k-means quantizer over gallery rows.
+
+    The inverted lists are a ``(order, offsets)`` pair built by
+    :meth:`build_lists`: ``order`` holds gallery rows sorted by cluster and
+    ``offsets[c]:offsets[c + 1]`` is the slice of ``order`` in cluster ``c``.
+    The caller keeps them next to the rows they refer to.
+    """
+
+    def __init__(self, centroids):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float64)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, vectors, nlist, iterations=20, sample_size=None, seed=0):
+        """Run k-means over (a sample of) ``vectors`` and return a new index."""
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist, len(vectors)))
+        sample_size = sample_size or 256 * nlist
+        if len(vectors) > sample_size:
+            vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = nearest_centroids(vectors, centroids)
+            counts = np.bincount(labels, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, vectors)
+            filled = counts > 0
+            # Empty clusters keep their previous centroid
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        return cls(centroids)
+
+    def build_lists(self, assignments):
+        """Return the inverted lists for one cluster label per gallery row."""
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+        return order, offsets.astype(np.int64)
+
+    def candidates(self, query, lists, nprobe):
+        """Return the gallery rows stored in the ``nprobe`` closest clusters."""
+        order, offsets = lists
+        distances = np.linalg.norm(self.centroids - query, axis=1)
+        probe = np.argsort(distances)[:nprobe]
+        return np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+
+    def save(self, path, encoding_ids, assignments):
+        """Persist centroids and the cluster label of every encoding."""
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                encoding_ids=np.asarray(encoding_ids, dtype=np.int64),
+                assignments=np.asarray(assignments, dtype=np.int32),
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Return ``(index, encoding_ids, assignments)`` read from ``path``."""
+        with np.load(path) as data:
+            return cls(data["centroids"]), data["encoding_ids"], data["assignments"]
+
+    def assign(self, encoding_ids, vectors, known_ids, known_assignments):
+        """Label gallery rows, reusing persisted labels where available.
+
+        Rows whose encoding is not in ``known_ids`` (enrolled after the index
+        was built) are assigned to their nearest centroid.
+        """
+        assignments = np.empty(len(encoding_ids), dtype=np.int32)
+        sorter = np.argsort(known_ids)
+        positions = np.searchsorted(known_ids, encoding_ids, sorter=sorter)
+        positions = np.minimum(positions, max(len(known_ids) - 1, 0))
+        found = (
+            known_ids[sorter[positions]] == encoding_ids
+            if len(known_ids)
+            else np.zeros(len(encoding_ids), dtype=bool)
+        )
+        if found.any():
+            assignments[found] = known_assignments[sorter[positions[found]]]
+        if not found.all():
+            assignments[~found] = nearest_centroids(vectors[~found], self.centroids)
+        return assignments
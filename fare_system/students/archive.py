@@ -0,0 +1,224 @@
+"""Daily rollups and cold storage for Transaction rows.
+
+Closed days (before today, in ``TIME_ZONE``) are rolled up into one
+``DailyFareSummary`` per student and day. Raw rows older than the retention
+window are then written to a gzipped JSON Lines file per day under
+``FARE_ARCHIVE_DIR``, recorded in ``TransactionArchive`` and deleted, so the
+table, and every query against it, only holds recent data.
+
+A day's summaries are rebuilt from its raw rows until the day is archived.
+Rows that reach an archived day later (e.g. an offline bus syncing late) are
+added to its summaries and archived in a further file. ``restore_day`` puts
+a day's rows back into the table.
+"""
+
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction as db_transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import DailyFareSummary, Student, Transaction, TransactionArchive
+
+FIELDS = ("id", "student_id", "bus_id", "amount", "timestamp", "status")
+FILE_NAME = "transactions-{day}-{part}.jsonl.gz"
+# Rows per DELETE / INSERT statement
+CHUNK = 500
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def raw_days(before):
+    """Days before ``before`` that still have raw Transaction rows."""
+    start, _ = day_bounds(before)
+    return list(Transaction.objects.filter(timestamp__lt=start).dates("timestamp", "day"))
+
+
+def archived_days(days):
+    return set(TransactionArchive.objects.filter(day__in=days).values_list("day", flat=True))
+
+
+def _summaries(day, totals):
+    return [
+        DailyFareSummary(
+            student_id=student_pk,
+            day=day,
+            approved=approved,
+            declined=declined,
+            amount=amount or 0.0,
+        )
+        for student_pk, (approved, declined, amount) in totals.items()
+    ]
+
+
+def rollup(days):
+    """Rebuild the summaries of ``days`` from their raw rows in one grouped query."""
+    if not days:
+        return 0
+    start, _ = day_bounds(min(days))
+    _, end = day_bounds(max(days))
+    rows = (
+        Transaction.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        .annotate(day=TruncDate("timestamp"))
+        .filter(day__in=days)
+        .values("day", "student_id")
+        .annotate(
+            approved=Count("pk", filter=Q(status="Approved")),
+            declined=Count("pk", filter=Q(status="Declined")),
+            amount=Sum("amount", filter=Q(status="Approved")),
+        )
+        .order_by()
+    )
+    totals = defaultdict(dict)
+    for row in rows:
+        totals[row["day"]][row["student_id"]] = (row["approved"], row["declined"], row["amount"])
+
+    with db_transaction.atomic():
+        DailyFareSummary.objects.filter(day__in=days).delete()
+        summaries = [summary for day, by_student in totals.items() for summary in _summaries(day, by_student)]
+        DailyFareSummary.objects.bulk_create(summaries, batch_size=CHUNK)
+    return len(summaries)
+
+
+def _add_to_summaries(day, totals):
+    existing = {
+        summary.student_id: summary
+        for summary in DailyFareSummary.objects.filter(day=day, student_id__in=list(totals))
+    }
+    new = []
+    for summary in _summaries(day, totals):
+        current = existing.get(summary.student_id)
+        if current is None:
+            new.append(summary)
+            continue
+        current.approved += summary.approved
+        current.declined += summary.declined
+        current.amount += summary.amount
+    DailyFareSummary.objects.bulk_update(existing.values(), ["approved", "declined", "amount"], batch_size=CHUNK)
+    DailyFareSummary.objects.bulk_create(new, batch_size=CHUNK)
+
+
+def _write_rows(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps({**row, "timestamp": row["timestamp"].isoformat()}) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def _read_rows(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            row["timestamp"] = parse_datetime(row["timestamp"])
+            yield row
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def archive_day(day, directory):
+    """Summarize the raw rows of ``day``, move them to a new archive file and
+    delete them. Returns the number of rows moved.
+
+    Raises ValueError for today or a later day, which may still get fares.
+    """
+    if day >= timezone.localdate():
+        raise ValueError(f"{day} is not closed yet; only days before today can be archived.")
+    start, end = day_bounds(day)
+    path = None
+    try:
+        with db_transaction.atomic():
+            rows = list(
+                Transaction.objects.filter(timestamp__gte=start, timestamp__lt=end)
+                .order_by("pk")
+                .values(*FIELDS)
+            )
+            if not rows:
+                return 0
+
+            totals = {}
+            for row in rows:
+                approved, declined, amount = totals.get(row["student_id"], (0, 0, 0.0))
+                if row["status"] == "Approved":
+                    approved, amount = approved + 1, amount + row["amount"]
+                elif row["status"] == "Declined":
+                    declined += 1
+                totals[row["student_id"]] = (approved, declined, amount)
+
+            parts = TransactionArchive.objects.filter(day=day).count()
+            if parts:
+                # Late rows for a day whose earlier rows are already archived
+                _add_to_summaries(day, totals)
+            else:
+                DailyFareSummary.objects.filter(day=day).delete()
+                DailyFareSummary.objects.bulk_create(_summaries(day, totals), batch_size=CHUNK)
+
+            name = FILE_NAME.format(day=day.isoformat(), part=parts)
+            path = os.path.join(directory, name)
+            _write_rows(path, rows)
+            TransactionArchive.objects.create(day=day, path=name, rows=len(rows))
+
+            pks = [row["id"] for row in rows]
+            for i in range(0, len(pks), CHUNK):
+                Transaction.objects.filter(pk__in=pks[i:i + CHUNK]).delete()
+    except BaseException:
+        # The database rolled back; drop the file so it is not restored twice
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        raise
+    return len(rows)
+
+
+def restore_day(day, directory):
+    """Move the archived rows of ``day`` back into the Transaction table.
+
+    Returns ``(restored, skipped)``; rows of students deleted since are
+    skipped, as deleting a student deletes their transactions. The day's
+    summaries are left as they are.
+    """
+    from bus.models import Bus
+
+    archives = list(TransactionArchive.objects.filter(day=day).order_by("pk"))
+    rows = [row for archive in archives for row in _read_rows(os.path.join(directory, archive.path))]
+    students = set(Student.objects.filter(pk__in={row["student_id"] for row in rows}).values_list("pk", flat=True))
+    buses = set(Bus.objects.filter(pk__in={row["bus_id"] for row in rows}).values_list("pk", flat=True))
+
+    transactions = [
+        Transaction(
+            pk=row["id"],
+            student_id=row["student_id"],
+            bus_id=row["bus_id"] if row["bus_id"] in buses else None,
+            amount=row["amount"],
+            status=row["status"],
+        )
+        for row in rows
+        if row["student_id"] in students
+    ]
+    timestamps = {row["id"]: row["timestamp"] for row in rows}
+
+    with db_transaction.atomic():
+        Transaction.objects.bulk_create(transactions, batch_size=CHUNK)
+        # bulk_create stamps auto_now_add fields with the current time
+        for transaction in transactions:
+            transaction.timestamp = timestamps[transaction.pk]
+        Transaction.objects.bulk_update(transactions, ["timestamp"], batch_size=CHUNK)
+        TransactionArchive.objects.filter(pk__in=[archive.pk for archive in archives]).delete()
+
+        paths = [os.path.join(directory, archive.path) for archive in archives]
+        db_transaction.on_commit(lambda: _remove(paths))
+    return len(transactions), len(rows) - len(transactions)
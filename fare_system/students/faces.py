@@ -0,0 +1,147 @@
+"""CPU-heavy face detection and encoding.
+
+This module deliberately avoids importing Django so it can run inside the
+worker processes of ``students.workers``.
+"""
+
+import io
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+
+def load_frame(image_bytes):
+    """Decode an encoded image into an RGB array."""
+    frame = face_recognition.load_image_file(io.BytesIO(image_bytes))
+
+    if len(frame.shape) == 3 and frame.shape[2] == 4:  # RGBA format
+        frame = frame[:, :, :3]  # Convert to RGB
+
+    return frame
+
+
+def detect_faces(frame, scale=1.0):
+    """Run HOG detection on a copy of ``frame`` resized by ``scale``.
+
+    HOG cost grows with pixel count, so detecting on a reduced image is much
+    cheaper. The returned boxes are mapped back to ``frame`` coordinates.
+    """
+    if scale >= 1.0:
+        return face_recognition.face_locations(frame, model="hog")
+
+    height, width = frame.shape[:2]
+    small = cv2.resize(
+        frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+        interpolation=cv2.INTER_AREA,
+    )
+    return [
+        (
+            max(0, round(top / scale)),
+            min(width, round(right / scale)),
+            min(height, round(bottom / scale)),
+            max(0, round(left / scale)),
+        )
+        for top, right, bottom, left in face_recognition.face_locations(small, model="hog")
+    ]
+
+
+def encode_locations(frame, locations, num_jitters=3):
+    """Encode the faces at known ``locations`` of a decoded frame."""
+    # IMPORTANT: Use the SAME model and jitters for enrollment and recognition
+    return face_recognition.face_encodings(
+        frame, locations, num_jitters=num_jitters, model="small"
+    )
+
+
+def analyze_frame(
+    image_bytes, num_jitters=3, min_image_size=0, min_face_size=50, detect_scale=1.0
+):
+    """Detect faces in an encoded image and encode a single usable face.
+
+    Detection runs at ``detect_scale`` while the encoding is always computed
+    from the original-resolution frame. Returns a dict with the image
+    ``shape`` (height, width), every detected face ``locations`` in original
+    coordinates and the ``encodings`` list, which is only filled when exactly
+    one face of at least ``min_face_size`` pixels was found. ``timings``
+    holds the seconds spent in the ``decode``, ``detect`` and ``encode``
+    stages that ran.
+    """
+    start = time.perf_counter()
+    frame = load_frame(image_bytes)
+    timings = {"decode": time.perf_counter() - start}
+    result = {"shape": frame.shape[:2], "locations": [], "encodings": [], "timings": timings}
+
+    if frame.shape[0] < min_image_size or frame.shape[1] < min_image_size:
+        return result
+
+    start = time.perf_counter()
+    locations = detect_faces(frame, detect_scale)
+    timings["detect"] = time.perf_counter() - start
+    result["locations"] = locations
+    if len(locations) != 1:
+        return result
+
+    top, right, bottom, left = locations[0]
+    if right - left < min_face_size or bottom - top < min_face_size:
+        return result
+
+    start = time.perf_counter()
+    result["encodings"] = encode_locations(frame, locations, num_jitters)
+    timings["encode"] = time.perf_counter() - start
+    return result
+
+
+def encode_face(image_bytes, location, num_jitters=3):
+    """Encode the face at a known ``location``, skipping detection."""
+    return encode_locations(load_frame(image_bytes), [location], num_jitters)[0]
+
+
+def analyze_burst(
+    frames, num_jitters=3, min_face_size=50, detect_scale=1.0, max_faces=10
+):
+    """Detect and encode every face in a short burst of encoded images.
+
+    All usable faces of a frame are encoded in one ``face_encodings`` call.
+    Returns a dict with one ``faces`` entry per detected face, holding its
+    ``frame`` index, ``location`` and ``encoding`` (None for faces smaller
+    than ``min_face_size``), and the ``timings`` of the ``decode``,
+    ``detect`` and ``encode`` stages summed over the burst.
+    """
+    results = []
+    timings = {"decode": 0.0, "detect": 0.0, "encode": 0.0}
+    for index, image_bytes in enumerate(frames):
+        start = time.perf_counter()
+        frame = load_frame(image_bytes)
+        timings["decode"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        locations = detect_faces(frame, detect_scale)[:max_faces]
+        timings["detect"] += time.perf_counter() - start
+        usable = [
+            location
+            for location in locations
+            if location[1] - location[3] >= min_face_size
+            and location[2] - location[0] >= min_face_size
+        ]
+
+        start = time.perf_counter()
+        encodings = iter(encode_locations(frame, usable, num_jitters) if usable else [])
+        timings["encode"] += time.perf_counter() - start
+        for location in locations:
+            results.append(
+                {
+                    "frame": index,
+                    "location": location,
+                    "encoding": next(encodings) if location in usable else None,
+                }
+            )
+    return {"faces": results, "timings": timings}
+
+
+def warm_up():
+    """Run one detection and encoding so dlib's models are loaded and ready."""
+    frame = np.zeros((160, 160, 3), dtype=np.uint8)
+    face_recognition.face_locations(frame, model="hog")
+    face_recognition.face_encodings(frame, [(20, 140, 140, 20)], model="small")
@@ -0,0 +1,375 @@
+"""In-memory gallery of enrolled face encodings used for recognition."""
+
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from . import snapshots
+from .ann import IVFIndex, nearest_centroids
+from .layers import TOMBSTONE, LayeredMatrix
+from .models import FaceEncoding, GalleryChange
+from .pruning import StudentCentroids
+from .quantization import QuantizedMatrix, row_distances
+
+ENCODING_SIZE = 128
+
+# Maximum face distance accepted as a match
+MATCH_THRESHOLD = 0.6
+
+# Size in bytes of one packed float64 encoding
+VECTOR_BYTES = ENCODING_SIZE * np.dtype(np.float64).itemsize
+
+
+def pack_encoding(encoding):
+    """Return the bytes stored in ``FaceEncoding.vector`` for an encoding."""
+    return np.ascontiguousarray(encoding, dtype=np.float64).tobytes()
+
+
+def read_encodings(encodings):
+    """Stream FaceEncoding rows into ``(vectors, student_ids, encoding_ids)``."""
+    blobs = []
+    student_ids = []
+    encoding_ids = []
+    for pk, student_id, vector in encodings.values_list("pk", "student_id", "vector").iterator():
+        if len(vector) == VECTOR_BYTES:
+            blobs.append(vector)
+            student_ids.append(student_id)
+            encoding_ids.append(pk)
+
+    vectors = np.frombuffer(b"".join(blobs), dtype=np.float64).reshape(-1, ENCODING_SIZE)
+    return (
+        vectors,
+        np.asarray(student_ids, dtype=np.int64),
+        np.asarray(encoding_ids, dtype=np.int64),
+    )
+
+
+class FaceGallery:
+    """Every enrolled encoding stacked into one contiguous matrix.
+
+    ``vectors`` has one row per stored encoding and ``student_ids`` maps each
+    row back to the primary key of the owning Student, so a frame is matched
+    with a single vectorized distance computation and no model instances are
+    loaded until a match is confirmed.
+
+    With ``FACE_CENTROID_PRUNING`` set, single best-match searches first
+    compare the frame with each student's centroid and skip students that
+    cannot beat the best distance found (see ``students.pruning``).
+
+    ``FACE_GALLERY_PRECISION`` may store the matrix as float16 or int8 (see
+    ``students.quantization``) to cut memory; the database keeps float64.
+
+    Changes are applied without copying the loaded matrix, which may be a
+    shared snapshot: the changed students' rows are tombstoned and their
+    current rows kept in a small float64 delta (see ``students.layers``).
+    The matrix is compacted into a private copy only once half of the loaded
+    rows are tombstones.
+
+    When ``FACE_ANN_ENABLED`` is set and a persisted index exists, galleries of
+    at least ``FACE_ANN_MIN_GALLERY_SIZE`` rows are searched through the IVF
+    index instead of a full scan.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.vectors = np.empty((0, ENCODING_SIZE), dtype=np.float64)
+        self.student_ids = np.empty(0, dtype=np.int64)
+        self.encoding_ids = np.empty(0, dtype=np.int64)
+        self.ann = None
+        self.assignments = None
+        self.ann_lists = None
+        self.centroids = None
+        self.tombstones = 0
+        self.version = 0
+        # Bumped whenever the row layout changes, so callers caching row
+        # subsets know when to rebuild them
+        self.generation = 0
+        self.loaded = False
+        self._last_sync = 0.0
+        self._snapshot_mtime = None
+
+    def __len__(self):
+        return len(self.student_ids) - self.tombstones
+
+    def load(self):
+        """Build the gallery from the shared snapshot, or else the database.
+
+        Snapshot arrays are memory-mapped read-only and shared with every
+        other worker; changes recorded after the snapshot was written are
+        applied on top as deltas.
+        """
+        snapshot_dir = settings.FACE_GALLERY_SNAPSHOT_DIR
+        snapshot_mtime = snapshots.manifest_mtime(snapshot_dir)
+        manifest = snapshots.read_manifest(snapshot_dir) if snapshot_mtime else None
+
+        if manifest is not None:
+            vectors, student_ids, encoding_ids = snapshots.load_snapshot(snapshot_dir, manifest)
+            version = manifest["version"]
+        else:
+            # Read the version first: changes made while loading are re-applied
+            # by the next sync, which is harmless because updates are idempotent.
+            version = GalleryChange.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+            vectors, student_ids, encoding_ids = read_encodings(FaceEncoding.objects.all())
+
+        ann, assignments, ann_lists = None, None, None
+        if settings.FACE_ANN_ENABLED and os.path.exists(settings.FACE_ANN_INDEX_PATH):
+            ann, known_ids, known_assignments = IVFIndex.load(settings.FACE_ANN_INDEX_PATH)
+            assignments = ann.assign(encoding_ids, vectors, known_ids, known_assignments)
+            ann_lists = ann.build_lists(assignments)
+
+        with self._lock:
+            self.vectors = self._store(vectors)
+            self.student_ids = student_ids
+            self.encoding_ids = encoding_ids
+            self.ann = ann
+            self.assignments = assignments
+            self.ann_lists = ann_lists
+            self.centroids = self._build_centroids(self.vectors, student_ids)
+            self.tombstones = 0
+            self.version = version
+            self.generation += 1
+            self.loaded = True
+            self._last_sync = time.monotonic()
+            self._snapshot_mtime = snapshot_mtime
+
+        if manifest is not None:
+            self.sync(force=True)
+
+    def update_students(self, student_pks):
+        """Replace the rows of the given students with their current encodings.
+
+        Students that were deleted or have no encodings left simply lose their rows.
+        """
+        student_pks = list(student_pks)
+        vectors, student_ids, encoding_ids = read_encodings(
+            FaceEncoding.objects.filter(student_id__in=student_pks)
+        )
+        with self._lock:
+            if isinstance(self.vectors, LayeredMatrix):
+                base, delta = self.vectors.base, self.vectors.delta
+            else:
+                base, delta = self.vectors, np.empty((0, ENCODING_SIZE), dtype=np.float64)
+            split = len(base)
+            stale = np.isin(self.student_ids, student_pks)
+            in_base, keep_delta = stale[:split], ~stale[split:]
+
+            # Base rows are tombstoned in place; changed rows go to the delta
+            self.vectors = LayeredMatrix(base, np.concatenate([delta[keep_delta], vectors]))
+            self.student_ids = np.concatenate([
+                np.where(in_base, TOMBSTONE, self.student_ids[:split]),
+                self.student_ids[split:][keep_delta],
+                student_ids,
+            ])
+            self.encoding_ids = np.concatenate([
+                np.where(in_base, TOMBSTONE, self.encoding_ids[:split]),
+                self.encoding_ids[split:][keep_delta],
+                encoding_ids,
+            ])
+            if self.ann is not None:
+                self.assignments = np.concatenate([
+                    np.where(in_base, -1, self.assignments[:split]),
+                    self.assignments[split:][keep_delta],
+                    nearest_centroids(vectors, self.ann.centroids),
+                ])
+                self.ann_lists = self.ann.build_lists(self.assignments)
+            keep = np.concatenate([np.ones(split, dtype=bool), keep_delta])
+            self.centroids = self._update_centroids(keep, student_pks, vectors, student_ids)
+            self.tombstones = int(np.count_nonzero(self.student_ids[:split] == TOMBSTONE))
+            if self.tombstones > split // 2:
+                self._compact()
+            self.generation += 1
+
+    def _compact(self):
+        """Fold the delta into a private matrix without tombstones."""
+        live = self.student_ids != TOMBSTONE
+        base, delta = self.vectors.base, self.vectors.delta
+        split = len(base)
+        if isinstance(base, QuantizedMatrix):
+            self.vectors = base.select(live[:split]).append(delta)
+        else:
+            self.vectors = np.concatenate([base[live[:split]], delta])
+        self.student_ids = self.student_ids[live]
+        self.encoding_ids = self.encoding_ids[live]
+        if self.ann is not None:
+            self.assignments = self.assignments[live]
+            self.ann_lists = self.ann.build_lists(self.assignments)
+        self.centroids = self._build_centroids(self.vectors, self.student_ids)
+        self.tombstones = 0
+
+    @staticmethod
+    def _store(vectors):
+        """Keep vectors as float64, or quantized per ``FACE_GALLERY_PRECISION``."""
+        if settings.FACE_GALLERY_PRECISION == "float64":
+            return np.ascontiguousarray(vectors, dtype=np.float64)
+        return QuantizedMatrix.from_float(vectors, settings.FACE_GALLERY_PRECISION)
+
+    @staticmethod
+    def _build_centroids(vectors, student_ids):
+        if not settings.FACE_CENTROID_PRUNING or not len(student_ids):
+            return None
+        return StudentCentroids(vectors, student_ids)
+
+    def _update_centroids(self, keep, student_pks, vectors, student_ids):
+        """Recompute the changed students' centroids only, rebuilding from
+        scratch once retired groups outnumber the students."""
+        if self.centroids is None or not len(self.student_ids):
+            return self._build_centroids(self.vectors, self.student_ids)
+        centroids = self.centroids.replace(keep, student_pks, vectors, student_ids)
+        if centroids.retired > len(centroids.groups) - centroids.retired:
+            return self._build_centroids(self.vectors, self.student_ids)
+        return centroids
+
+    def sync(self, force=False):
+        """Apply changes recorded by any process since this gallery's version.
+
+        A newly published snapshot is swapped in instead. The version check is
+        throttled to ``FACE_GALLERY_SYNC_INTERVAL`` seconds unless ``force`` is
+        set. A gallery that was never loaded is left alone.
+        """
+        if not self.loaded:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_sync < settings.FACE_GALLERY_SYNC_INTERVAL:
+            return
+        self._last_sync = now
+
+        snapshot_mtime = snapshots.manifest_mtime(settings.FACE_GALLERY_SNAPSHOT_DIR)
+        if snapshot_mtime is not None and snapshot_mtime != self._snapshot_mtime:
+            self.load()
+            return
+
+        changes = list(
+            GalleryChange.objects.filter(pk__gt=self.version)
+            .order_by("pk")
+            .values_list("pk", "student_pk")
+        )
+        if not changes:
+            return
+
+        self.update_students({student_pk for _, student_pk in changes})
+        self.version = changes[-1][0]
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+        else:
+            self.sync()
+
+    def invalidate(self):
+        """Force a full rebuild on the next match."""
+        self.loaded = False
+
+    def subset(self, student_pks):
+        """Return ``(vectors, student_ids, generation)`` for the given students only.
+
+        The vectors are a compact copy, suitable for caching until
+        ``generation`` changes.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            vectors, student_ids, generation = self.vectors, self.student_ids, self.generation
+        rows = np.flatnonzero(np.isin(student_ids, student_pks))
+        return np.ascontiguousarray(vectors[rows]), student_ids[rows], generation
+
+    def search(self, encoding, k=1, exact=False):
+        """Return up to ``k`` ``(student_pk, distance)`` pairs, closest first.
+
+        Candidates from the ANN index are re-ranked by their exact distance, so
+        the returned distances can be compared directly with ``MATCH_THRESHOLD``.
+        """
+        self.ensure_loaded()
+
+        # Take a consistent snapshot in case another thread swaps the arrays
+        with self._lock:
+            vectors, student_ids = self.vectors, self.student_ids
+            ann, ann_lists = self.ann, self.ann_lists
+            centroids, tombstones = self.centroids, self.tombstones
+
+        if len(student_ids) == tombstones:
+            return []
+
+        use_ann = (
+            not exact
+            and ann is not None
+            and len(student_ids) - tombstones >= settings.FACE_ANN_MIN_GALLERY_SIZE
+        )
+        if k == 1 and centroids is not None and not use_ann:
+            row, distance, _ = centroids.nearest(vectors, encoding)
+            return [] if row is None else [(int(student_ids[row]), distance)]
+
+        rows = None
+        if use_ann:
+            rows = ann.candidates(encoding, ann_lists, settings.FACE_ANN_NPROBE)
+            if not len(rows):
+                return []
+            vectors = vectors[rows]
+
+        distances = row_distances(vectors, encoding)
+        if tombstones and rows is None:
+            distances[student_ids == TOMBSTONE] = np.inf
+            k = min(k, len(student_ids) - tombstones)
+        k = min(k, len(distances))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        if rows is not None:
+            hits = rows[best]
+        else:
+            hits = best
+        return [
+            (int(student_ids[row]), float(distance))
+            for row, distance in zip(hits, distances[best])
+        ]
+
+    def match_many(self, encodings):
+        """Match several encodings at once; returns one ``match`` result each.
+
+        With exact search all queries are compared with the gallery in a
+        single matrix product.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            vectors, student_ids, ann = self.vectors, self.student_ids, self.ann
+            tombstones = self.tombstones
+
+        if len(student_ids) == tombstones:
+            return [(None, None)] * len(encodings)
+        if ann is not None and len(student_ids) - tombstones >= settings.FACE_ANN_MIN_GALLERY_SIZE:
+            return [self.match(encoding) for encoding in encodings]
+
+        if not isinstance(vectors, np.ndarray):
+            distances = np.stack([vectors.distances(encoding) for encoding in encodings])
+            if tombstones:
+                distances[:, student_ids == TOMBSTONE] = np.inf
+            rows = np.argmin(distances, axis=1)
+            return [
+                (int(student_ids[row]), float(distances[i, row]))
+                for i, row in enumerate(rows)
+            ]
+
+        queries = np.asarray(encodings, dtype=np.float64)
+        # ||q - v||^2 = ||q||^2 - 2 q.v + ||v||^2
+        squared = (
+            np.einsum("ij,ij->i", queries, queries)[:, None]
+            - 2.0 * (queries @ vectors.T)
+            + np.einsum("ij,ij->i", vectors, vectors)[None, :]
+        )
+        rows = np.argmin(squared, axis=1)
+        distances = np.sqrt(np.maximum(squared[np.arange(len(rows)), rows], 0.0))
+        return [
+            (int(student_ids[row]), float(distance))
+            for row, distance in zip(rows, distances)
+        ]
+
+    def match(self, encoding):
+        """Return ``(student_pk, distance)`` of the closest stored encoding.
+
+        Returns ``(None, None)`` when the gallery is empty.
+        """
+        results = self.search(encoding, k=1)
+        return results[0] if results else (None, None)
+
+
+gallery = FaceGallery()
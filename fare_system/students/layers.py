@@ -0,0 +1,58 @@
+"""Gallery rows split into a shared base and a small private delta.
+
+A gallery loaded from a memory-mapped snapshot must never write to or copy
+the snapshot, or every worker ends up with its own copy of the pages. Rows
+of students changed since the snapshot are therefore tombstoned in place
+(their student id becomes ``TOMBSTONE``) and the students' current rows go
+to a separate delta matrix that searches cover as well.
+"""
+
+import numpy as np
+
+from .quantization import row_distances
+
+# Student id of a base row whose student changed after the base was built
+TOMBSTONE = -1
+
+
+class LayeredMatrix:
+    """Read-only ``base`` rows followed by ``delta`` rows, addressed as one matrix.
+
+    Row ``i`` is ``base[i]`` below ``len(base)`` and ``delta[i - len(base)]``
+    after it. Indexing returns float64 rows like :class:`QuantizedMatrix`.
+    """
+
+    def __init__(self, base, delta):
+        self.base = base
+        self.delta = delta
+
+    @property
+    def shape(self):
+        return (len(self.base) + len(self.delta), self.base.shape[1])
+
+    @property
+    def nbytes(self):
+        return self.base.nbytes + self.delta.nbytes
+
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            rows = np.arange(len(self))[index]
+        else:
+            rows = np.asarray(index)
+            if rows.dtype == bool:
+                rows = np.flatnonzero(rows)
+        split = len(self.base)
+        out = np.empty((len(rows), self.shape[1]), dtype=np.float64)
+        in_base = rows < split
+        if in_base.any():
+            out[in_base] = self.base[rows[in_base]]
+        if not in_base.all():
+            out[~in_base] = self.delta[rows[~in_base] - split]
+        return out
+
+    def distances(self, query):
+        """Euclidean distance from ``query`` to every row."""
+        return np.concatenate([row_distances(self.base, query), row_distances(self.delta, query)])
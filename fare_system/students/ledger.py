@@ -0,0 +1,200 @@
+"""Balance ledger.
+
+Every balance change is a single ``UPDATE ... SET balance = balance ± X``
+evaluated by the database, so concurrent fares and top-ups never overwrite
+each other, and a debit only succeeds while ``balance >= X``. A fare's debit
+and its ``Transaction`` row are committed together.
+
+With ``FARE_GROUP_COMMIT`` set, fares charged outside an atomic block are
+handed to :class:`FareBatcher`, which commits everything that arrives within
+``FARE_GROUP_COMMIT_WINDOW`` seconds in one database transaction.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import connection
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+
+from .models import Student, Transaction
+
+logger = logging.getLogger(__name__)
+
+
+def debit(student_pk, amount):
+    """Deduct ``amount`` if the balance covers it; returns True if deducted."""
+    return bool(
+        Student.objects.filter(pk=student_pk, balance__gte=amount).update(
+            balance=F("balance") - amount
+        )
+    )
+
+
+def credit(student_pk, amount):
+    """Add ``amount`` to a student's balance."""
+    Student.objects.filter(pk=student_pk).update(balance=F("balance") + amount)
+
+
+def balance(student_pk):
+    return Student.objects.values_list("balance", flat=True).get(pk=student_pk)
+
+
+def charge_fare(student, amount, bus_id=None):
+    """Charge a fare and record it, in one commit.
+
+    Returns the saved Transaction, ``Approved`` if the balance covered the
+    fare and ``Declined`` otherwise. ``student.balance`` is refreshed. The
+    fare is durable when this returns, with or without group commit.
+    """
+    if settings.FARE_GROUP_COMMIT and not connection.in_atomic_block:
+        return fare_batcher.charge(student, amount, bus_id)
+    return _charge_now(student, amount, bus_id)
+
+
+def _charge_now(student, amount, bus_id):
+    with db_transaction.atomic():
+        approved = debit(student.pk, amount)
+        transaction = Transaction(
+            student=student,
+            bus_id=bus_id,
+            amount=amount,
+            status="Approved" if approved else "Declined",
+        )
+        transaction.save()
+        student.balance = balance(student.pk)
+    return transaction
+
+
+class FareBatcher:
+    """Group commit of fares from many request threads.
+
+    Callers enqueue a fare and block on a future. A single writer thread
+    collects fares for up to ``FARE_GROUP_COMMIT_WINDOW`` seconds (or
+    ``FARE_GROUP_COMMIT_MAX_BATCH`` fares), then in one transaction debits
+    each student once for the sum of their fares, inserts every row with
+    ``bulk_create`` and reads the new balances back. If a batch fails, its
+    fares are retried one by one so a single bad row fails only its caller.
+
+    A caller that waits longer than ``FARE_GROUP_COMMIT_TIMEOUT`` withdraws
+    its fare if the writer has not picked it up yet and charges it directly;
+    otherwise it keeps waiting for the commit in progress. Either way it
+    gets the fare's actual outcome.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def charge(self, student, amount, bus_id=None):
+        self._start()
+        future = Future()
+        self._queue.put((student, amount, bus_id, future))
+        try:
+            return future.result(timeout=settings.FARE_GROUP_COMMIT_TIMEOUT)
+        except FutureTimeoutError:
+            if future.cancel():
+                # The writer will skip it, so it was never charged
+                return _charge_now(student, amount, bus_id)
+            # Already in a batch being committed
+            return future.result()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="fare-group-commit", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + settings.FARE_GROUP_COMMIT_WINDOW
+                while len(batch) < settings.FARE_GROUP_COMMIT_MAX_BATCH:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+                # Skip fares their callers withdrew after timing out
+                batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    logger.exception("Group commit writer failed a batch")
+                    for _, _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            # Let the next fare start a new writer
+            with self._lock:
+                self._thread = None
+
+    def _flush(self, batch):
+        try:
+            transactions = self._commit(batch)
+        except Exception:
+            connection.close_if_unusable_or_obsolete()
+            for student, amount, bus_id, future in batch:
+                try:
+                    future.set_result(_charge_now(student, amount, bus_id))
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        for (_, _, _, future), transaction in zip(batch, transactions):
+            future.set_result(transaction)
+
+    def _commit(self, batch):
+        fares = defaultdict(list)
+        for index, (student, amount, _, _) in enumerate(batch):
+            fares[student.pk].append(index)
+
+        approved = [False] * len(batch)
+        with db_transaction.atomic():
+            for student_pk, indexes in fares.items():
+                if debit(student_pk, sum(batch[i][1] for i in indexes)):
+                    for i in indexes:
+                        approved[i] = True
+                else:
+                    # Not enough for all of them: charge in arrival order
+                    for i in indexes:
+                        approved[i] = debit(student_pk, batch[i][1])
+
+            transactions = Transaction.objects.bulk_create(
+                Transaction(
+                    student=student,
+                    bus_id=bus_id,
+                    amount=amount,
+                    status="Approved" if ok else "Declined",
+                )
+                for (student, amount, bus_id, _), ok in zip(batch, approved)
+            )
+            # bulk_create skips signals; receivers such as the recent-boarding
+            # index still need to see every new row
+            for transaction in transactions:
+                post_save.send(
+                    sender=Transaction, instance=transaction, created=True,
+                    raw=False, using=connection.alias, update_fields=None,
+                )
+
+            balances = dict(Student.objects.filter(pk__in=list(fares)).values_list("pk", "balance"))
+
+        for student, _, _, _ in batch:
+            student.balance = balances[student.pk]
+        return transactions
+
+
+fare_batcher = FareBatcher()
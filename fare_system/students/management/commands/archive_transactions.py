@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from students.archive import archive_day, archived_days, raw_days, restore_day, rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll closed days of Transactions up into per-student daily summaries "
+        "and move raw rows older than the retention window to compressed "
+        "files in FARE_ARCHIVE_DIR. Run it daily. With --restore DAY, put an "
+        "archived day back into the Transaction table; it is archived again "
+        "on the next run unless the retention window now covers it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-days", type=int, default=settings.FARE_ARCHIVE_RETENTION_DAYS,
+            help="Days of raw Transactions to keep in the table.",
+        )
+        parser.add_argument("--restore", metavar="YYYY-MM-DD", help="Restore the archived rows of this day.")
+
+    def handle(self, *args, **options):
+        directory = str(settings.FARE_ARCHIVE_DIR)
+
+        if options["restore"]:
+            day = parse_date(options["restore"])
+            if day is None:
+                raise CommandError("--restore expects a date as YYYY-MM-DD.")
+            restored, skipped = restore_day(day, directory)
+            self.stdout.write(f"Restored {restored} transactions of {day}" + (f", skipped {skipped} of deleted students." if skipped else "."))
+            return
+
+        if options["retention_days"] < 1:
+            raise CommandError("--retention-days must be at least 1.")
+        today = timezone.localdate()
+        cutoff = today - timedelta(days=options["retention_days"])
+
+        days = raw_days(today)
+        archived = archived_days(days)
+        recent_days = [day for day in days if day >= cutoff and day not in archived]
+        summaries = rollup(recent_days)
+
+        moved = moved_days = 0
+        for day in days:
+            if day < cutoff:
+                rows = archive_day(day, directory)
+                moved += rows
+                moved_days += rows > 0
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {len(recent_days)} recent days into {summaries} summaries; "
+            f"archived {moved} transactions from {moved_days} days before {cutoff}."
+        ))
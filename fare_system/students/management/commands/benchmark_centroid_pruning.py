@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from students.gallery import ENCODING_SIZE, read_encodings
+from students.models import FaceEncoding
+from students.pruning import StudentCentroids
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare encodings compared per frame, and latency, for a full scan "
+        "versus centroid/radius pruning, on the enrolled gallery or a "
+        "synthetic one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--synthetic", type=int, help="Generate this many synthetic students instead of using the database.")
+        parser.add_argument("--angles", type=int, default=5, help="Angles per synthetic student.")
+        parser.add_argument("--queries", type=int, default=200, help="Number of query frames.")
+        parser.add_argument("--noise", type=float, default=0.03, help="Std-dev of noise added to sampled encodings to form queries.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        if options["synthetic"]:
+            students, angles = options["synthetic"], options["angles"]
+            centers = rng.normal(0, 0.15, (students, ENCODING_SIZE))
+            vectors = np.repeat(centers, angles, axis=0) + rng.normal(0, 0.03, (students * angles, ENCODING_SIZE))
+            student_ids = np.repeat(np.arange(students), angles)
+        else:
+            vectors, student_ids, _ = read_encodings(FaceEncoding.objects.all())
+        if not len(vectors):
+            raise CommandError("No face encodings enrolled; use --synthetic.")
+
+        centroids = StudentCentroids(vectors, student_ids)
+        samples = rng.choice(len(vectors), min(options["queries"], len(vectors)), replace=False)
+        queries = vectors[samples] + rng.normal(0, options["noise"], (len(samples), ENCODING_SIZE))
+
+        full_times, pruned_times, compared, mismatches = [], [], [], 0
+        for query in queries:
+            start = time.perf_counter()
+            distances = np.linalg.norm(vectors - query, axis=1)
+            full_row = int(np.argmin(distances))
+            full_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            row, distance, count = centroids.nearest(vectors, query)
+            pruned_times.append(time.perf_counter() - start)
+
+            compared.append(count)
+            mismatches += not np.isclose(distance, distances[full_row])
+
+        self.stdout.write(
+            f"Gallery: {len(vectors)} encodings, {len(centroids.groups)} students, {len(queries)} queries"
+        )
+        self.stdout.write(f"Full scan: {len(vectors)} comparisons/frame, {np.mean(full_times) * 1000:.3f} ms/frame")
+        self.stdout.write(
+            f"Pruned:    {np.mean(compared):.0f} comparisons/frame "
+            f"(min {np.min(compared)}, max {np.max(compared)}), {np.mean(pruned_times) * 1000:.3f} ms/frame"
+        )
+        self.stdout.write(f"Best distance differs from full scan: {mismatches} queries")
@@ -0,0 +1,84 @@
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from students import faces
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def largest_box(locations):
+    return max(locations, key=lambda box: (box[1] - box[3]) * (box[2] - box[0]))
+
+
+def box_iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda box: (box[1] - box[3]) * (box[2] - box[0])
+    union = area(a) + area(b) - inter
+    return inter / union if union else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure HOG detection latency and detection rate at several "
+        "FACE_DETECTION_SCALE values over a set of captured frames."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Image files or directories of frames.")
+        parser.add_argument(
+            "--scales", default="1.0,0.75,0.5,0.35", help="Comma-separated scales to compare."
+        )
+
+    def handle(self, *args, **options):
+        paths = []
+        for path in options["paths"]:
+            if os.path.isdir(path):
+                paths.extend(
+                    os.path.join(path, name)
+                    for name in sorted(os.listdir(path))
+                    if name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+            else:
+                paths.append(path)
+        if not paths:
+            raise CommandError("No images found.")
+
+        frames = []
+        for path in paths:
+            with open(path, "rb") as f:
+                frames.append(faces.load_frame(f.read()))
+
+        # Full-resolution detections are the reference for every scale
+        reference = [faces.detect_faces(frame) for frame in frames]
+        scales = [float(scale) for scale in options["scales"].split(",")]
+
+        self.stdout.write(
+            f"{len(frames)} frames, current FACE_DETECTION_SCALE = {settings.FACE_DETECTION_SCALE}"
+        )
+        self.stdout.write(
+            f"{'scale':>6} {'mean ms':>8} {'p95 ms':>8} {'detected':>9} {'same count':>11} {'mean IoU':>9}"
+        )
+        for scale in scales:
+            timings, detected, same_count, ious = [], 0, 0, []
+            for frame, expected in zip(frames, reference):
+                start = time.perf_counter()
+                locations = faces.detect_faces(frame, scale)
+                timings.append((time.perf_counter() - start) * 1000)
+
+                detected += bool(locations)
+                same_count += len(locations) == len(expected)
+                if locations and expected:
+                    ious.append(box_iou(largest_box(locations), largest_box(expected)))
+
+            total = len(frames)
+            self.stdout.write(
+                f"{scale:>6.2f} {np.mean(timings):>8.1f} {np.percentile(timings, 95):>8.1f} "
+                f"{detected / total:>9.1%} {same_count / total:>11.1%} "
+                f"{(np.mean(ious) if ious else 0.0):>9.3f}"
+            )
@@ -0,0 +1,83 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from students.ann import IVFIndex
+from students.gallery import MATCH_THRESHOLD, read_encodings
+from students.models import FaceEncoding
+
+
+class Command(BaseCommand):
+    help = (
+        "Build and persist the IVF index used for approximate face search, "
+        "then report recall and latency against exact search."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nlist", type=int, help="Number of clusters (default: 4 * sqrt(rows)).")
+        parser.add_argument("--iterations", type=int, default=20, help="k-means iterations.")
+        parser.add_argument("--nprobe", type=int, default=settings.FACE_ANN_NPROBE, help="Clusters probed per query in the report.")
+        parser.add_argument("--queries", type=int, default=500, help="Number of report queries.")
+        parser.add_argument("--noise", type=float, default=0.03, help="Std-dev of noise added to sampled encodings to form report queries.")
+        parser.add_argument("--output", default=str(settings.FACE_ANN_INDEX_PATH), help="Where to write the index.")
+
+    def handle(self, *args, **options):
+        vectors, student_ids, encoding_ids = read_encodings(FaceEncoding.objects.all())
+        if not len(vectors):
+            raise CommandError("No face encodings enrolled; nothing to index.")
+
+        nlist = options["nlist"] or max(1, int(4 * np.sqrt(len(vectors))))
+        start = time.perf_counter()
+        index = IVFIndex.train(vectors, nlist, iterations=options["iterations"])
+        assignments = index.assign(encoding_ids, vectors, np.empty(0, dtype=np.int64), None)
+        index.save(options["output"], encoding_ids, assignments)
+        self.stdout.write(
+            f"Indexed {len(vectors)} encodings into {index.nlist} clusters "
+            f"in {time.perf_counter() - start:.1f}s -> {options['output']}"
+        )
+
+        self.report(index, index.build_lists(assignments), vectors, student_ids, options)
+
+    def report(self, index, lists, vectors, student_ids, options):
+        rng = np.random.default_rng(0)
+        samples = rng.choice(len(vectors), min(options["queries"], len(vectors)), replace=False)
+        queries = vectors[samples] + rng.normal(0, options["noise"], (len(samples), vectors.shape[1]))
+
+        exact_times, ann_times = [], []
+        same_student = same_decision = candidates_scanned = 0
+        for query in queries:
+            start = time.perf_counter()
+            distances = np.linalg.norm(vectors - query, axis=1)
+            exact_row = int(np.argmin(distances))
+            exact_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            rows = index.candidates(query, lists, options["nprobe"])
+            ann_distances = np.linalg.norm(vectors[rows] - query, axis=1)
+            best = int(np.argmin(ann_distances))
+            ann_row, ann_distance = int(rows[best]), ann_distances[best]
+            ann_times.append(time.perf_counter() - start)
+
+            candidates_scanned += len(rows)
+            same_student += student_ids[ann_row] == student_ids[exact_row]
+            exact_match = distances[exact_row] <= MATCH_THRESHOLD
+            ann_match = ann_distance <= MATCH_THRESHOLD
+            same_decision += exact_match == ann_match and (
+                not exact_match or student_ids[ann_row] == student_ids[exact_row]
+            )
+
+        total = len(queries)
+        exact_ms = np.array(exact_times) * 1000
+        ann_ms = np.array(ann_times) * 1000
+        self.stdout.write(f"Queries: {total} (nprobe={options['nprobe']}, noise={options['noise']})")
+        self.stdout.write(f"Recall@1 (same student as exact): {same_student / total:.4f}")
+        self.stdout.write(f"Same accept/reject decision at {MATCH_THRESHOLD}: {same_decision / total:.4f}")
+        self.stdout.write(f"Rows scanned per query: {candidates_scanned / total:.0f} of {len(vectors)}")
+        self.stdout.write(
+            f"Exact latency: mean {exact_ms.mean():.3f} ms, p95 {np.percentile(exact_ms, 95):.3f} ms"
+        )
+        self.stdout.write(
+            f"ANN latency:   mean {ann_ms.mean():.3f} ms, p95 {np.percentile(ann_ms, 95):.3f} ms"
+        )
@@ -0,0 +1,62 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from students.gallery import ENCODING_SIZE, MATCH_THRESHOLD, read_encodings
+from students.models import FaceEncoding
+from students.quantization import QuantizedMatrix
+
+
+class Command(BaseCommand):
+    help = (
+        "Report memory per encoding and matching accuracy of float16 and int8 "
+        "gallery storage against float64, using leave-one-out queries over the "
+        "enrolled gallery or a synthetic one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--synthetic", type=int, help="Generate this many synthetic students instead of using the database.")
+        parser.add_argument("--angles", type=int, default=5, help="Angles per synthetic student.")
+        parser.add_argument("--queries", type=int, default=500, help="Number of stored encodings used as queries.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        if options["synthetic"]:
+            students, angles = options["synthetic"], options["angles"]
+            centers = rng.normal(0, 0.15, (students, ENCODING_SIZE))
+            vectors = np.repeat(centers, angles, axis=0) + rng.normal(0, 0.03, (students * angles, ENCODING_SIZE))
+            student_ids = np.repeat(np.arange(students), angles)
+        else:
+            vectors, student_ids, _ = read_encodings(FaceEncoding.objects.all())
+        if len(vectors) < 2:
+            raise CommandError("Need at least two face encodings; use --synthetic.")
+
+        samples = rng.choice(len(vectors), min(options["queries"], len(vectors)), replace=False)
+        reference = [self._best(np.linalg.norm(vectors - vectors[row], axis=1), row) for row in samples]
+
+        self.stdout.write(f"Gallery: {len(vectors)} encodings, {len(samples)} leave-one-out queries")
+        self.stdout.write(f"float64: {vectors.nbytes / len(vectors):.0f} bytes/encoding")
+
+        for precision in ("float16", "int8"):
+            matrix = QuantizedMatrix.from_float(vectors, precision)
+            errors, same_student, same_decision = [], 0, 0
+            for row, (ref_row, ref_distance) in zip(samples, reference):
+                distances = matrix.distances(vectors[row])
+                errors.append(abs(distances[ref_row] - ref_distance))
+                best_row, best_distance = self._best(distances, row)
+                same_student += student_ids[best_row] == student_ids[ref_row]
+                same_decision += (best_distance <= MATCH_THRESHOLD) == (ref_distance <= MATCH_THRESHOLD)
+
+            self.stdout.write(
+                f"{precision}: {matrix.nbytes / len(matrix):.0f} bytes/encoding, "
+                f"distance error mean {np.mean(errors):.2e} max {np.max(errors):.2e}, "
+                f"top-1 student agrees {same_student / len(samples):.2%}, "
+                f"accept/reject at {MATCH_THRESHOLD} agrees {same_decision / len(samples):.2%}"
+            )
+
+    @staticmethod
+    def _best(distances, exclude):
+        """Closest row other than the query itself, and its distance."""
+        distances = distances.copy()
+        distances[exclude] = np.inf
+        row = int(np.argmin(distances))
+        return row, float(distances[row])
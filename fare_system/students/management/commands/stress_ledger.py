@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import OperationalError
+from django.test.utils import override_settings
+
+from students.ledger import charge_fare
+from students.models import Student, Transaction
+
+MODES = {"row": False, "group": True}
+
+
+class Command(BaseCommand):
+    help = (
+        "Charge fares to scratch students from many threads at once, check "
+        "that no deduction is lost, no balance goes negative and every "
+        "attempt left exactly one Transaction, and report fares/s for "
+        "per-row commits and group commit. Scratch students are deleted "
+        "afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16, help="Concurrent threads.")
+        parser.add_argument("--fares", type=int, default=50, help="Fares charged per thread.")
+        parser.add_argument("--students", type=int, default=1, help="Students the threads share.")
+        parser.add_argument("--amount", type=float, default=20.0, help="Fare amount.")
+        parser.add_argument(
+            "--balance", type=float,
+            help="Starting balance per student; by default enough for half of its attempts, so some are declined.",
+        )
+        parser.add_argument("--mode", choices=["row", "group", "both"], default="both", help="Commit path(s) to run.")
+
+    def handle(self, *args, **options):
+        modes = list(MODES) if options["mode"] == "both" else [options["mode"]]
+        problems = []
+        for mode in modes:
+            with override_settings(FARE_GROUP_COMMIT=MODES[mode]):
+                problems += [f"[{mode}] {problem}" for problem in self.run(mode, options)]
+
+        if problems:
+            raise CommandError(" ".join(problems))
+        self.stdout.write(self.style.SUCCESS("Ledger stayed consistent."))
+
+    def run(self, mode, options):
+        threads, fares, amount = options["threads"], options["fares"], options["amount"]
+        attempts = threads * fares
+        per_student = [
+            sum(fares for thread in range(threads) if thread % options["students"] == index)
+            for index in range(options["students"])
+        ]
+        balances = [
+            options["balance"] if options["balance"] is not None else amount * (count // 2)
+            for count in per_student
+        ]
+
+        stamp = int(time.time() * 1000)
+        users = [User.objects.create(username=f"ledger-stress-{stamp}-{index}") for index in range(len(balances))]
+        students = [
+            Student.objects.create(
+                user=user, full_name="Ledger stress", student_id=4_000_000_000 - user.pk, balance=balance
+            )
+            for user, balance in zip(users, balances)
+        ]
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker(thread):
+            # Each thread charges through its own database connection
+            scratch = Student.objects.get(pk=students[thread % len(students)].pk)
+            barrier.wait()
+            try:
+                for _ in range(fares):
+                    try:
+                        charge_fare(scratch, amount)
+                    except OperationalError as e:
+                        with lock:
+                            errors.append(str(e))
+            finally:
+                connections.close_all()
+
+        problems = []
+        try:
+            began = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(worker, range(threads)))
+            elapsed = time.perf_counter() - began
+
+            approved_total = declined_total = 0
+            for student, start_balance, count in zip(students, balances, per_student):
+                final_balance = Student.objects.values_list("balance", flat=True).get(pk=student.pk)
+                transactions = Transaction.objects.filter(student=student)
+                approved = transactions.filter(status="Approved").count()
+                declined = transactions.filter(status="Declined").count()
+                approved_total += approved
+                declined_total += declined
+
+                if final_balance != start_balance - approved * amount:
+                    problems.append(f"Student {student.pk}: balance does not equal start minus approved fares.")
+                if final_balance < 0:
+                    problems.append(f"Student {student.pk}: balance went negative.")
+                if not errors and approved != min(count, int(start_balance // amount)):
+                    problems.append(f"Student {student.pk}: {approved} approved, expected {min(count, int(start_balance // amount))}.")
+
+            if approved_total + declined_total != attempts - len(errors):
+                problems.append("Transaction rows do not match the attempts that completed.")
+            if errors:
+                problems.append(f"{len(errors)} fares failed, first error: {errors[0]}")
+
+            self.stdout.write(
+                f"{mode:<6} {attempts} fares, {threads} threads, {len(students)} students: "
+                f"{elapsed:.2f}s, {attempts / elapsed:.0f} fares/s, "
+                f"approved {approved_total}, declined {declined_total}, errors {len(errors)}"
+            )
+        finally:
+            for user in users:
+                user.delete()
+        return problems
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from students.gallery import read_encodings
+from students.models import FaceEncoding, GalleryChange
+from students.snapshots import write_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a versioned, memory-mappable snapshot of the face gallery to "
+        "FACE_GALLERY_SNAPSHOT_DIR. Running workers swap to it on their next "
+        "version check; run it periodically or after bulk enrollments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", type=int, default=2, help="Number of snapshots to keep.")
+
+    def handle(self, *args, **options):
+        # Read the version first so changes made while reading are re-applied
+        # by workers as deltas on top of this snapshot
+        version = GalleryChange.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+        vectors, student_ids, encoding_ids = read_encodings(FaceEncoding.objects.all())
+        write_snapshot(
+            settings.FACE_GALLERY_SNAPSHOT_DIR,
+            version,
+            vectors,
+            student_ids,
+            encoding_ids,
+            keep=options["keep"],
+        )
+        self.stdout.write(
+            f"Wrote gallery snapshot version {version} with {len(student_ids)} encodings "
+            f"to {settings.FACE_GALLERY_SNAPSHOT_DIR}"
+        )
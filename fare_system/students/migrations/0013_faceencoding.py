@@ -0,0 +1,115 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:58
+
+import base64
+import json
+from datetime import datetime
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+ENCODING_BYTES = 128 * 8
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return django.utils.timezone.now()
+
+
+def convert_encodings(apps, schema_editor):
+    """Move base64-in-JSON encodings into FaceEncoding rows."""
+    Student = apps.get_model("students", "Student")
+    FaceEncoding = apps.get_model("students", "FaceEncoding")
+
+    rows = []
+    students = Student.objects.exclude(
+        models.Q(face_encodings__isnull=True) & models.Q(face_encoding__isnull=True)
+    )
+    for student in students.iterator():
+        converted = []
+        try:
+            entries = json.loads(student.face_encodings or "[]")
+        except json.JSONDecodeError:
+            entries = []
+
+        for entry in entries:
+            try:
+                vector = base64.b64decode(entry["encoding"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if len(vector) != ENCODING_BYTES:
+                continue
+            quality = entry.get("quality") or {}
+            converted.append(
+                FaceEncoding(
+                    student=student,
+                    angle=entry.get("angle") or "center",
+                    face_width=quality.get("width") or 0,
+                    face_height=quality.get("height") or 0,
+                    created_at=_parse_timestamp(quality.get("timestamp")),
+                    vector=vector,
+                )
+            )
+
+        # Fallback to legacy single encoding if no multiple encodings found
+        if not converted and student.face_encoding:
+            try:
+                vector = base64.b64decode(student.face_encoding)
+            except ValueError:
+                vector = b""
+            if len(vector) == ENCODING_BYTES:
+                converted.append(FaceEncoding(student=student, vector=vector))
+
+        rows.extend(converted)
+
+    FaceEncoding.objects.bulk_create(rows, batch_size=500)
+
+
+def restore_encodings(apps, schema_editor):
+    """Rebuild the JSON encodings from FaceEncoding rows."""
+    Student = apps.get_model("students", "Student")
+    FaceEncoding = apps.get_model("students", "FaceEncoding")
+
+    entries = {}
+    for encoding in FaceEncoding.objects.order_by("created_at", "pk").iterator():
+        entries.setdefault(encoding.student_id, []).append(
+            {
+                "angle": encoding.angle,
+                "encoding": base64.b64encode(bytes(encoding.vector)).decode("utf-8"),
+                "quality": {
+                    "width": encoding.face_width,
+                    "height": encoding.face_height,
+                    "timestamp": str(encoding.created_at),
+                },
+            }
+        )
+
+    for student in Student.objects.filter(pk__in=entries):
+        student.face_encodings = json.dumps(entries[student.pk])
+        student.face_encoding = entries[student.pk][-1]["encoding"]
+        student.save(update_fields=["face_encoding", "face_encodings"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0012_gallerychange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceEncoding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('angle', models.CharField(default='center', max_length=20)),
+                ('face_width', models.PositiveIntegerField(default=0)),
+                ('face_height', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('vector', models.BinaryField()),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='encodings', to='students.student')),
+            ],
+        ),
+        migrations.RunPython(convert_encodings, restore_encodings),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0013_faceencoding'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='student',
+            name='face_encoding',
+        ),
+        migrations.RemoveField(
+            model_name='student',
+            name='face_encodings',
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus', '0005_remove_bus_route_bus_route_name_alter_busdriver_bus'),
+        ('students', '0014_remove_student_face_encoding_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='bus',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='bus.bus'),
+        ),
+    ]
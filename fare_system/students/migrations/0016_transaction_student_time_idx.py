@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus', '0005_remove_bus_route_bus_route_name_alter_busdriver_bus'),
+        ('students', '0015_transaction_bus'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['student', 'timestamp'], name='transaction_student_time_idx'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db import transaction as db_transaction
+from django.utils import timezone
 
 # from tensorflow.keras.models import load_model
 # import os
@@ -23,26 +25,49 @@ class Student(models.Model):
         unique=True
     )  # Numeric student ID (used as username)
     balance = models.FloatField(default=0.0)
-    face_encoding = models.TextField(blank=True, null=True)
-    face_encodings = models.TextField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.full_name} ({self.student_id})"
 
     def credit_balance(self, amount):
-        self.balance += amount
-        self.save()
+        from .ledger import balance, credit
+
+        credit(self.pk, amount)
+        self.balance = balance(self.pk)
 
     def deduct_balance(self, amount):
-        if self.balance >= amount:
-            self.balance -= amount
-            self.save()
-            return True
-        return False
+        from .ledger import balance, debit
+
+        deducted = debit(self.pk, amount)
+        self.balance = balance(self.pk)
+        return deducted
+
+
+class FaceEncoding(models.Model):
+    """A single enrolled face angle, stored as the raw bytes of a float64 vector."""
+
+    student = models.ForeignKey(
+        Student, on_delete=models.CASCADE, related_name="encodings"
+    )
+    angle = models.CharField(max_length=20, default="center")
+    face_width = models.PositiveIntegerField(default=0)
+    face_height = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    vector = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.student.full_name} - {self.angle}"
 
 
 class Transaction(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    bus = models.ForeignKey(
+        "bus.Bus",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="transactions",
+    )
     amount = models.FloatField(default=20.0)
     timestamp = models.DateTimeField(auto_now_add=True)
     status = models.CharField(
@@ -55,15 +80,71 @@ class Transaction(models.Model):
         default="Pending",
     )
 
+    class Meta:
+        indexes = [
+            # Latest boarding of a student, for the re-boarding rule
+            models.Index(fields=["student", "timestamp"], name="transaction_student_time_idx"),
+        ]
+
     def save(self, *args, **kwargs):
-        # Automatically approve and deduct balance if sufficient
-        if self.status == "Pending" and self.student.balance >= self.amount:
-            self.student.balance -= self.amount
-            self.student.save()
-            self.status = "Approved"
-        elif self.status == "Pending":
-            self.status = "Declined"
+        # Automatically approve and deduct balance if sufficient, committing
+        # the deduction together with this row
+        if self.status == "Pending":
+            with db_transaction.atomic():
+                self.status = "Approved" if self.student.deduct_balance(self.amount) else "Declined"
+                super().save(*args, **kwargs)
+            return
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.student.user.username} - {self.amount} - {self.status}"
+
+
+class DailyFareSummary(models.Model):
+    """Totals of one student's fares on one closed day.
+
+    Written by ``manage.py archive_transactions`` and kept after the day's
+    raw Transaction rows are moved to the archive.
+    """
+
+    student = models.ForeignKey(
+        Student, on_delete=models.CASCADE, related_name="daily_summaries"
+    )
+    day = models.DateField()
+    approved = models.PositiveIntegerField(default=0)
+    declined = models.PositiveIntegerField(default=0)
+    amount = models.FloatField(default=0.0)  # Sum of approved fares
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["student", "day"], name="daily_fare_summary_student_day"),
+        ]
+
+    def __str__(self):
+        return f"{self.student} - {self.day}: {self.approved} fares, {self.amount}"
+
+
+class TransactionArchive(models.Model):
+    """A compressed file holding raw Transactions of one day moved out of the table."""
+
+    day = models.DateField(db_index=True)
+    path = models.CharField(max_length=255)  # Relative to FARE_ARCHIVE_DIR
+    rows = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.day} - {self.rows} transactions ({self.path})"
+
+
+class GalleryChange(models.Model):
+    """Change log of students whose face encodings were added, edited or removed.
+
+    The auto-incrementing primary key doubles as the gallery version, so each
+    worker process can pull only the changes made since the version it last saw.
+    """
+
+    student_pk = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Gallery change {self.pk} - student {self.student_pk}"
@@ -0,0 +1,106 @@
+"""Triangle-inequality pruning over per-student centroids.
+
+For a student with angle encodings ``a_i``, centroid ``c`` and radius
+``r = max ||a_i - c||``, every angle satisfies ``||q - a_i|| >= ||q - c|| - r``.
+Students whose lower bound is not below the best distance found so far cannot
+win and their angles are never compared.
+"""
+
+import numpy as np
+
+from .quantization import CHUNK
+
+# Students whose angles are compared exactly to seed the best distance
+SEED_STUDENTS = 8
+
+
+class StudentCentroids:
+    """Centroid and radius of every student's angle encodings.
+
+    :meth:`replace` recomputes only the students whose encodings changed;
+    their old groups are retired (radius ``-inf``, so they never survive)
+    rather than removed, which keeps every other row's group index valid.
+    Rows with a negative student id are tombstones and are retired too.
+    """
+
+    def __init__(self, vectors, student_ids):
+        self.groups, self.row_groups = np.unique(student_ids, return_inverse=True)
+        self.centroids, self.radii = _fit(vectors, self.row_groups, len(self.groups))
+        self.radii[self.groups < 0] = -np.inf
+
+    @property
+    def retired(self):
+        """Number of groups left behind by :meth:`replace`."""
+        return int(np.isneginf(self.radii).sum())
+
+    def replace(self, keep, student_pks, vectors, student_ids):
+        """Return centroids for an updated gallery layout.
+
+        The new layout is the old rows where ``keep`` is true followed by
+        ``vectors`` of ``student_ids``, the current encodings of the changed
+        ``student_pks``. Only those students' centroids are computed.
+        """
+        groups, row_groups = np.unique(student_ids, return_inverse=True)
+        centroids, radii = _fit(vectors, row_groups, len(groups))
+
+        updated = StudentCentroids.__new__(StudentCentroids)
+        updated.groups = np.concatenate([self.groups, groups])
+        updated.row_groups = np.concatenate([self.row_groups[keep], row_groups + len(self.groups)])
+        updated.centroids = np.concatenate([self.centroids, centroids])
+        updated.radii = np.concatenate([self.radii, radii])
+        updated.radii[:len(self.groups)][np.isin(self.groups, student_pks)] = -np.inf
+        return updated
+
+    def nearest(self, vectors, query):
+        """Return ``(row, distance, compared)`` for the closest row to ``query``.
+
+        ``compared`` is the number of vector comparisons made, counting one
+        per centroid plus one per angle of each surviving student.
+        """
+        lower = np.linalg.norm(self.centroids - query, axis=1) - self.radii
+        compared = len(self.groups)
+
+        # Seed the best distance with the most promising students
+        seed = np.argsort(lower)[:SEED_STUDENTS]
+        seed = seed[np.isfinite(lower[seed])]
+        best_row, best_distance, seen = self._scan(vectors, query, np.isin(self.row_groups, seed))
+        compared += seen
+
+        survivors = lower < best_distance
+        survivors[seed] = False
+        if survivors.any():
+            row, distance, seen = self._scan(vectors, query, survivors[self.row_groups])
+            compared += seen
+            if distance < best_distance:
+                best_row, best_distance = row, distance
+
+        return best_row, best_distance, compared
+
+    @staticmethod
+    def _scan(vectors, query, row_mask):
+        rows = np.flatnonzero(row_mask)
+        if not len(rows):
+            return None, np.inf, 0
+        distances = np.linalg.norm(vectors[rows] - query, axis=1)
+        best = int(np.argmin(distances))
+        return int(rows[best]), float(distances[best]), len(rows)
+
+
+def _fit(vectors, row_groups, count):
+    """Return ``(centroids, radii)`` of ``count`` groups of rows.
+
+    ``vectors`` may be quantized or layered; it is read in float64 blocks of
+    ``CHUNK`` rows, so the whole matrix is never expanded at once.
+    """
+    sums = np.zeros((count, vectors.shape[1]), dtype=np.float64)
+    for start in range(0, len(row_groups), CHUNK):
+        np.add.at(sums, row_groups[start:start + CHUNK], vectors[start:start + CHUNK])
+    centroids = sums
+    centroids /= np.maximum(np.bincount(row_groups, minlength=count), 1)[:, None]
+
+    radii = np.zeros(count, dtype=np.float64)
+    for start in range(0, len(row_groups), CHUNK):
+        groups = row_groups[start:start + CHUNK]
+        spread = np.linalg.norm(vectors[start:start + CHUNK] - centroids[groups], axis=1)
+        np.maximum.at(radii, groups, spread)
+    return centroids, radii
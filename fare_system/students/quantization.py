@@ -0,0 +1,111 @@
+"""Reduced-precision storage for gallery encodings.
+
+The gallery is otherwise float64. ``float16`` takes a quarter of that memory
+and needs no parameters. ``int8`` takes an eighth: it stores
+``round(v / scale)`` with one scale per dimension, fixed when the matrix is
+first built so later rows can usually be appended without re-encoding
+existing ones. Only rows that would overflow the range widen the scale.
+Distances are always computed in float32 on dequantized blocks.
+"""
+
+import numpy as np
+
+PRECISIONS = ("float64", "float16", "int8")
+
+# Rows dequantized at a time when computing distances, bounds temporary memory
+CHUNK = 16384
+
+# Extra range kept above the largest magnitude seen when choosing int8 scales
+INT8_HEADROOM = 1.25
+
+
+class QuantizedMatrix:
+    """A float16 or int8 encoding matrix that behaves like a read-only array.
+
+    Indexing returns dequantized float64 rows, so code written for plain
+    float64 galleries can slice it unchanged; :meth:`distances` scans it
+    without dequantizing the whole matrix at once.
+    """
+
+    def __init__(self, codes, scale=None):
+        self.codes = codes
+        self.scale = scale
+
+    @classmethod
+    def from_float(cls, vectors, precision, scale=None):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if precision == "float16":
+            return cls(vectors.astype(np.float16))
+        if precision != "int8":
+            raise ValueError(f"Unknown precision {precision!r}; expected one of {PRECISIONS}.")
+
+        if scale is None:
+            peak = np.abs(vectors).max(axis=0) if len(vectors) else np.ones(vectors.shape[1])
+            scale = (np.maximum(peak, 1e-6) * INT8_HEADROOM / 127).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+        return cls(codes, scale)
+
+    @property
+    def precision(self):
+        return "int8" if self.scale is not None else "float16"
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        block = self.codes[index].astype(np.float64)
+        if self.scale is not None:
+            block *= self.scale
+        return block
+
+    def select(self, mask):
+        """Return a new matrix with only the rows where ``mask`` is true."""
+        return QuantizedMatrix(self.codes[mask], self.scale)
+
+    def append(self, vectors):
+        """Return a new matrix with float64 ``vectors`` quantized and appended.
+
+        If an int8 value would be clipped, the scale of its dimension is
+        widened and the existing codes are re-encoded to match.
+        """
+        vectors = np.asarray(vectors, dtype=np.float64)
+        codes, scale = self.codes, self.scale
+        if scale is not None and len(vectors):
+            peak = np.abs(vectors).max(axis=0)
+            if (peak > 127 * scale).any():
+                wider = np.maximum(scale, (peak * INT8_HEADROOM / 127).astype(np.float32))
+                codes = np.empty_like(self.codes)
+                for start in range(0, len(codes), CHUNK):
+                    block = self.codes[start:start + CHUNK].astype(np.float32) * (scale / wider)
+                    codes[start:start + CHUNK] = np.rint(block)
+                scale = wider
+        extra = QuantizedMatrix.from_float(vectors, self.precision, scale)
+        return QuantizedMatrix(np.concatenate([codes, extra.codes]), scale)
+
+    def distances(self, query):
+        """Euclidean distance from ``query`` to every row."""
+        query = np.asarray(query, dtype=np.float32)
+        out = np.empty(len(self.codes), dtype=np.float64)
+        for start in range(0, len(self.codes), CHUNK):
+            block = self.codes[start:start + CHUNK].astype(np.float32)
+            if self.scale is not None:
+                block *= self.scale
+            block -= query
+            out[start:start + CHUNK] = np.sqrt(np.einsum("ij,ij->i", block, block))
+        return out
+
+
+def row_distances(vectors, query):
+    """Distances from ``query`` to every row of a float64 array, or of a
+    matrix object with a ``distances`` method (quantized or layered)."""
+    if isinstance(vectors, np.ndarray):
+        return np.linalg.norm(vectors - query, axis=1)
+    return vectors.distances(query)
@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import FaceEncoding, GalleryChange
+
+
+@receiver(post_save, sender=FaceEncoding)
+def record_encoding_save(sender, instance, **kwargs):
+    """Record a gallery change when a face encoding is added or edited."""
+    _record_change(instance.student_id)
+
+
+@receiver(post_delete, sender=FaceEncoding)
+def record_encoding_delete(sender, instance, **kwargs):
+    """Record a gallery change so the deleted encoding is dropped everywhere."""
+    _record_change(instance.student_id)
+
+
+def _record_change(student_pk):
+    from .gallery import gallery
+
+    GalleryChange.objects.create(student_pk=student_pk)
+    # Apply the delta in this process right away; other workers pick it up
+    # on their next version check.
+    transaction.on_commit(lambda: gallery.sync(force=True))
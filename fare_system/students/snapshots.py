@@ -0,0 +1,77 @@
+"""Versioned on-disk gallery snapshots shared by worker processes.
+
+A snapshot is three ``.npy`` files (vectors, student ids, encoding ids) plus
+a ``gallery.json`` manifest naming the current version. Workers open the
+arrays with ``mmap_mode="r"``, so every process on the host reads the same
+pages from the OS page cache instead of holding a private copy.
+"""
+
+import json
+import os
+
+import numpy as np
+
+MANIFEST = "gallery.json"
+ARRAYS = ("vectors", "student_ids", "encoding_ids")
+
+
+def _path(directory, version, name):
+    return os.path.join(directory, f"gallery-{version}-{name}.npy")
+
+
+def read_manifest(directory):
+    """Return the current manifest dict, or None if no snapshot was written."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def manifest_mtime(directory):
+    """Cheap change check: modification time of the manifest, or None."""
+    try:
+        return os.stat(os.path.join(directory, MANIFEST)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_snapshot(directory, manifest):
+    """Memory-map the arrays named by ``manifest``."""
+    version = manifest["version"]
+    return tuple(
+        np.load(_path(directory, version, name), mmap_mode="r") for name in ARRAYS
+    )
+
+
+def write_snapshot(directory, version, vectors, student_ids, encoding_ids, keep=2):
+    """Write a snapshot, publish it atomically and prune older ones.
+
+    The newest ``keep`` snapshots are kept so workers still mapping the
+    previous one are never left without their files on platforms that
+    refuse to delete open files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, array in zip(ARRAYS, (vectors, student_ids, encoding_ids)):
+        path = _path(directory, version, name)
+        np.save(path + ".tmp.npy", np.ascontiguousarray(array))
+        os.replace(path + ".tmp.npy", path)
+
+    manifest_path = os.path.join(directory, MANIFEST)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"version": version, "rows": len(student_ids)}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    versions = sorted(
+        {
+            int(name.split("-")[1])
+            for name in os.listdir(directory)
+            if name.startswith("gallery-") and name.endswith(".npy")
+        }
+    )
+    for old in versions[:-keep]:
+        for name in ARRAYS:
+            try:
+                os.remove(_path(directory, old, name))
+            except OSError:
+                pass
@@ -1,3 +1,825 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db import transaction as db_transaction
+from django.db.utils import OperationalError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .archive import archive_day, day_bounds, restore_day, rollup
+from .gallery import ENCODING_SIZE, FaceGallery, gallery, pack_encoding, read_encodings
+from .layers import LayeredMatrix
+from .ledger import charge_fare
+from .uploads import request_image, request_images
+from .models import (
+    DailyFareSummary,
+    FaceEncoding,
+    GalleryChange,
+    Student,
+    Transaction,
+    TransactionArchive,
+)
+from .pruning import StudentCentroids
+from .quantization import QuantizedMatrix
+from .workers import FaceWorkerPool
+
+
+class ConcurrentFareTests(TransactionTestCase):
+    """Fares charged from many threads at once must never lose a deduction."""
+
+    threads = 8
+    fares = 10
+    amount = 20.0
+
+    def setUp(self):
+        user = User.objects.create(username="ledger-test")
+        # Enough for half of the attempts, so the balance check is contended
+        self.start_balance = self.amount * (self.threads * self.fares // 2)
+        self.student = Student.objects.create(
+            user=user, full_name="Ledger test", student_id=900001, balance=self.start_balance
+        )
+
+    def charge_concurrently(self):
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def worker():
+            student = Student.objects.get(pk=self.student.pk)
+            barrier.wait()
+            try:
+                for _ in range(self.fares):
+                    while True:
+                        try:
+                            charge_fare(student, self.amount)
+                            break
+                        except OperationalError:
+                            # The in-memory test database reports table locks
+                            # instead of waiting; the charge rolled back, retry
+                            time.sleep(0.001)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assert_consistent(self):
+        attempts = self.threads * self.fares
+        final_balance = Student.objects.values_list("balance", flat=True).get(pk=self.student.pk)
+        transactions = Transaction.objects.filter(student=self.student)
+        approved = transactions.filter(status="Approved").count()
+
+        self.assertEqual(final_balance, self.start_balance - approved * self.amount)
+        self.assertGreaterEqual(final_balance, 0)
+        self.assertEqual(transactions.count(), attempts)
+        self.assertEqual(approved, min(attempts, int(self.start_balance // self.amount)))
+
+    def test_row_commits(self):
+        with override_settings(FARE_GROUP_COMMIT=False):
+            self.charge_concurrently()
+        self.assert_consistent()
+
+    def test_group_commit(self):
+        with override_settings(FARE_GROUP_COMMIT=True):
+            self.charge_concurrently()
+        self.assert_consistent()
+
+
+class GalleryTestCase(TestCase):
+    """Students with a few clustered angle encodings each, and brute-force
+    reference answers computed from the database."""
+
+    students = 30
+    angles = 3
+
+    def setUp(self):
+        # No shared snapshot or persisted ANN index unless a test writes one
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+        settings = override_settings(
+            FACE_GALLERY_SNAPSHOT_DIR=self.snapshot_dir, FACE_ANN_ENABLED=False
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.rng = np.random.default_rng(0)
+        self.enrolled = [self.enroll() for _ in range(self.students)]
+
+    def enroll(self, angles=None):
+        number = 100000 + Student.objects.count()
+        user = User.objects.create(username=str(number))
+        student = Student.objects.create(user=user, full_name=f"Student {number}", student_id=number)
+        center = self.rng.normal(0, 0.1, ENCODING_SIZE)
+        for _ in range(angles or self.angles):
+            self.add_encoding(student, center + self.rng.normal(0, 0.02, ENCODING_SIZE))
+        return student
+
+    def add_encoding(self, student, vector):
+        return FaceEncoding.objects.create(student=student, vector=pack_encoding(vector))
+
+    def reenroll(self, student):
+        """Replace every encoding of ``student`` with a new face."""
+        center = self.rng.normal(0, 0.1, ENCODING_SIZE)
+        for encoding in student.encodings.all():
+            encoding.vector = pack_encoding(center + self.rng.normal(0, 0.02, ENCODING_SIZE))
+            encoding.save()
+
+    def queries(self, count=20):
+        """Noisy copies of enrolled encodings, plus one far from everyone."""
+        vectors, _, _ = read_encodings(FaceEncoding.objects.all())
+        rows = self.rng.choice(len(vectors), min(count, len(vectors)), replace=False)
+        queries = vectors[rows] + self.rng.normal(0, 0.01, (len(rows), ENCODING_SIZE))
+        return np.vstack([queries, np.full(ENCODING_SIZE, 0.5)])
+
+    def brute_force(self, query, k=1):
+        vectors, student_ids, _ = read_encodings(FaceEncoding.objects.all())
+        distances = np.linalg.norm(vectors - query, axis=1)
+        best = np.argsort(distances)[:k]
+        return [(int(student_ids[row]), float(distances[row])) for row in best]
+
+    def assert_matches_brute_force(self, gallery, tolerance=1e-9):
+        """``match``, ``search`` and ``match_many`` agree with a full scan.
+
+        Students are compared exactly; distances within ``tolerance``, which
+        is loose for quantized storage.
+        """
+        vectors, student_ids, _ = read_encodings(FaceEncoding.objects.all())
+        self.assertEqual(len(gallery), len(student_ids))
+        queries = self.queries()
+        for query in queries:
+            expected = self.brute_force(query, k=self.angles)
+            student_pk, distance = gallery.match(query)
+            self.assertEqual(student_pk, expected[0][0])
+            self.assertAlmostEqual(distance, expected[0][1], delta=tolerance)
+
+            found = gallery.search(query, k=self.angles, exact=True)
+            self.assertEqual([pk for pk, _ in found], [pk for pk, _ in expected])
+            np.testing.assert_allclose(
+                [d for _, d in found], [d for _, d in expected], atol=tolerance
+            )
+
+        for (student_pk, distance), query in zip(gallery.match_many(queries), queries):
+            expected = self.brute_force(query)[0]
+            self.assertEqual(student_pk, expected[0])
+            self.assertAlmostEqual(distance, expected[1], delta=tolerance)
+
+
+class FaceGalleryTests(GalleryTestCase):
+    @override_settings(FACE_CENTROID_PRUNING=False)
+    def test_full_scan_matches_brute_force(self):
+        gallery = FaceGallery()
+        gallery.load()
+
+        self.assert_matches_brute_force(gallery)
+
+    def test_malformed_vectors_are_skipped(self):
+        FaceEncoding.objects.create(student=self.enrolled[0], vector=b"not an encoding")
+        gallery = FaceGallery()
+        gallery.load()
+
+        self.assertEqual(len(gallery), self.students * self.angles)
+        self.assert_matches_brute_force(gallery)
+
+    def test_empty_gallery(self):
+        FaceEncoding.objects.all().delete()
+        gallery = FaceGallery()
+        gallery.load()
+        query = np.zeros(ENCODING_SIZE)
+
+        self.assertEqual(gallery.match(query), (None, None))
+        self.assertEqual(gallery.search(query, k=3), [])
+        self.assertEqual(gallery.match_many([query, query]), [(None, None)] * 2)
+
+
+class ANNSearchTests(GalleryTestCase):
+    students = 40
+
+    def setUp(self):
+        super().setUp()
+        self.index_path = os.path.join(self.snapshot_dir, "face_index.npz")
+        call_command(
+            "build_face_index", "--output", self.index_path, "--nlist", "6", "--queries", "10",
+            stdout=StringIO(),
+        )
+        settings = override_settings(
+            FACE_ANN_ENABLED=True, FACE_ANN_INDEX_PATH=self.index_path, FACE_ANN_MIN_GALLERY_SIZE=0
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def load(self):
+        gallery = FaceGallery()
+        gallery.load()
+        self.assertIsNotNone(gallery.ann)
+        return gallery
+
+    @override_settings(FACE_ANN_NPROBE=6)
+    def test_probing_every_cluster_is_exact(self):
+        gallery = self.load()
+        self.assert_matches_brute_force(gallery)
+
+        # Rows enrolled or removed after the index was built
+        self.enroll()
+        self.reenroll(self.enrolled[0])
+        self.enrolled[1].delete()
+        gallery.sync(force=True)
+        self.assert_matches_brute_force(gallery)
+
+    @override_settings(FACE_ANN_NPROBE=1)
+    def test_recall_with_one_probe(self):
+        gallery = self.load()
+        queries = self.queries(40)[:-1]
+
+        found = sum(
+            gallery.match(query)[0] == self.brute_force(query)[0][0] for query in queries
+        )
+
+        self.assertGreaterEqual(found / len(queries), 0.9)
+        # Distances are exact even when the ANN candidate list is partial
+        for query in queries:
+            student_pk, distance = gallery.match(query)
+            vectors, _, _ = read_encodings(FaceEncoding.objects.filter(student_id=student_pk))
+            self.assertAlmostEqual(distance, np.linalg.norm(vectors - query, axis=1).min())
+
+
+class CentroidPruningTests(GalleryTestCase):
+    def test_nearest_matches_a_full_scan(self):
+        vectors, student_ids, _ = read_encodings(FaceEncoding.objects.all())
+        centroids = StudentCentroids(vectors, student_ids)
+
+        for query in self.queries():
+            row, distance, compared = centroids.nearest(vectors, query)
+            distances = np.linalg.norm(vectors - query, axis=1)
+            self.assertEqual(row, int(np.argmin(distances)))
+            self.assertAlmostEqual(distance, distances.min())
+
+        # A query next to one student skips most other students' angles
+        row, _, compared = centroids.nearest(vectors, vectors[0] + 0.001)
+        self.assertEqual(row, 0)
+        self.assertLess(compared, len(vectors))
+
+    def test_incremental_update_matches_a_rebuild(self):
+        gallery = FaceGallery()
+        gallery.load()
+
+        self.enroll()
+        self.reenroll(self.enrolled[0])
+        self.enrolled[1].delete()
+        gallery.sync(force=True)
+
+        self.assertGreater(gallery.centroids.retired, 0)
+        rebuilt = StudentCentroids(gallery.vectors, gallery.student_ids)
+        for query in self.queries():
+            self.assertEqual(
+                gallery.centroids.nearest(gallery.vectors, query)[:2],
+                rebuilt.nearest(gallery.vectors, query)[:2],
+            )
+        self.assert_matches_brute_force(gallery)
+
+    def test_retired_groups_never_outnumber_live_ones(self):
+        gallery = FaceGallery()
+        gallery.load()
+
+        for student in self.enrolled * 2:
+            self.reenroll(student)
+            gallery.sync(force=True)
+            live = len(gallery.centroids.groups) - gallery.centroids.retired
+            self.assertLessEqual(gallery.centroids.retired, live)
+
+        self.assert_matches_brute_force(gallery)
+
+
+# Distance error allowed by each storage precision
+PRECISION_TOLERANCE = {"float64": 1e-6, "float16": 0.01, "int8": 0.05}
+
+
+class QuantizedGalleryTests(GalleryTestCase):
+    def test_codes_round_trip_within_precision(self):
+        vectors, _, _ = read_encodings(FaceEncoding.objects.all())
+        for precision, itemsize in (("float16", 2), ("int8", 1)):
+            with self.subTest(precision=precision):
+                matrix = QuantizedMatrix.from_float(vectors, precision)
+
+                self.assertEqual(matrix.nbytes, vectors.size * itemsize)
+                error = np.abs(matrix[:] - vectors)
+                if precision == "int8":
+                    self.assertTrue((error <= matrix.scale / 2 + 1e-9).all())
+                else:
+                    self.assertLess(error.max(), 1e-3)
+                query = vectors[0] + 0.01
+                np.testing.assert_allclose(
+                    matrix.distances(query),
+                    np.linalg.norm(matrix[:] - query, axis=1),
+                    atol=1e-5,
+                )
+                np.testing.assert_array_equal(
+                    matrix.select(np.arange(len(vectors)) % 2 == 0).codes, matrix.codes[::2]
+                )
+
+    def test_int8_append_widens_the_scale_instead_of_clipping(self):
+        vectors, _, _ = read_encodings(FaceEncoding.objects.all())
+        matrix = QuantizedMatrix.from_float(vectors, "int8")
+        outlier = np.zeros((1, ENCODING_SIZE))
+        outlier[0, 0] = 10 * np.abs(vectors[:, 0]).max()
+
+        appended = matrix.append(outlier)
+
+        self.assertAlmostEqual(appended[-1:][0, 0], outlier[0, 0], delta=appended.scale[0])
+        self.assertGreater(appended.scale[0], matrix.scale[0])
+        np.testing.assert_array_equal(appended.scale[1:], matrix.scale[1:])
+        # Existing rows are re-encoded to the wider scale
+        self.assertLess(np.abs(appended[:len(vectors)] - vectors).max(), appended.scale.max())
+
+    def test_search_matches_brute_force(self):
+        for precision in ("float16", "int8"):
+            for pruning in (True, False):
+                with self.subTest(precision=precision, pruning=pruning), override_settings(
+                    FACE_GALLERY_PRECISION=precision, FACE_CENTROID_PRUNING=pruning
+                ):
+                    gallery = FaceGallery()
+                    gallery.load()
+                    self.assertIsInstance(gallery.vectors, QuantizedMatrix)
+                    self.assert_matches_brute_force(gallery, PRECISION_TOLERANCE[precision])
+
+    def test_report_command(self):
+        out = StringIO()
+
+        call_command("quantization_report", "--synthetic", "50", "--queries", "20", stdout=out)
+
+        self.assertIn("float16", out.getvalue())
+        self.assertIn("int8", out.getvalue())
+
+
+class GallerySnapshotTests(GalleryTestCase):
+    """A gallery loaded from a memory-mapped snapshot stays correct as
+    students are added, re-enrolled and deleted, through compaction."""
+
+    def load(self):
+        gallery = FaceGallery()
+        gallery.load()
+        return gallery
+
+    def test_deltas_and_compaction(self):
+        for precision in PRECISION_TOLERANCE:
+            for pruning in (True, False):
+                with self.subTest(precision=precision, pruning=pruning), override_settings(
+                    FACE_GALLERY_PRECISION=precision, FACE_CENTROID_PRUNING=pruning
+                ):
+                    self.check_deltas_and_compaction(PRECISION_TOLERANCE[precision])
+
+    def check_deltas_and_compaction(self, tolerance):
+        # Every combination starts from the same students
+        savepoint = db_transaction.savepoint()
+        try:
+            self.enrolled = list(Student.objects.order_by("pk"))
+            call_command("write_gallery_snapshot", stdout=StringIO())
+            gallery = self.load()
+            base = gallery.vectors
+            if isinstance(base, np.ndarray):
+                # The snapshot is used in place, not copied
+                self.assertFalse(base.flags.owndata)
+                self.assertFalse(base.flags.writeable)
+            self.assert_matches_brute_force(gallery, tolerance)
+
+            added = self.enroll()
+            self.reenroll(self.enrolled[0])
+            self.add_encoding(self.enrolled[1], self.rng.normal(0, 0.1, ENCODING_SIZE))
+            self.enrolled[2].delete()
+            self.enrolled[3].encodings.first().delete()
+            gallery.sync(force=True)
+
+            self.assertIsInstance(gallery.vectors, LayeredMatrix)
+            self.assertIs(gallery.vectors.base, base)
+            self.assertEqual(gallery.tombstones, 4 * self.angles)
+            self.assertIn(added.pk, gallery.student_ids)
+            self.assert_matches_brute_force(gallery, tolerance)
+
+            # Re-enrolling over half of the snapshot's students compacts it
+            for student in self.enrolled[4:self.students // 2 + 5]:
+                self.reenroll(student)
+            gallery.sync(force=True)
+
+            self.assertNotIsInstance(gallery.vectors, LayeredMatrix)
+            self.assertEqual(gallery.tombstones, 0)
+            self.assert_matches_brute_force(gallery, tolerance)
+
+            # A fresh snapshot replaces the compacted matrix
+            call_command("write_gallery_snapshot", stdout=StringIO())
+            gallery.sync(force=True)
+            self.assertEqual(gallery.tombstones, 0)
+            self.assert_matches_brute_force(gallery, tolerance)
+        finally:
+            db_transaction.savepoint_rollback(savepoint)
+
+
+class TransactionArchiveTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(FARE_ARCHIVE_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.today = timezone.localdate()
+        self.students = [
+            Student.objects.create(
+                user=User.objects.create(username=f"archive-{i}"),
+                full_name=f"Archive {i}",
+                student_id=800000 + i,
+            )
+            for i in range(2)
+        ]
+
+    def fare(self, student, day, status="Approved", amount=20.0, hour=8):
+        transaction = Transaction.objects.create(student=student, amount=amount, status=status)
+        timestamp = day_bounds(day)[0] + timedelta(hours=hour)
+        Transaction.objects.filter(pk=transaction.pk).update(timestamp=timestamp)
+        return transaction.pk
+
+    def summaries(self, day):
+        return {
+            summary.student_id: (summary.approved, summary.declined, summary.amount)
+            for summary in DailyFareSummary.objects.filter(day=day)
+        }
+
+    def test_rollup_totals(self):
+        day = self.today - timedelta(days=1)
+        first, second = self.students
+        self.fare(first, day)
+        self.fare(first, day, amount=15.0, hour=17)
+        self.fare(first, day, status="Declined")
+        self.fare(second, day, status="Declined")
+        # Neighbouring days are not counted
+        self.fare(first, day - timedelta(days=1))
+        self.fare(first, self.today)
+
+        self.assertEqual(rollup([day]), 2)
+
+        self.assertEqual(
+            self.summaries(day), {first.pk: (2, 1, 35.0), second.pk: (0, 1, 0.0)}
+        )
+        # Rolling up again rebuilds rather than adds
+        rollup([day])
+        self.assertEqual(self.summaries(day)[first.pk], (2, 1, 35.0))
+
+    def test_archive_and_restore_round_trip(self):
+        day = self.today - timedelta(days=120)
+        first, second = self.students
+        pks = [self.fare(first, day), self.fare(second, day, status="Declined", hour=9)]
+        kept = self.fare(first, day + timedelta(days=1))
+        before = list(Transaction.objects.filter(pk__in=pks).order_by("pk").values())
+
+        self.assertEqual(archive_day(day, self.directory), 2)
+
+        self.assertFalse(Transaction.objects.filter(pk__in=pks).exists())
+        self.assertTrue(Transaction.objects.filter(pk=kept).exists())
+        archive = TransactionArchive.objects.get(day=day)
+        self.assertEqual(archive.rows, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, archive.path)))
+        self.assertEqual(self.summaries(day), {first.pk: (1, 0, 20.0), second.pk: (0, 1, 0.0)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(restore_day(day, self.directory), (2, 0))
+
+        self.assertEqual(list(Transaction.objects.filter(pk__in=pks).order_by("pk").values()), before)
+        self.assertFalse(TransactionArchive.objects.filter(day=day).exists())
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.summaries(day), {first.pk: (1, 0, 20.0), second.pk: (0, 1, 0.0)})
+
+    def test_open_day_is_not_archived(self):
+        pk = self.fare(self.students[0], self.today)
+
+        for day in (self.today, self.today + timedelta(days=1)):
+            with self.assertRaises(ValueError):
+                archive_day(day, self.directory)
+
+        self.assertTrue(Transaction.objects.filter(pk=pk).exists())
+        self.assertFalse(TransactionArchive.objects.exists())
+
+    def test_late_row_after_rollup_and_archive(self):
+        day = self.today - timedelta(days=120)
+        student = self.students[0]
+        self.fare(student, day)
+        rollup([day])
+        # A bus syncing late adds a fare to a day that was already rolled up
+        self.fare(student, day, hour=10)
+        rollup([day])
+        self.assertEqual(self.summaries(day), {student.pk: (2, 0, 40.0)})
+
+        archive_day(day, self.directory)
+        self.fare(student, day, amount=15.0, hour=11)
+        self.fare(student, day, status="Declined", hour=12)
+
+        self.assertEqual(archive_day(day, self.directory), 2)
+
+        self.assertEqual(self.summaries(day), {student.pk: (3, 1, 55.0)})
+        self.assertEqual(
+            list(TransactionArchive.objects.filter(day=day).order_by("pk").values_list("rows", flat=True)),
+            [2, 2],
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(restore_day(day, self.directory), (4, 0))
+
+    def test_command_reports_days_written(self):
+        recent = self.today - timedelta(days=1)
+        old = self.today - timedelta(days=120)
+        self.fare(self.students[0], recent)
+        self.fare(self.students[1], recent)
+        self.fare(self.students[0], old)
+        self.fare(self.students[0], self.today)
+        out = StringIO()
+
+        call_command("archive_transactions", stdout=out)
+
+        self.assertIn("Rolled up 1 recent days into 2 summaries", out.getvalue())
+        self.assertIn("archived 1 transactions from 1 days", out.getvalue())
+        self.assertEqual(Transaction.objects.count(), 3)
+
+
+class GalleryChangeSignalTests(GalleryTestCase):
+    students = 5
+
+    def setUp(self):
+        super().setUp()
+        self.gallery = FaceGallery()
+        self.gallery.load()
+
+    def changes(self):
+        return list(
+            GalleryChange.objects.filter(pk__gt=self.gallery.version)
+            .order_by("pk")
+            .values_list("student_pk", flat=True)
+        )
+
+    def test_saving_an_encoding_records_a_change(self):
+        student = self.enrolled[0]
+        vector = self.rng.normal(0, 0.1, ENCODING_SIZE)
+
+        encoding = self.add_encoding(student, vector)
+        self.assertEqual(self.changes(), [student.pk])
+
+        self.gallery.sync(force=True)
+        self.assertEqual(self.gallery.match(vector), (student.pk, 0.0))
+
+        vector = self.rng.normal(0, 0.1, ENCODING_SIZE)
+        encoding.vector = pack_encoding(vector)
+        encoding.save()
+        self.assertEqual(self.changes(), [student.pk])
+
+        self.gallery.sync(force=True)
+        self.assertEqual(self.gallery.match(vector), (student.pk, 0.0))
+        self.assert_matches_brute_force(self.gallery)
+
+    def test_deleting_encodings_and_students_records_changes(self):
+        first, second = self.enrolled[:2]
+
+        first.encodings.first().delete()
+        second_pk = second.pk
+        second.delete()
+        self.assertEqual(self.changes(), [first.pk] + [second_pk] * self.angles)
+
+        self.gallery.sync(force=True)
+        self.assertNotIn(second_pk, self.gallery.student_ids)
+        self.assertEqual(len(self.gallery), (self.students - 1) * self.angles - 1)
+        self.assert_matches_brute_force(self.gallery)
+
+    def test_process_gallery_syncs_on_commit(self):
+        gallery.load()
+        self.addCleanup(gallery.invalidate)
+        student = self.enrolled[0]
+        vector = self.rng.normal(0, 0.1, ENCODING_SIZE)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_encoding(student, vector)
+
+        self.assertEqual(gallery.match(vector), (student.pk, 0.0))
+
+
+class FaceEncodingMigrationTests(TransactionTestCase):
+    """Encodings survive 0013 moving them into FaceEncoding rows and back."""
+
+    before = [("students", "0012_gallerychange")]
+    after = [("students", "0014_remove_student_face_encoding_and_more")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def vector(self, seed):
+        return np.random.default_rng(seed).normal(0, 0.1, ENCODING_SIZE).tobytes()
+
+    def test_forward_and_backward(self):
+        apps = self.migrate(self.before)
+        OldStudent = apps.get_model("students", "Student")
+        OldUser = apps.get_model("auth", "User")
+
+        def student(number, **fields):
+            user = OldUser.objects.create(username=str(number))
+            return OldStudent.objects.create(
+                user=user, full_name=f"Student {number}", student_id=number, **fields
+            ).pk
+
+        entries = [
+            {
+                "angle": angle,
+                "encoding": base64.b64encode(self.vector(seed)).decode("utf-8"),
+                "quality": {"width": 120 + seed, "height": 140, "timestamp": f"2026-01-0{seed + 1}T08:00:00+00:00"},
+            }
+            for seed, angle in enumerate(["center", "left"])
+        ]
+        multi = student(1, face_encodings=json.dumps(entries))
+        legacy = student(2, face_encoding=base64.b64encode(self.vector(5)).decode("utf-8"))
+        broken = student(3, face_encodings=json.dumps([{"angle": "center", "encoding": "c2hvcnQ="}]))
+        student(4)
+
+        apps = self.migrate(self.after)
+        FaceEncoding = apps.get_model("students", "FaceEncoding")
+        rows = {}
+        for student_pk, angle, width, height, vector in (
+            FaceEncoding.objects.order_by("created_at")
+            .values_list("student_id", "angle", "face_width", "face_height", "vector")
+        ):
+            rows.setdefault(student_pk, []).append((angle, width, height, bytes(vector)))
+        self.assertEqual(rows, {
+            multi: [
+                ("center", 120, 140, self.vector(0)),
+                ("left", 121, 140, self.vector(1)),
+            ],
+            legacy: [("center", 0, 0, self.vector(5))],
+        })
+        self.assertNotIn(broken, rows)
+
+        apps = self.migrate(self.before)
+        OldStudent = apps.get_model("students", "Student")
+        restored = OldStudent.objects.get(pk=multi)
+        restored_entries = json.loads(restored.face_encodings)
+        self.assertEqual(
+            [(entry["angle"], base64.b64decode(entry["encoding"])) for entry in restored_entries],
+            [(entry["angle"], base64.b64decode(entry["encoding"])) for entry in entries],
+        )
+        self.assertEqual(restored_entries[0]["quality"]["width"], 120)
+        self.assertEqual(base64.b64decode(restored.face_encoding), self.vector(1))
+        self.assertEqual(
+            base64.b64decode(OldStudent.objects.get(pk=legacy).face_encoding), self.vector(5)
+        )
+
+
+class FaceWorkerPoolTests(TestCase):
+    @override_settings(FACE_WORKER_PROCESSES=3, FACE_WORKER_QUEUE_SIZE=8)
+    def test_wait_until_warm_hears_from_every_worker(self):
+        pool = FaceWorkerPool()
+        self.addCleanup(pool.shutdown)
+
+        pids = pool.wait_until_warm(timeout=120)
+
+        self.assertEqual(len(pids), 3)
+        self.assertNotIn(os.getpid(), pids)
+
+
+class UploadTests(TestCase):
+    url = "/bus/recognize-face/"
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def data_url(self, data):
+        return "data:image/jpeg;base64," + base64.b64encode(data).decode()
+
+    def test_raw_body(self):
+        request = self.factory.post(self.url, b"raw jpeg", content_type="image/jpeg")
+
+        self.assertEqual(request_image(request), b"raw jpeg")
+        self.assertEqual(request_images(request), [b"raw jpeg"])
+
+    def test_multipart_upload(self):
+        request = self.factory.post(
+            self.url, {"image": SimpleUploadedFile("a.jpg", b"frame", content_type="image/jpeg")}
+        )
+
+        self.assertEqual(request_image(request), b"frame")
+        request = self.factory.post(self.url, {
+            "image": [
+                SimpleUploadedFile("a.jpg", b"first", content_type="image/jpeg"),
+                SimpleUploadedFile("b.jpg", b"second", content_type="image/jpeg"),
+            ],
+        })
+        self.assertEqual(request_images(request), [b"first", b"second"])
+
+    def test_legacy_base64_field(self):
+        request = self.factory.post(self.url, {"image_data": self.data_url(b"legacy")})
+
+        self.assertEqual(request_image(request), b"legacy")
+        request = self.factory.post(
+            self.url, {"image_data": [self.data_url(b"one"), self.data_url(b"two"), ""]}
+        )
+        self.assertEqual(request_images(request), [b"one", b"two"])
+
+    def test_missing_image(self):
+        for request in (
+            self.factory.post(self.url, b"", content_type="image/jpeg"),
+            self.factory.post(self.url, {}),
+        ):
+            self.assertIsNone(request_image(request))
+            self.assertEqual(request_images(request), [])
+
+
+class DetectionScaleTests(TestCase):
+    def setUp(self):
+        from . import faces
+
+        self.faces = faces
+        self.frame = np.zeros((400, 600, 3), dtype=np.uint8)
+
+    def resize(self, frame, size, interpolation=None):
+        return np.zeros((size[1], size[0], 3), dtype=np.uint8)
+
+    def test_boxes_are_mapped_back_to_the_full_frame(self):
+        seen = []
+
+        def face_locations(image, model):
+            seen.append(image.shape)
+            return [(10, 60, 60, 10), (190, 305, 205, 290)]
+
+        with mock.patch.object(self.faces.cv2, "resize", self.resize), mock.patch.object(
+            self.faces.face_recognition, "face_locations", face_locations
+        ):
+            locations = self.faces.detect_faces(self.frame, scale=0.5)
+
+        self.assertEqual(seen, [(200, 300, 3)])
+        # Scaled by 2 and clamped to the frame
+        self.assertEqual(locations, [(20, 120, 120, 20), (380, 600, 400, 580)])
+
+    def test_full_scale_skips_resizing(self):
+        with mock.patch.object(self.faces.cv2, "resize") as resize, mock.patch.object(
+            self.faces.face_recognition, "face_locations", return_value=[(1, 2, 3, 0)]
+        ):
+            self.assertEqual(self.faces.detect_faces(self.frame, scale=1.0), [(1, 2, 3, 0)])
+        resize.assert_not_called()
+
+    def test_encoding_uses_the_full_resolution_frame(self):
+        encoding = np.ones(ENCODING_SIZE)
+        with mock.patch.object(self.faces, "load_frame", return_value=self.frame), mock.patch.object(
+            self.faces.cv2, "resize", self.resize
+        ), mock.patch.object(
+            self.faces.face_recognition, "face_locations", return_value=[(10, 60, 60, 10)]
+        ), mock.patch.object(
+            self.faces.face_recognition, "face_encodings", return_value=[encoding]
+        ) as face_encodings:
+            analysis = self.faces.analyze_frame(b"jpeg", detect_scale=0.5)
+
+        self.assertEqual(analysis["locations"], [(20, 120, 120, 20)])
+        self.assertIs(analysis["encodings"][0], encoding)
+        frame, locations = face_encodings.call_args.args
+        self.assertIs(frame, self.frame)
+        self.assertEqual(locations, [(20, 120, 120, 20)])
+
+
+class BurstAnalysisTests(TestCase):
+    def test_faces_of_every_frame_are_encoded_together(self):
+        from . import faces
+
+        big, small, extra = (0, 100, 100, 0), (0, 140, 30, 110), (0, 300, 100, 200)
+        encodings = [np.full(ENCODING_SIZE, i) for i in range(2)]
+        with mock.patch.object(
+            faces, "load_frame", return_value=np.zeros((200, 400, 3), dtype=np.uint8)
+        ), mock.patch.object(
+            faces.face_recognition, "face_locations", return_value=[big, small, extra]
+        ), mock.patch.object(
+            faces.face_recognition, "face_encodings", return_value=encodings
+        ) as face_encodings:
+            analysis = faces.analyze_burst([b"one", b"two"], max_faces=2)
+
+        # One call per frame, with only the usable faces under max_faces
+        self.assertEqual([call.args[1] for call in face_encodings.call_args_list], [[big], [big]])
+        self.assertEqual(
+            [(face["frame"], face["location"]) for face in analysis["faces"]],
+            [(0, big), (0, small), (1, big), (1, small)],
+        )
+        self.assertIs(analysis["faces"][0]["encoding"], encodings[0])
+        self.assertIsNone(analysis["faces"][1]["encoding"])
+        self.assertEqual(set(analysis["timings"]), {"decode", "detect", "encode"})
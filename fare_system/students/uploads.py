@@ -0,0 +1,49 @@
+"""Reading captured camera frames from kiosk requests."""
+
+import base64
+
+# Content types accepted as a raw image request body
+RAW_IMAGE_TYPES = {"image/jpeg", "image/png", "application/octet-stream"}
+
+
+def request_image(request):
+    """Return the encoded image bytes posted by a kiosk, or None if missing.
+
+    Three forms are accepted, cheapest first:
+
+    * a raw ``image/jpeg`` (or png) request body, used as-is;
+    * a multipart upload in the ``image`` field;
+    * the legacy base64 data URL in the ``image_data`` form field, still
+      sent by kiosks that have not been updated.
+    """
+    if request.content_type in RAW_IMAGE_TYPES:
+        return request.body or None
+
+    upload = request.FILES.get("image")
+    if upload is not None:
+        return upload.read() or None
+
+    image_data = request.POST.get("image_data")
+    if not image_data:
+        return None
+
+    # Decode the base64 image
+    return base64.b64decode(image_data.split(",")[1])
+
+
+def request_images(request):
+    """Return every frame posted in a burst upload, oldest first.
+
+    Accepts the same forms as :func:`request_image`; multipart uploads and
+    base64 fields may repeat to carry several frames.
+    """
+    if request.content_type in RAW_IMAGE_TYPES:
+        return [request.body] if request.body else []
+
+    frames = [upload.read() for upload in request.FILES.getlist("image")]
+    frames.extend(
+        base64.b64decode(image_data.split(",")[1])
+        for image_data in request.POST.getlist("image_data")
+        if image_data
+    )
+    return [frame for frame in frames if frame]
@@ -1,14 +1,12 @@
-import json
+import logging
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from .models import Student, Transaction
+from .models import FaceEncoding, Student, Transaction
+from .uploads import request_image
+from .workers import PoolBusy, face_pool
+from bus.metrics import StageTimer
 from bus.models import Bus, BusDriver
-import base64
-import face_recognition
 from django.http import JsonResponse
-import io
-import cv2
-from django.utils import timezone
 from .models import Student
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
@@ -17,6 +15,8 @@ from django.conf import settings
 import requests
 from django.core.cache import cache
 
+logger = logging.getLogger(__name__)
+
 
 @login_required
 def change_password(request):
@@ -39,22 +39,41 @@ def change_password(request):
 def face_enrollment(request):
     """Handles face enrollment for the student with multiple angles and improved quality checks."""
     if request.method == "POST":
+        # Imported on first use so processes that never enroll skip
+        # loading OpenCV, dlib and numpy
+        from . import faces
+        from .gallery import pack_encoding
+
+        timer = StageTimer()
         try:
             # Get the uploaded image from the request
-            image_data = request.POST.get("image_data")
-            angle = request.POST.get("angle", "center")  # Get the angle of the face
+            with timer.stage("decode"):
+                image_data = request_image(request)
+            angle = request.POST.get("angle") or request.GET.get("angle", "center")  # Get the angle of the face
 
             if not image_data:
                 return JsonResponse(
                     {"status": "error", "message": "No image data provided."}
                 )
 
-            # Decode the base64 image
-            image_data = base64.b64decode(image_data.split(",")[1])
-            np_image = face_recognition.load_image_file(io.BytesIO(image_data))
+            # Detect and encode on a worker process
+            try:
+                analysis = face_pool.run(
+                    faces.analyze_frame, image_data, min_image_size=100
+                )
+            except PoolBusy:
+                return JsonResponse(
+                    {
+                        "status": "busy",
+                        "message": "Enrollment is busy. Please try again in a moment.",
+                    },
+                    status=503,
+                )
+            timer.add(analysis["timings"])
 
             # Check image quality
-            if np_image.shape[0] < 100 or np_image.shape[1] < 100:
+            image_height, image_width = analysis["shape"]
+            if image_height < 100 or image_width < 100:
                 return JsonResponse(
                     {
                         "status": "error",
@@ -62,12 +81,7 @@ def face_enrollment(request):
                     }
                 )
 
-            # Convert to RGB if needed
-            if len(np_image.shape) == 3 and np_image.shape[2] == 4:  # RGBA format
-                np_image = np_image[:, :, :3]  # Convert to RGB
-
-            # Get face locations first to check quality
-            face_locations = face_recognition.face_locations(np_image, model="hog")
+            face_locations = analysis["locations"]
 
             if len(face_locations) == 0:
                 return JsonResponse(
@@ -98,11 +112,7 @@ def face_enrollment(request):
                     }
                 )
 
-            # IMPORTANT: Use the SAME model and jitters here as in recognition
-            # To ensure consistency between enrollment and recognition
-            encodings = face_recognition.face_encodings(
-                np_image, face_locations, num_jitters=3, model="small"
-            )
+            encodings = analysis["encodings"]
 
             if len(encodings) == 0:
                 return JsonResponse(
@@ -112,52 +122,24 @@ def face_enrollment(request):
                     }
                 )
 
-            # Debug info
-            print(f"Encoding shape: {encodings[0].shape}, type: {type(encodings[0])}")
-
             # Save the face encoding to the student's profile
-            student = request.user.student_profile
-
-            # Get existing encodings if any
-            existing_encodings = []
-            if student.face_encodings:
-                try:
-                    existing_encodings = json.loads(student.face_encodings)
-                except:
-                    # If there's an error parsing, start fresh
-                    existing_encodings = []
-
-            # Add the new encoding with its angle
-            new_encoding = {
-                "angle": angle,
-                "encoding": base64.b64encode(encodings[0].tobytes()).decode("utf-8"),
-                "quality": {
-                    "width": face_width,
-                    "height": face_height,
-                    "timestamp": str(timezone.now()),
-                },
-            }
-
-            # Add to existing or create new
-            existing_encodings.append(new_encoding)
-
-            # Save as JSON string
-            student.face_encodings = json.dumps(existing_encodings)
-
-            # For backward compatibility, also save to face_encoding field
-            student.face_encoding = base64.b64encode(encodings[0].tobytes()).decode(
-                "utf-8"
-            )
-
-            student.save()
+            with timer.stage("db"):
+                student = request.user.student_profile
+                FaceEncoding.objects.create(
+                    student=student,
+                    angle=angle,
+                    face_width=face_width,
+                    face_height=face_height,
+                    vector=pack_encoding(encodings[0]),
+                )
 
-            # Calculate progress based on number of angles collected
-            angles_count = len(existing_encodings)
+                # Calculate progress based on number of angles collected
+                angles_count = student.encodings.count()
             total_required = 5  # We want 5 different angles
             progress = min(angles_count / total_required * 100, 100)
 
             # Calculate quality score based on face size relative to image
-            image_area = np_image.shape[0] * np_image.shape[1]
+            image_area = image_height * image_width
             face_area = face_width * face_height
             quality_ratio = (face_area / image_area) * 100
             quality_text = (
@@ -185,12 +167,12 @@ def face_enrollment(request):
                 }
             )
         except Exception as e:
-            import traceback
-
-            print("Face enrollment error:", str(e))
-            print(traceback.format_exc())
+            logger.exception("Face enrollment error")
             return JsonResponse({"status": "error", "message": f"Error: {str(e)}"})
 
+        finally:
+            timer.observe_enrollment()
+
     return render(request, "face_enrollment.html")
 
 
@@ -270,7 +252,7 @@ def get_bus_location(request, bus_id):
                         return JsonResponse(location)
 
             except Exception as e:
-                print(f"Geocoding error: {str(e)}")
+                logger.warning("Geocoding error: %s", e)
 
         # Return default location if geocoding fails
         return JsonResponse({
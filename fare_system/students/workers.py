@@ -0,0 +1,155 @@
+"""Bounded pool of worker processes for face detection and encoding."""
+
+import asyncio
+import atexit
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+
+def _warm_up():
+    """Worker initializer; the face models are only imported in the workers."""
+    from . import faces
+
+    faces.warm_up()
+
+
+def _worker_pid():
+    """Identify the worker that ran this job, holding it long enough that
+    jobs queued together spread over the idle workers."""
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class PoolBusy(Exception):
+    """Raised when the face worker queue is full, a job timed out or a worker died."""
+
+
+class FaceWorkerPool:
+    """Runs ``students.faces`` functions on pre-warmed worker processes.
+
+    At most ``FACE_WORKER_QUEUE_SIZE`` jobs may be queued or running at once;
+    further submissions raise :class:`PoolBusy` immediately instead of waiting,
+    so callers can answer with a fast "busy, retry" response. If a worker
+    process dies (a crash in dlib, an OOM kill), the broken pool is dropped
+    and the next call starts a fresh one. With ``FACE_WORKER_PROCESSES = 0``
+    jobs run inline in the calling thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def _start(self):
+        with self._lock:
+            if self._executor is None:
+                self._slots = threading.BoundedSemaphore(settings.FACE_WORKER_QUEUE_SIZE)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.FACE_WORKER_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_up,
+                )
+                atexit.register(self.shutdown)
+        return self._executor
+
+    def _discard(self, executor):
+        """Drop ``executor`` after a worker died, unless it was already replaced."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn`` on a worker and return its future, or raise PoolBusy."""
+        return self._submit(fn, *args, **kwargs)[1]
+
+    def _submit(self, fn, *args, **kwargs):
+        executor = self._start()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise PoolBusy("Face worker queue is full.")
+
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            slots.release()
+            self._discard(executor)
+            raise PoolBusy("Face worker pool was broken; restarting it.")
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return executor, future
+
+    def run(self, fn, *args, **kwargs):
+        """Run ``fn`` on a worker and return its result, or raise PoolBusy."""
+        if not settings.FACE_WORKER_PROCESSES:
+            return fn(*args, **kwargs)
+
+        executor, future = self._submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=settings.FACE_WORKER_TIMEOUT)
+        except FutureTimeoutError:
+            raise PoolBusy("Face worker timed out.")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise PoolBusy("Face worker died; restarting the pool.")
+
+    async def arun(self, fn, *args, **kwargs):
+        """Awaitable :meth:`run` that does not hold a thread while waiting."""
+        if not settings.FACE_WORKER_PROCESSES:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(fn, *args, **kwargs)
+            )
+
+        executor, future = self._submit(fn, *args, **kwargs)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), settings.FACE_WORKER_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            raise PoolBusy("Face worker timed out.")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise PoolBusy("Face worker died; restarting the pool.")
+
+    def wait_until_warm(self, timeout):
+        """Block until every worker process has run its initializer.
+
+        A process only takes jobs once its initializer has loaded the face
+        models, but the executor may hand every job to the first process
+        that is ready. Short jobs are therefore submitted in rounds until
+        each of the ``FACE_WORKER_PROCESSES`` workers has answered with its
+        PID. Returns the PIDs; raises TimeoutError after ``timeout`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        pids = set()
+        while len(pids) < settings.FACE_WORKER_PROCESSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"Only {len(pids)} of {settings.FACE_WORKER_PROCESSES} face workers warmed up."
+                )
+            futures = [self.submit(_worker_pid) for _ in range(settings.FACE_WORKER_PROCESSES)]
+            try:
+                pids.update(future.result(timeout=remaining) for future in futures)
+            except FutureTimeoutError:
+                continue
+        return pids
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+face_pool = FaceWorkerPool()
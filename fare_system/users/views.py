@@ -4,6 +4,9 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.http import HttpResponse
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 def login_view(request):
@@ -14,23 +17,19 @@ def login_view(request):
 
         if user is not None:
             login(request, user)
-            print(f"User '{username}' logged in successfully.")
+            logger.info("User '%s' logged in successfully.", username)
 
             # Check user role and redirect accordingly
             if user.is_superuser:
-                print("Redirecting to admin dashboard")
                 return redirect("admin_dashboard")
             elif hasattr(user, "student_profile"):
-                print("Redirecting to student dashboard")
                 return redirect("student_dashboard")
             elif user.groups.filter(name="Drivers").exists():
-                print("Redirecting to bus dashboard")
                 return redirect("bus_dashboard")
             else:
-                print("Redirecting to home")
                 return redirect("home")
         else:
-            print(f"Failed login attempt for '{username}'")
+            logger.warning("Failed login attempt for '%s'", username)
             messages.error(request, "Invalid username or password. Please try again.")
 
     return render(request, "users/login.html")